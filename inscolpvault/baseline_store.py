@@ -0,0 +1,210 @@
+"""
+Local baseline store for pVault health check results
+Keeps every health check run (interactive, quick and non-interactive) in SQLite and compares a run against
+the same hour of the week in earlier weeks
+
+Usage:
+    python baseline_store.py                          # latest run vs its hour-of-week baseline
+    python baseline_store.py --run 42                 # a specific run
+    python baseline_store.py --metric blocked_sessions --days 14   # history of one metric
+"""
+
+import argparse
+import math
+import os
+import sqlite3
+from datetime import datetime, timedelta
+
+from sql_connection import STATE_DIR, open_state_db
+
+BASELINE_DB = os.path.join(STATE_DIR, "baseline.db")
+BASELINE_WEEKS = 8           # how far back the hour-of-week baseline looks
+MIN_BASELINE_SAMPLES = 3     # fewer earlier runs than this and a metric has no baseline yet
+DEVIATION_SIGMAS = 2.0       # flag values this many standard deviations from the baseline mean
+# save_run sources: sql_health_check.py, quick_health_check.py and run_sql_health_check.py
+RUN_SOURCES = ["health_check", "quick_check", "run_health_check"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    server TEXT NOT NULL,
+    database TEXT NOT NULL,
+    source TEXT NOT NULL,
+    taken_at TEXT NOT NULL,
+    hour_of_week INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS metrics (
+    run_id INTEGER NOT NULL REFERENCES runs(run_id),
+    server TEXT NOT NULL,
+    source TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    taken_at TEXT NOT NULL,
+    hour_of_week INTEGER NOT NULL,
+    value REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_metrics_time ON metrics (server, source, metric, taken_at);
+CREATE INDEX IF NOT EXISTS ix_metrics_hour ON metrics (server, source, metric, hour_of_week, taken_at);
+CREATE INDEX IF NOT EXISTS ix_metrics_run ON metrics (run_id);
+"""
+
+def hour_of_week(moment):
+    """0 = Monday 00:00-00:59 ... 167 = Sunday 23:00-23:59"""
+    return moment.weekday() * 24 + moment.hour
+
+class BaselineStore:
+    """Runs and their metrics; one row per (run, metric) with indexed lookups by metric and time"""
+
+    def __init__(self, path=BASELINE_DB):
+        self.path = path
+        self.db = open_state_db(path, SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def record_run(self, server, database, source, metrics, taken_at=None):
+        """Store one run's {metric: value}; returns its run_id"""
+        taken_at = taken_at or datetime.now()
+        stamp = taken_at.isoformat(timespec="seconds")
+        how = hour_of_week(taken_at)
+        with self.db:
+            cursor = self.db.execute(
+                "INSERT INTO runs (server, database, source, taken_at, hour_of_week) VALUES (?, ?, ?, ?, ?)",
+                (server, database, source, stamp, how))
+            run_id = cursor.lastrowid
+            self.db.executemany(
+                "INSERT INTO metrics (run_id, server, source, metric, taken_at, hour_of_week, value) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(run_id, server, source, metric, stamp, how, float(value))
+                 for metric, value in metrics.items() if value is not None])
+        return run_id
+
+    def run(self, run_id=None):
+        """A run row, or the latest run when run_id is None"""
+        if run_id is None:
+            return self.db.execute("SELECT * FROM runs ORDER BY run_id DESC LIMIT 1").fetchone()
+        return self.db.execute("SELECT * FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+
+    def run_metrics(self, run_id):
+        rows = self.db.execute("SELECT metric, value FROM metrics WHERE run_id = ? ORDER BY metric", (run_id,))
+        return {row["metric"]: row["value"] for row in rows}
+
+    def history(self, server, source, metric, since=None, until=None):
+        """(taken_at, value) for one metric of one kind of run, oldest first"""
+        since = (since or datetime.min).isoformat(timespec="seconds")
+        until = (until or datetime.max).isoformat(timespec="seconds")
+        rows = self.db.execute(
+            "SELECT taken_at, value FROM metrics WHERE server = ? AND source = ? AND metric = ? "
+            "AND taken_at >= ? AND taken_at <= ? ORDER BY taken_at",
+            (server, source, metric, since, until))
+        return [(row["taken_at"], row["value"]) for row in rows]
+
+    def baseline(self, server, source, metric, how, before, weeks=BASELINE_WEEKS):
+        """(count, mean, stdev, min, max) of a metric in hour-of-week how, over the weeks before a time.
+
+        Only runs of the same source count: a quick check and a full health
+        check measure some metrics differently.
+        """
+        since = (before - timedelta(weeks=weeks)).isoformat(timespec="seconds")
+        row = self.db.execute(
+            "SELECT COUNT(*) AS n, AVG(value) AS mean, AVG(value * value) AS square, "
+            "MIN(value) AS low, MAX(value) AS high FROM metrics "
+            "WHERE server = ? AND source = ? AND metric = ? AND hour_of_week = ? AND taken_at >= ? AND taken_at < ?",
+            (server, source, metric, how, since, before.isoformat(timespec="seconds"))).fetchone()
+        if not row["n"]:
+            return 0, None, None, None, None
+        stdev = math.sqrt(max(row["square"] - row["mean"] ** 2, 0.0))
+        return row["n"], row["mean"], stdev, row["low"], row["high"]
+
+    def compare(self, run_id):
+        """(metric, value, count, mean, stdev, low, high, flag) for every metric of a run"""
+        run = self.run(run_id)
+        taken_at = datetime.fromisoformat(run["taken_at"])
+        rows = []
+        for metric, value in self.run_metrics(run_id).items():
+            n, mean, stdev, low, high = self.baseline(run["server"], run["source"], metric,
+                                                   run["hour_of_week"], taken_at)
+            flag = ""
+            if n >= MIN_BASELINE_SAMPLES:
+                spread = max(stdev, 0.05 * abs(mean), 1e-9)
+                if abs(value - mean) > DEVIATION_SIGMAS * spread:
+                    flag = "HIGH" if value > mean else "LOW"
+            rows.append((metric, value, n, mean, stdev, low, high, flag))
+        return rows
+
+    def print_comparison(self, run_id):
+        """Each metric of a run next to its baseline for the same hour of the week"""
+        run = self.run(run_id)
+        taken_at = datetime.fromisoformat(run["taken_at"])
+        print("\n" + "="*60)
+        print("BASELINE COMPARISON")
+        print("="*60)
+        print(f"Run {run['run_id']} ({run['source']}) on {run['server']} at {run['taken_at']}")
+        print(f"Baseline: {taken_at.strftime('%A')}s {taken_at.hour:02d}:00-{taken_at.hour:02d}:59, "
+              f"last {BASELINE_WEEKS} weeks\n")
+
+        rows = self.compare(run_id)
+        width = max([len(r[0]) for r in rows] + [6])
+        print(f"{'Metric':<{width}}  {'Value':>12}  {'Baseline':>12}  {'Range':>23}  {'Runs':>4}")
+        flagged = 0
+        for metric, value, n, mean, stdev, low, high, flag in rows:
+            if n < MIN_BASELINE_SAMPLES:
+                print(f"{metric:<{width}}  {value:>12,.2f}  {'(no baseline)':>12}  {'':>23}  {n:>4}")
+                continue
+            marker = f"  ⚠ {flag}" if flag else ""
+            flagged += bool(flag)
+            print(f"{metric:<{width}}  {value:>12,.2f}  {mean:>12,.2f}  "
+                  f"{f'{low:,.2f} - {high:,.2f}':>23}  {n:>4}{marker}")
+        if flagged:
+            print(f"\n⚠ {flagged} metric(s) outside {DEVIATION_SIGMAS:g} standard deviations of the baseline")
+        else:
+            print("\n✓ No metric outside its usual range for this hour")
+
+def save_run(server, database, source, metrics, compare=False):
+    """Persist a run, optionally printing its comparison; never fails the calling check"""
+    try:
+        store = BaselineStore()
+        try:
+            run_id = store.record_run(server, database, source, metrics)
+            print(f"\n[INFO] Saved {len(metrics)} metrics as baseline run {run_id} ({store.path})")
+            if compare:
+                store.print_comparison(run_id)
+            return run_id
+        finally:
+            store.close()
+    except (sqlite3.Error, OSError) as e:
+        print(f"\n⚠ Could not save results to the baseline store: {e}")
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare health check runs against their hour-of-week baseline")
+    parser.add_argument("--run", type=int, help="run to compare (default: latest)")
+    parser.add_argument("--metric", help="print the history of one metric instead")
+    parser.add_argument("--server", help="server for --metric (default: server of the latest run)")
+    parser.add_argument("--source", choices=RUN_SOURCES,
+                        help="kind of run for --metric (default: that of the latest run)")
+    parser.add_argument("--days", type=int, default=30, help="history length for --metric")
+    parser.add_argument("--db", default=BASELINE_DB, help="baseline database file")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        print(f"No baseline store at {args.db} yet - run a health check first")
+        return
+    store = BaselineStore(args.db)
+    run = store.run(args.run)
+    if run is None:
+        print("No matching run in the baseline store")
+        return
+
+    if args.metric:
+        server = args.server or run["server"]
+        source = args.source or run["source"]
+        history = store.history(server, source, args.metric, since=datetime.now() - timedelta(days=args.days))
+        print(f"{args.metric} ({source}) on {server}, last {args.days} days ({len(history)} runs)")
+        for taken_at, value in history:
+            print(f"  {taken_at}  {value:,.2f}")
+    else:
+        store.print_comparison(run["run_id"])
+    store.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+"""
+Benchmark the pVault collector and analyzer hot paths
+Times run_all_checks, run_quick_checks, monitor_queries and analyze_log against synthetic
+workloads of increasing size (stand-in server, zero latency) and compares them to a stored baseline
+
+Usage: python benchmark.py [--profile quick|full] [--only BENCH] [--repeat N]
+                           [--baseline PATH] [--save-baseline] [--output PATH] [--threshold PCT]
+Exits 1 when a benchmark regressed against the baseline.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from tabulate import tabulate
+
+BENCHMARK_VERSION = 1
+REPEATS = 5
+REGRESSION_PCT = 25       # slower than the baseline median by more than this is a regression
+MIN_REGRESSION_SEC = 0.005  # ...and by at least this much, so timer noise on tiny runs is ignored
+BASELINE_FILE = "benchmark_baseline.json"
+
+# Workload sizes per benchmark; "full" is the complete 1k->1M / 100->10k / 10->5k ladder
+SIZES = {
+    "quick": {
+        "analyze_log": [1000, 10000, 100000],
+        "run_all_checks": [100, 1000],
+        "run_quick_checks": [10, 100, 1000],
+        "monitor_queries": [10, 100, 1000],
+    },
+    "full": {
+        "analyze_log": [1000, 10000, 100000, 1000000],
+        "run_all_checks": [100, 1000, 10000],
+        "run_quick_checks": [10, 100, 1000, 5000],
+        "monitor_queries": [10, 100, 1000, 5000],
+    },
+}
+
+# What the size of each benchmark counts
+UNITS = {
+    "analyze_log": "log rows",
+    "run_all_checks": "indexes",
+    "run_quick_checks": "requests",
+    "monitor_queries": "requests",
+}
+
+def _standin(**settings):
+    """A zero-latency synthetic instance of the given shape"""
+    from dmv_standin import StandinServer
+    return StandinServer(dict(settings, latency={"default": 0.0}, jitter=0.0))
+
+def _request_settings(requests):
+    """Stand-in shape for a number of concurrent requests, 5% of them blocked"""
+    return {"requests": requests, "blocked": max(requests // 20, 1)}
+
+def setup_run_all_checks(size, scratch):
+    """Every health check against an instance with size indexes (fragmentation cache warm)"""
+    from sql_health_check import SQLServerHealthCheck
+
+    server = _standin(indexes=size, tables=max(size // 20, 60))
+    health_check = SQLServerHealthCheck('benchmark', server.settings['database'], '', '')
+    health_check.factory.standin = server
+    health_check.sleep = lambda seconds: None  # the wait sample still runs, without waiting
+    return health_check.run_all_checks
+
+def setup_run_quick_checks(size, scratch):
+    """The quick checks against an instance with size concurrent requests"""
+    from quick_health_check import run_quick_checks
+
+    server = _standin(**_request_settings(size))
+    return lambda: run_quick_checks(server.connect(), save_baseline=False)
+
+def setup_monitor_queries(size, scratch):
+    """One monitor sample of size concurrent requests, fetched up front so only client-side work is timed"""
+    from monitor_query_performance import QueryMonitor, REQUESTS_QUERY
+    from perf_log import open_log_writer
+
+    server = _standin(**_request_settings(size))
+    connection = server.connect()
+    cursor = connection.cursor()
+    cursor.execute(REQUESTS_QUERY.sql)
+    queries = cursor.fetchall()
+    monitor = QueryMonitor('', '', 'benchmark')
+    monitor.log_writer = open_log_writer(os.path.join(scratch, f'monitor_{size}.csv'), 'csv')
+    return lambda: monitor.monitor_queries(connection, queries=queries)
+
+def write_synthetic_log(path, rows, seed=1):
+    """CSV performance log of rows samples: 200 sessions over 60 fingerprints, 5s apart"""
+    from perf_log import CsvLogWriter
+
+    rng = random.Random(seed)
+    fingerprints = [(f"{k:016x}", f"SELECT * FROM dbo.Table_{k:02d} WHERE ID = @p1", f"{k * 7919:016x}")
+                    for k in range(60)]
+    start = datetime(2025, 11, 12, 8, 0, 0)
+    writer = CsvLogWriter(path)
+    for i in range(rows):
+        fp, snippet, plan = fingerprints[int(rng.paretovariate(1.2)) % len(fingerprints)]
+        elapsed = rng.expovariate(1 / 4.0)
+        blocking = rng.randint(51, 250) if rng.random() < 0.05 else None
+        alert = f"TIMEOUT_RISK ({elapsed:.1f}s)" if elapsed > 20 else ""
+        if blocking:
+            alert += " BLOCKED"
+        writer.write_row([start + timedelta(seconds=5 * (i // 200)), 51 + i % 200, 'running', 'SELECT',
+                          elapsed, 'LCK_M_S' if blocking else 'PAGEIOLATCH_SH', blocking,
+                          'PaperlessEnvironments', snippet, alert, fp, plan, 5.0, 'benchmark'])
+    writer.close()
+
+def setup_analyze_log(size, scratch):
+    """Analysis of a CSV log of size samples"""
+    from monitor_query_performance import QueryMonitor
+
+    monitor = QueryMonitor('', '', 'benchmark')
+    monitor.log_path = os.path.join(scratch, f'log_{size}.csv')
+    write_synthetic_log(monitor.log_path, size)
+    return monitor.analyze_log
+
+BENCHMARKS = {
+    "run_all_checks": setup_run_all_checks,
+    "run_quick_checks": setup_run_quick_checks,
+    "monitor_queries": setup_monitor_queries,
+    "analyze_log": setup_analyze_log,
+}
+
+def measure(run, repeats):
+    """Seconds for each of repeats calls of run, after one warm-up call; script output is discarded"""
+    seconds = []
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        for attempt in range(repeats + 1):
+            output.seek(0)
+            output.truncate()
+            start = time.perf_counter()
+            run()
+            if attempt:
+                seconds.append(time.perf_counter() - start)
+    return seconds
+
+def run_benchmarks(profile, only=None, repeats=REPEATS, scratch=None):
+    """{"bench/size": result} for every benchmark and size of the profile"""
+    results = {}
+    for name, sizes in SIZES[profile].items():
+        if only and name not in only:
+            continue
+        for size in sizes:
+            with contextlib.redirect_stdout(io.StringIO()):
+                run = BENCHMARKS[name](size, scratch)
+            seconds = measure(run, repeats)
+            median = statistics.median(seconds)
+            results[f"{name}/{size}"] = {
+                "benchmark": name, "size": size, "unit": UNITS[name], "repeats": repeats,
+                "median_sec": round(median, 6), "min_sec": round(min(seconds), 6),
+                "max_sec": round(max(seconds), 6),
+                "per_sec": round(size / median, 1) if median else None,
+            }
+            print(f"[BENCH] {name:<17} {size:>9,} {UNITS[name]:<9} median {median * 1000:9.1f} ms "
+                  f"({size / median if median else 0:,.0f} {UNITS[name]}/s)")
+    return results
+
+def machine_info():
+    return {"machine": platform.node(), "platform": platform.platform(),
+            "python": platform.python_version(), "processor": platform.processor() or platform.machine()}
+
+def load_baseline(path):
+    """Saved benchmark results, or None"""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def save_results(path, results):
+    """Write results with machine details; atomic so an interrupted run keeps the old file"""
+    data = {"version": BENCHMARK_VERSION, "taken_at": datetime.now().isoformat(timespec="seconds"),
+            **machine_info(), "results": results}
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+
+def compare(results, baseline, threshold=REGRESSION_PCT):
+    """(rows, regressions) comparing median times with the baseline's"""
+    rows, regressions = [], []
+    for key, result in results.items():
+        base = baseline["results"].get(key)
+        if base is None:
+            rows.append([key, result["median_sec"], None, None, "new"])
+            continue
+        change = 100.0 * (result["median_sec"] - base["median_sec"]) / base["median_sec"] if base["median_sec"] else 0.0
+        regressed = change > threshold and result["median_sec"] - base["median_sec"] > MIN_REGRESSION_SEC
+        improved = change < -threshold and base["median_sec"] - result["median_sec"] > MIN_REGRESSION_SEC
+        status = "REGRESSED" if regressed else "faster" if improved else "ok"
+        rows.append([key, result["median_sec"], base["median_sec"], round(change, 1), status])
+        if regressed:
+            regressions.append(key)
+    return rows, regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the pVault collector and analyzer hot paths')
+    parser.add_argument('--profile', choices=sorted(SIZES), default='quick',
+                        help='workload sizes: quick (default) or full (up to 1M log rows, 10k indexes, 5k requests)')
+    parser.add_argument('--only', action='append', choices=sorted(BENCHMARKS), help='run only this benchmark (repeatable)')
+    parser.add_argument('--repeat', type=int, default=REPEATS, help='timed runs per size (after one warm-up)')
+    parser.add_argument('--baseline', default=BASELINE_FILE, help='baseline results file to compare with')
+    parser.add_argument('--save-baseline', action='store_true', help='store these results as the new baseline')
+    parser.add_argument('--output', help='also write these results to this JSON file')
+    parser.add_argument('--threshold', type=float, default=REGRESSION_PCT,
+                        help='percent slower than the baseline median that counts as a regression')
+    args = parser.parse_args()
+
+    # Benchmarks run against the stand-in and must not touch the real caches, baselines or recordings
+    scratch = tempfile.mkdtemp(prefix='pvault_bench_')
+    os.environ['PVAULT_STATE_DIR'] = scratch
+    os.environ.pop('PVAULT_RECORD', None)
+    os.environ.pop('PVAULT_STANDIN', None)
+
+    print(f"pVault benchmark ({args.profile} profile, {args.repeat} runs per size) on {platform.node()}, "
+          f"Python {platform.python_version()}")
+    results = run_benchmarks(args.profile, args.only, args.repeat, scratch)
+
+    if args.output:
+        save_results(args.output, results)
+        print(f"✓ Results written to {args.output}")
+
+    regressions = []
+    baseline = load_baseline(args.baseline)
+    if baseline is None:
+        if not args.save_baseline:
+            print(f"\n[INFO] No baseline at {args.baseline}; run with --save-baseline to store one")
+    else:
+        print(f"\nCompared with baseline from {baseline.get('taken_at')} on {baseline.get('machine')}:")
+        if baseline.get('machine') != platform.node() or baseline.get('python') != platform.python_version():
+            print("⚠ Baseline was taken on a different machine or Python version; differences may not be regressions")
+        rows, regressions = compare(results, baseline, args.threshold)
+        print(tabulate(rows, headers=['Benchmark', 'Median(s)', 'Baseline(s)', 'Change%', 'Status'], tablefmt='grid'))
+        if regressions:
+            print(f"⚠ {len(regressions)} regression(s) over {args.threshold:.0f}%: {', '.join(regressions)}")
+        else:
+            print("✓ No regressions")
+
+    if args.save_baseline:
+        if baseline is not None:
+            # Keep baseline entries for sizes this run skipped (--only, quick profile)
+            results = {**baseline["results"], **results}
+        save_results(args.baseline, results)
+        print(f"✓ Baseline saved to {args.baseline}")
+    elif regressions:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
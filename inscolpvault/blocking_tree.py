@@ -0,0 +1,145 @@
+"""
+Client-side blocking trees for pVault monitoring
+Builds full blocking trees from one sys.dm_exec_requests snapshot instead of a recursive CTE
+"""
+
+# Head blockers without a request row (idle sessions holding an open transaction)
+IDLE_SESSIONS_QUERY = """
+SELECT
+    s.session_id,
+    s.status,
+    s.login_name,
+    s.host_name,
+    s.program_name,
+    s.open_transaction_count,
+    DATEDIFF(SECOND, s.last_request_end_time, GETDATE()) AS IdleSec,
+    c.most_recent_sql_handle
+FROM sys.dm_exec_sessions s
+LEFT JOIN sys.dm_exec_connections c ON c.session_id = s.session_id
+WHERE s.session_id IN ({})
+"""
+
+class BlockingNode:
+    """One session in a blocking tree, with totals over everything it blocks"""
+
+    def __init__(self, session_id, blocked_by=0, wait_sec=0.0, wait_type="", status="", query=""):
+        self.session_id = session_id
+        self.blocked_by = blocked_by
+        self.wait_sec = wait_sec
+        self.wait_type = wait_type
+        self.status = status
+        self.query = query
+        self.has_request = True  # False for blockers missing from the request snapshot
+        self.session = None      # dm_exec_sessions row for idle blockers, once looked up
+        self.in_cycle = False    # head chosen to break a blocking cycle
+        self.children = []
+        self.depth = 0               # levels below this node
+        self.blocked_count = 0       # sessions blocked directly or indirectly
+        self.blocked_wait_sec = 0.0  # their summed wait time
+
+    @property
+    def fan_out(self):
+        return len(self.children)
+
+    def walk(self, level=0):
+        """(level, node) for this node and its descendants, depth first"""
+        stack = [(level, self)]
+        while stack:
+            level, node = stack.pop()
+            yield level, node
+            for child in sorted(node.children, key=lambda c: c.blocked_wait_sec + c.wait_sec):
+                stack.append((level + 1, child))
+
+def build_blocking_trees(requests):
+    """Head blocker nodes for a request snapshot, most blocked wait first.
+
+    requests are (session_id, blocking_session_id, wait_sec, wait_type,
+    status, query) tuples. Blockers that have no request of their own become
+    nodes with has_request False. A session reported as blocking itself
+    (parallel query waits) is not treated as blocked.
+    """
+    nodes = {}
+    for session_id, blocked_by, wait_sec, wait_type, status, query in requests:
+        blocked_by = blocked_by if blocked_by and blocked_by != session_id else 0
+        nodes[session_id] = BlockingNode(session_id, blocked_by, wait_sec or 0.0, wait_type or "",
+                                         status or "", query or "")
+
+    for node in list(nodes.values()):
+        if node.blocked_by and node.blocked_by not in nodes:
+            blocker = nodes[node.blocked_by] = BlockingNode(node.blocked_by)
+            blocker.has_request = False
+
+    for node in nodes.values():
+        if node.blocked_by:
+            nodes[node.blocked_by].children.append(node)
+
+    involved = {sid: node for sid, node in nodes.items() if node.blocked_by or node.children}
+    heads = [node for node in involved.values() if not node.blocked_by]
+
+    # Sessions not reachable from a head are in a cycle; cut each cycle at its lowest session_id
+    reached = set()
+    for head in heads:
+        reached.update(node.session_id for _, node in head.walk())
+    for session_id in sorted(involved):
+        if session_id in reached:
+            continue
+        cycle = []
+        node = involved[session_id]
+        while node.session_id not in cycle:
+            cycle.append(node.session_id)
+            node = nodes[node.blocked_by]
+        head = nodes[min(cycle[cycle.index(node.session_id):])]
+        nodes[head.blocked_by].children.remove(head)
+        head.in_cycle = True
+        heads.append(head)
+        reached.update(n.session_id for _, n in head.walk())
+
+    for head in heads:
+        _total(head)
+    return sorted(heads, key=lambda h: (h.blocked_wait_sec, h.blocked_count), reverse=True)
+
+def _total(head):
+    """Fill depth, blocked_count and blocked_wait_sec bottom-up (iterative)"""
+    order = [node for _, node in head.walk()]
+    for node in reversed(order):
+        node.depth = 1 + max((c.depth for c in node.children), default=-1)
+        node.blocked_count = sum(1 + c.blocked_count for c in node.children)
+        node.blocked_wait_sec = sum(c.wait_sec + c.blocked_wait_sec for c in node.children)
+
+def idle_blockers(heads):
+    """Head blockers with no request row, whose session details must be looked up"""
+    return [head for head in heads if not head.has_request]
+
+def print_blocking_trees(heads, prefix="", max_lines=40):
+    """Print each tree with head blocker, depth, fan-out and blocked wait"""
+    blocked = sum(h.blocked_count for h in heads)
+    total_wait = sum(h.blocked_wait_sec for h in heads)
+    print(f"\n⚠ {prefix}BLOCKING: {len(heads)} head blocker(s), {blocked} session(s) blocked, "
+          f"{total_wait:.1f}s total blocked wait")
+
+    lines = 0
+    for head in heads:
+        for level, node in head.walk():
+            if lines >= max_lines:
+                print("  ...")
+                return
+            lines += 1
+            if level == 0:
+                print(f"  Head {node.session_id} {_describe_head(node)}: blocks {node.blocked_count}, "
+                      f"depth {node.depth}, fan-out {node.fan_out}, {node.blocked_wait_sec:.1f}s blocked wait")
+            else:
+                detail = f", fan-out {node.fan_out}" if node.children else ""
+                print(f"  {'   ' * level}└ {node.session_id} {node.wait_type} {node.wait_sec:.1f}s{detail}")
+            if node.query and (level == 0 or node.children):
+                print(f"  {'   ' * level}  Query: {node.query[:80]}...")
+
+def _describe_head(node):
+    if node.in_cycle:
+        return "(blocking cycle)"
+    if node.has_request:
+        return f"({node.status})"
+    session = node.session
+    if session is None:
+        return "(no active request)"
+    return (f"(idle {session.IdleSec or 0}s, {session.open_transaction_count} open tran, "
+            f"{session.login_name} from {session.host_name} / {session.program_name})")
@@ -0,0 +1,274 @@
+"""
+Statement timeouts and a time budget for health check runs
+Each check gets a deadline (its own timeout, capped by what is left of the run budget); every
+statement it runs carries the time left as its query timeout, so the driver cancels it server-side.
+Checks that no longer fit are skipped and reported, cheap critical checks run first
+
+Used by sql_health_check.py and run_sql_health_check.py
+"""
+
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+from tabulate import tabulate
+
+RUN_BUDGET_SECONDS = 300   # whole run
+CHECK_TIMEOUT_SECONDS = 30  # per check unless listed below
+CHECK_TIMEOUTS = {
+    'check_wait_stats': 45,             # includes the wait stats sample
+    'check_table_fragmentation': 90,    # dm_db_index_physical_stats, bounded further by its scan budget
+    'check_statistics_age': 60,
+    'check_recent_errors': 20,          # sp_readerrorlog can hang on a large error log
+    'check_deadlocks': 45,              # reads the system_health files after the last read
+}
+MIN_CHECK_SECONDS = 1  # a check with less time left than this is skipped
+
+# Run order: what matters during an incident and costs little first, heavy scans last
+CHECK_PRIORITY = [
+    'check_blocking',
+    'check_long_running_queries',
+    'check_query_timeouts',
+    'check_server_info',
+    'check_database_status',
+    'check_performance_metrics',
+    'check_memory',
+    'check_wait_stats',
+    'check_disk_space',
+    'check_missing_indexes',
+    'check_large_tables',
+    'check_recent_errors',
+    'check_deadlocks',
+    'check_statistics_age',
+    'check_table_fragmentation',
+]
+
+TIMEOUT_STATES = ('HYT00', 'HYT01', 'HY008')  # query timeout, connection timeout, canceled
+
+class CheckTimeout(Exception):
+    """A check ran out of time; statements already run have printed their results"""
+
+def is_timeout(error):
+    return isinstance(error, CheckTimeout) or any(state in str(error) for state in TIMEOUT_STATES)
+
+class Deadline:
+    """Monotonic end time of one check"""
+
+    def __init__(self, seconds, clock=time.monotonic):
+        self.clock = clock
+        self.seconds = seconds
+        self.end = clock() + seconds
+
+    def remaining(self):
+        return self.end - self.clock()
+
+class _DeadlineCursor:
+    # pyodbc applies Connection.timeout to a cursor when it is created, so the underlying cursor is
+    # (re)created whenever the statement timeout it needs differs from the one it was created with
+    def __init__(self, connection, budget):
+        self.connection = connection
+        self.budget = budget
+        self.cursor = None
+        self.timeout = None
+
+    def _cursor(self, timeout):
+        if self.cursor is None or timeout != self.timeout:
+            if self.cursor is not None:
+                self.cursor.close()
+            self.connection.timeout = timeout
+            self.cursor = self.connection.cursor()
+            self.timeout = timeout
+        return self.cursor
+
+    def execute(self, sql, *params):
+        state = self.budget.state()
+        deadline = state.deadline if state else None
+        if deadline is None:
+            self._cursor(0).execute(sql, *params)
+            return self
+        remaining = deadline.remaining()
+        if remaining <= 0:
+            state.timeouts += 1
+            raise CheckTimeout(f"{deadline.seconds:.0f}s limit reached before the next statement")
+        # pyodbc statement timeout: whole seconds, 0 = none
+        cursor = self._cursor(max(int(math.ceil(remaining)), 1))
+        with self.budget.running(cursor):
+            try:
+                cursor.execute(sql, *params)
+            except Exception as e:
+                if is_timeout(e):
+                    state.timeouts += 1
+                    raise CheckTimeout(f"statement canceled at the {deadline.seconds:.0f}s limit")
+                raise
+        state.statements += 1
+        return self
+
+    def close(self):
+        if self.cursor is not None:
+            self.cursor.close()
+
+    def __iter__(self):
+        return iter(self.cursor.fetchall())
+
+    def __getattr__(self, name):
+        if self.cursor is None:
+            raise AttributeError(f"{name}: no statement executed on this cursor yet")
+        return getattr(self.cursor, name)
+
+class DeadlineConnection:
+    """Wraps a connection so statements run for a check get that check's remaining time as timeout"""
+
+    def __init__(self, connection, budget):
+        self.connection = connection
+        self.budget = budget
+
+    def cursor(self):
+        return _DeadlineCursor(self.connection, self.budget)
+
+    def close(self):
+        self.connection.close()
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+class _CheckState:
+    __slots__ = ("name", "deadline", "statements", "timeouts")
+
+    def __init__(self, name, deadline):
+        self.name = name
+        self.deadline = deadline
+        self.statements = 0
+        self.timeouts = 0
+
+class _CheckScope:
+    def __init__(self, budget, name):
+        self.budget = budget
+        self.name = name
+
+    def __enter__(self):
+        budget = self.budget
+        self.started = budget.clock()
+        self.state = _CheckState(self.name, budget.deadline(self.name))
+        budget.local.state = self.state
+        return self.state.deadline
+
+    def __exit__(self, kind, error, traceback):
+        budget, state = self.budget, self.state
+        budget.local.state = None
+        seconds = budget.clock() - self.started
+        if error is not None and not is_timeout(error):
+            budget.finish(self.name, 'failed', seconds, str(error))
+        elif error is not None or state.timeouts:
+            # Timeouts a check handled itself (e.g. the error log check) still leave it incomplete
+            status = 'partial' if state.statements else 'timed out'
+            detail = str(error) if error else f"{state.timeouts} statement(s) timed out"
+            budget.finish(self.name, status, seconds, detail)
+            print(f"\n[TIMEOUT] {self.name} {status} after {seconds:.1f}s: {detail}")
+        else:
+            budget.finish(self.name, 'ok', seconds)
+        return isinstance(error, CheckTimeout)
+
+class CheckBudget:
+    """Time budget of one health check run: check order, per-check deadlines and outcomes"""
+
+    def __init__(self, seconds=RUN_BUDGET_SECONDS, timeouts=None, default_timeout=CHECK_TIMEOUT_SECONDS,
+                 clock=time.monotonic):
+        self.seconds = seconds
+        self.timeouts = dict(CHECK_TIMEOUTS, **(timeouts or {}))
+        self.default_timeout = default_timeout
+        self.clock = clock
+        self.started = clock()
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.outcomes = {}  # check -> (status, seconds, detail)
+        self.in_flight = set()
+        self.timer = None
+
+    def order(self, checks):
+        """Checks in run order: by CHECK_PRIORITY, unknown checks last in their given order"""
+        rank = {name: i for i, name in enumerate(CHECK_PRIORITY)}
+        return sorted(checks, key=lambda name: rank.get(name, len(rank)))
+
+    def remaining(self):
+        return self.seconds - (self.clock() - self.started)
+
+    def deadline(self, name):
+        """Deadline for a check starting now: its timeout, capped by what is left of the run"""
+        return Deadline(min(self.timeouts.get(name, self.default_timeout), self.remaining()), self.clock)
+
+    def state(self):
+        return getattr(self.local, 'state', None)
+
+    def current_deadline(self):
+        """Deadline of the check running on this thread, or None"""
+        state = self.state()
+        return state.deadline if state else None
+
+    def check(self, name):
+        """Context manager running one check under its deadline; a CheckTimeout ends only that check"""
+        return _CheckScope(self, name)
+
+    def should_skip(self, name):
+        """True (and recorded) when the run budget has too little left to start a check"""
+        if self.remaining() >= MIN_CHECK_SECONDS:
+            return False
+        self.finish(name, 'skipped', 0.0, f"run budget of {self.seconds:.0f}s used up")
+        return True
+
+    def finish(self, name, status, seconds, detail=""):
+        with self.lock:
+            self.outcomes[name] = (status, seconds, detail)
+
+    def wrap(self, connection):
+        return DeadlineConnection(connection, self)
+
+    @contextmanager
+    def running(self, cursor):
+        """Register a statement in flight, so the budget timer can cancel it"""
+        with self.lock:
+            self.in_flight.add(cursor)
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.in_flight.discard(cursor)
+
+    def start_timer(self):
+        """Cancel whatever is still executing when the run budget runs out (statement timeouts are whole seconds)"""
+        self.timer = threading.Timer(max(self.remaining(), 0), self.cancel_all)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def stop_timer(self):
+        if self.timer is not None:
+            self.timer.cancel()
+
+    def cancel_all(self):
+        with self.lock:
+            cursors = list(self.in_flight)
+        for cursor in cursors:
+            try:
+                cursor.cancel()
+            except AttributeError:
+                raise  # a cursor wrapper without cancel(): the budget could never stop its statements
+            except Exception:
+                pass  # already finished, or the driver cannot cancel
+
+    def incomplete(self):
+        return {name: outcome for name, outcome in self.outcomes.items() if outcome[0] != 'ok'}
+
+    def print_summary(self):
+        """One line when every check completed, else a table of skipped, partial and failed checks"""
+        counts = {}
+        for status, _, _ in self.outcomes.values():
+            counts[status] = counts.get(status, 0) + 1
+        used = self.clock() - self.started
+        print(f"\n[INFO] {len(self.outcomes)} checks in {used:.1f}s of a {self.seconds:.0f}s budget: "
+              + ", ".join(f"{count} {status}" for status, count in sorted(counts.items())))
+        incomplete = self.incomplete()
+        if incomplete:
+            rows = [(name, status, round(seconds, 2), detail[:80])
+                    for name, (status, seconds, detail) in incomplete.items()]
+            print("[WARNING] Some checks did not complete; their sections above are missing or cut short")
+            print(tabulate(rows, headers=['Check', 'Status', 'Seconds', 'Reason'], tablefmt='grid'))
@@ -0,0 +1,259 @@
+"""
+Round-trip instrumentation for the health checks
+Records a span per check and per query (server time, fetch time, rows, bytes) and the time
+each check spends rendering its output, written as a Chrome/Perfetto trace and summarized as a table
+
+Enable with PVAULT_TRACE=trace.json (or SQLServerHealthCheck(..., trace='trace.json'));
+nothing is wrapped or timed when it is not set. Open the file in https://ui.perfetto.dev
+"""
+
+import json
+import os
+import threading
+import time
+from datetime import date, datetime
+from decimal import Decimal
+
+from tabulate import tabulate
+
+TRACE_FILE = os.environ.get("PVAULT_TRACE")
+SQL_LENGTH = 200  # statement text kept per query span
+SLOWEST_QUERIES = 5
+
+def value_bytes(value):
+    """Approximate wire size of one column value"""
+    if value is None:
+        return 0
+    if isinstance(value, str):
+        return 2 * len(value)  # nvarchar
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, (datetime, Decimal)):
+        return 9
+    if isinstance(value, date):
+        return 3
+    return 8
+
+def rows_bytes(rows):
+    return sum(value_bytes(value) for row in rows for value in row)
+
+class Span:
+    """One timed operation; query spans add server/fetch time, rows and bytes as they happen"""
+
+    __slots__ = ("name", "kind", "parent", "thread", "start", "end", "args", "children")
+
+    def __init__(self, name, kind, parent, start, **args):
+        self.name = name
+        self.kind = kind
+        self.parent = parent
+        self.thread = threading.get_ident()
+        self.start = start
+        self.end = None
+        self.args = args
+        self.children = []
+
+    @property
+    def seconds(self):
+        return (self.end if self.end is not None else self.start) - self.start
+
+    def total(self, kind, key):
+        """Sum of an argument over the child spans of one kind"""
+        return sum(child.args.get(key, 0) for child in self.children if child.kind == kind)
+
+class _CheckScope:
+    def __init__(self, tracer, name):
+        self.tracer = tracer
+        self.name = name
+
+    def __enter__(self):
+        tracer = self.tracer
+        self.span = tracer.start(self.name, "check", tracer.run)
+        tracer.local.check = self.span
+        return self.span
+
+    def __exit__(self, kind, error, traceback):
+        if error is not None:
+            self.span.args["error"] = str(error)
+        self.tracer.local.check = None
+        self.tracer.finish(self.span)
+        return False
+
+class _TracingCursor:
+    """pyodbc cursor proxy timing execute/nextset as server time and fetch* as fetch time"""
+
+    def __init__(self, cursor, tracer):
+        self.cursor = cursor
+        self.tracer = tracer
+        self.span = None
+
+    def _timed(self, key, call, *args):
+        start = time.perf_counter()
+        try:
+            return call(*args)
+        finally:
+            end = time.perf_counter()
+            self.span.args[key] += end - start
+            self.span.end = end
+
+    def execute(self, sql, *params):
+        self.span = self.tracer.query(sql)
+        try:
+            self._timed("server_sec", self.cursor.execute, sql, *params)
+        except Exception as e:
+            self.span.args["error"] = str(e)
+            raise
+        return self
+
+    def nextset(self):
+        self.span.args["sets"] += 1
+        return self._timed("server_sec", self.cursor.nextset)
+
+    def _fetched(self, rows):
+        self.span.args["rows"] += len(rows)
+        self.span.args["bytes"] += rows_bytes(rows)
+        return rows
+
+    def fetchall(self):
+        return self._fetched(self._timed("fetch_sec", self.cursor.fetchall))
+
+    def fetchmany(self, size=1):
+        return self._fetched(self._timed("fetch_sec", self.cursor.fetchmany, size))
+
+    def fetchone(self):
+        row = self._timed("fetch_sec", self.cursor.fetchone)
+        if row is not None:
+            self._fetched([row])
+        return row
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+class TracingConnection:
+    """Wraps a connection so the statements run on it become query spans of the current check"""
+
+    def __init__(self, connection, tracer):
+        self.connection = connection
+        self.tracer = tracer
+
+    def cursor(self):
+        return _TracingCursor(self.connection.cursor(), self.tracer)
+
+    def close(self):
+        self.connection.close()
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+class CheckTracer:
+    """Spans of one health check run; checks may run on several threads"""
+
+    def __init__(self, name, **args):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.origin = time.perf_counter()
+        self.started_at = datetime.now()
+        self.spans = []
+        self.run = self.start(name, "run", None, **args)
+
+    def start(self, name, kind, parent, **args):
+        span = Span(name, kind, parent, time.perf_counter(), **args)
+        with self.lock:
+            self.spans.append(span)
+            if parent is not None:
+                parent.children.append(span)
+        return span
+
+    def finish(self, span):
+        span.end = time.perf_counter()
+
+    def check(self, name):
+        """Context manager timing one check; queries on this thread are attributed to it"""
+        return _CheckScope(self, name)
+
+    def query(self, sql):
+        parent = getattr(self.local, "check", None) or self.run
+        span = self.start(" ".join(sql.split())[:SQL_LENGTH], "query", parent,
+                          server_sec=0.0, fetch_sec=0.0, rows=0, bytes=0, sets=1)
+        span.end = span.start
+        return span
+
+    def wrap(self, connection):
+        return TracingConnection(connection, self)
+
+    def traced_sleep(self, sleep):
+        """sleep() recorded as its own span, so waiting is not counted as render time"""
+        def traced(seconds):
+            parent = getattr(self.local, "check", None) or self.run
+            span = self.start(f"sleep {seconds}s", "sleep", parent)
+            try:
+                sleep(seconds)
+            finally:
+                self.finish(span)
+        return traced
+
+    def check_times(self, span):
+        """(server, fetch, sleep, render) seconds of a check; render is whatever the queries and sleeps don't cover"""
+        server = span.total("query", "server_sec")
+        fetch = span.total("query", "fetch_sec")
+        sleep = sum(child.seconds for child in span.children if child.kind == "sleep")
+        return server, fetch, sleep, max(span.seconds - server - fetch - sleep, 0.0)
+
+    def trace_events(self):
+        """Spans in Chrome trace event format (complete events, microseconds)"""
+        threads = {}
+        events = []
+        for span in self.spans:
+            args = dict(span.args)
+            if span.kind == "check":
+                server, fetch, sleep, render = self.check_times(span)
+                args.update(server_sec=server, fetch_sec=fetch, sleep_sec=sleep, render_sec=render,
+                            queries=sum(1 for c in span.children if c.kind == "query"))
+            events.append({"name": span.name, "cat": span.kind, "ph": "X", "pid": 1,
+                           "tid": threads.setdefault(span.thread, len(threads) + 1),
+                           "ts": round((span.start - self.origin) * 1e6, 1),
+                           "dur": round(span.seconds * 1e6, 1),
+                           "args": {k: round(v, 6) if isinstance(v, float) else v for k, v in args.items()}})
+        return events
+
+    def save(self, path):
+        """Write the trace atomically; returns the path"""
+        if self.run.end is None:
+            self.finish(self.run)
+        data = {"traceEvents": self.trace_events(), "displayTimeUnit": "ms",
+                "metadata": {"started": self.started_at.isoformat(timespec="seconds"), **self.run.args}}
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(data, f, default=str)
+        os.replace(tmp, path)
+        return path
+
+    def print_summary(self):
+        """Per-check breakdown of where the time went, plus the slowest queries"""
+        checks = [span for span in self.spans if span.kind == "check"]
+        if not checks:
+            return
+        print("\n" + "="*60)
+        print("CHECK TRACE (server / fetch / render)")
+        print("="*60)
+
+        rows = []
+        for span in sorted(checks, key=lambda s: s.seconds, reverse=True):
+            server, fetch, sleep, render = self.check_times(span)
+            rows.append([span.name, sum(1 for c in span.children if c.kind == "query"),
+                         round(server, 3), round(fetch, 3), round(render, 3), round(sleep, 3),
+                         round(span.seconds, 3), span.total("query", "rows"),
+                         round(span.total("query", "bytes") / 1024.0, 1)])
+        print(tabulate(rows, headers=['Check', 'Queries', 'Server(s)', 'Fetch(s)', 'Render(s)', 'Sleep(s)',
+                                      'Total(s)', 'Rows', 'KB'], tablefmt='grid'))
+
+        queries = sorted((span for span in self.spans if span.kind == "query"),
+                         key=lambda s: s.seconds, reverse=True)[:SLOWEST_QUERIES]
+        if queries:
+            print("\nSlowest queries:")
+            for span in queries:
+                print(f"  {span.seconds:7.3f}s  {span.parent.name}: {span.args['rows']} rows, "
+                      f"server {span.args['server_sec']:.3f}s, fetch {span.args['fetch_sec']:.3f}s  "
+                      f"{span.name[:80]}")
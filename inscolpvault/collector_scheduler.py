@@ -0,0 +1,184 @@
+"""
+Fixed-rate collector scheduler for pVault monitoring
+Each collector runs on its own worker thread and connection with its own period and deadline
+"""
+
+import sys
+import threading
+import time
+from datetime import datetime
+
+class _LineOutput:
+    """stdout proxy that writes whole lines, so collectors printing at once do not interleave"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def write(self, text):
+        pending = getattr(self.local, 'pending', '') + text
+        complete, newline, rest = pending.rpartition('\n')
+        self.local.pending = rest
+        if newline:
+            with self.lock:
+                self.stream.write(complete + newline)
+                self.stream.flush()
+        return len(text)
+
+    def flush(self):
+        with self.lock:
+            self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+class Collector:
+    """One periodic job with a fixed-rate schedule and latency accounting.
+
+    Deadlines are laid out on a grid (start + n * period) instead of sleeping
+    after the work, so a slow run does not shift later runs. When a run takes
+    longer than its period, the deadlines it overran are skipped rather than
+    run back to back. period may be a number or a callable returning the
+    current period in seconds, evaluated after every run. on_error, if
+    given, is called with the exception of every failed run, including
+    failures to connect.
+    """
+
+    def __init__(self, name, period, func, connect=None, delay=0.0, on_error=None):
+        self.name = name
+        self.period = period
+        self.func = func
+        self.connect = connect
+        self.delay = delay
+        self.on_error = on_error
+        self.connection = None
+        self.runs = 0
+        self.errors = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.last_latency = 0.0
+        self.max_latency = 0.0
+        self.total_latency = 0.0
+        self.max_lag = 0.0  # how late a run started relative to its deadline
+        self.last_error = None
+        self.failing = False  # whether the most recent run raised
+
+    def current_period(self):
+        return self.period() if callable(self.period) else self.period
+
+    def average_latency(self):
+        return self.total_latency / self.runs if self.runs else 0.0
+
+    def run_once(self):
+        """Run the job once, (re)opening its connection first when it has one"""
+        if self.connect is not None and self.connection is None:
+            self.connection = self.connect()
+        if self.connect is not None:
+            self.func(self.connection)
+        else:
+            self.func()
+
+    def close(self):
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+            self.connection = None
+
+    def loop(self, origin, stop):
+        deadline = origin + self.delay
+        try:
+            while not stop.is_set():
+                wait = deadline - time.monotonic()
+                if wait > 0 and stop.wait(wait):
+                    break
+
+                started = time.monotonic()
+                self.max_lag = max(self.max_lag, started - deadline)
+                try:
+                    self.run_once()
+                    if self.failing:
+                        print(f"[{datetime.now().strftime('%H:%M:%S')}] ✓ Collector {self.name} recovered")
+                    self.failing = False
+                except Exception as e:
+                    # Report the first failure of a streak, not every retry
+                    if not self.failing:
+                        print(f"[{datetime.now().strftime('%H:%M:%S')}] ⚠ Collector {self.name} failed: {e}")
+                    self.failing = True
+                    self.errors += 1
+                    self.last_error = str(e)
+                    # Drop the connection so the next run reconnects
+                    self.close()
+                    if self.on_error is not None:
+                        self.on_error(e)
+                finished = time.monotonic()
+
+                latency = finished - started
+                self.runs += 1
+                self.last_latency = latency
+                self.max_latency = max(self.max_latency, latency)
+                self.total_latency += latency
+
+                period = max(self.current_period(), 0.001)
+                missed = int((finished - deadline) // period)
+                if missed > 0:
+                    self.overruns += 1
+                    self.skipped += missed
+                deadline += (max(missed, 0) + 1) * period
+        finally:
+            self.close()
+
+class CollectorScheduler:
+    """Runs collectors concurrently on a shared clock"""
+
+    def __init__(self):
+        self.collectors = []
+        self.threads = []
+        self.stop_event = threading.Event()
+        self.origin = None
+        self.stdout = None
+
+    def add(self, name, period, func, connect=None, delay=0.0, on_error=None):
+        """Register func to run every period seconds; connect() supplies its own connection"""
+        collector = Collector(name, period, func, connect, delay, on_error)
+        self.collectors.append(collector)
+        return collector
+
+    def start(self):
+        self.stop_event.clear()
+        self.origin = time.monotonic()
+        self.stdout = sys.stdout
+        sys.stdout = _LineOutput(self.stdout)
+        for collector in self.collectors:
+            # Daemon threads, so a collector stuck in a query never blocks shutdown
+            thread = threading.Thread(target=collector.loop, args=(self.origin, self.stop_event),
+                                      name=f"collector-{collector.name}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def wait(self):
+        """Block until stop() is called or Ctrl+C"""
+        while not self.stop_event.wait(1.0):
+            pass
+
+    def stop(self, timeout=5.0):
+        self.stop_event.set()
+        deadline = time.monotonic() + timeout
+        for thread in self.threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        self.threads = [t for t in self.threads if t.is_alive()]
+        if self.stdout is not None:
+            sys.stdout = self.stdout
+            self.stdout = None
+
+    def print_report(self):
+        """Runs, skipped ticks and latency per collector"""
+        width = max([18] + [len(c.name) + 2 for c in self.collectors])
+        print("\n[Collector Schedule]")
+        print(f"  {'Collector':<{width}}{'Period':>8}{'Runs':>7}{'Overruns':>10}{'Skipped':>9}{'Errors':>8}"
+              f"{'Avg ms':>9}{'Max ms':>9}{'Max lag ms':>12}")
+        for c in self.collectors:
+            print(f"  {c.name:<{width}}{c.current_period():>7.1f}s{c.runs:>7}{c.overruns:>10}{c.skipped:>9}{c.errors:>8}"
+                  f"{1000 * c.average_latency():>9.0f}{1000 * c.max_latency:>9.0f}{1000 * c.max_lag:>12.0f}")
@@ -0,0 +1,345 @@
+"""
+Deadlock collector for pVault
+Reads xml_deadlock_report events from the built-in system_health event session after a
+timestamp bookmark, parses them with the streaming parser of xe_timeouts.py and fingerprints
+each deadlock by the objects locked and the statements taking part. Only counts per fingerprint
+(per hour, and per victim statement) are kept in a local SQLite file, not the graphs, so a day of
+thousands of identical deadlocks is a handful of rows
+
+Read on each run of sql_health_check.py and every DEADLOCK_SECONDS by monitor_query_performance.py;
+report from the local copy without connecting:
+    python deadlock_collector.py                          # top 10 deadlock shapes, last 24 hours
+    python deadlock_collector.py --hours 168 --top 5
+    python deadlock_collector.py --fingerprint 3f2a9c0e1b7d4a55
+"""
+
+import argparse
+import hashlib
+import os
+from collections import namedtuple
+from datetime import datetime, timedelta
+from xml.etree import ElementTree
+
+from tabulate import tabulate
+
+from query_fingerprint import normalize
+from sql_connection import STATE_DIR, open_state_db
+from xe_timeouts import BOOKMARK_FILE, XeSessionReader, XeUnavailable, _local_time, _message
+
+DEADLOCK_DB = os.path.join(STATE_DIR, "deadlocks.db")
+SESSION_NAME = "system_health"
+INITIAL_HOURS = 24        # deadlocks read on the first read of a server without a bookmark
+RETENTION_DAYS = 30
+STATEMENT_CHARS = 300     # normalized statement text kept per process
+LOCK_TIMEOUT_SECONDS = 120  # wait for another process's read of the same server to finish
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Targets of the running system_health session; event_file keeps days, ring_buffer minutes to hours
+TARGETS_QUERY = """
+SELECT t.target_name AS TargetName
+FROM sys.dm_xe_sessions s
+JOIN sys.dm_xe_session_targets t ON t.event_session_address = s.address
+WHERE s.name = ?
+"""
+
+# system_health captures far more than deadlocks: blank the other events on the server but keep
+# their rows, so the bookmark moves past them even when no deadlock was reported
+DEADLOCK_FILE_QUERY = """
+SELECT file_name, file_offset,
+    CASE WHEN object_name = N'xml_deadlock_report' THEN event_data END AS event_data
+FROM sys.fn_xe_file_target_read_file(?, NULL, ?, ?)
+"""
+
+DEADLOCK_RING_BUFFER_QUERY = """
+SELECT CAST(CAST(t.target_data AS xml).query(
+    '<events>{/RingBufferTarget/event[@name="xml_deadlock_report"]}</events>') AS nvarchar(max)) AS TargetData
+FROM sys.dm_xe_sessions s
+JOIN sys.dm_xe_session_targets t ON t.event_session_address = s.address
+WHERE s.name = ? AND t.target_name = 'ring_buffer'
+"""
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS fingerprints (
+    server TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    objects TEXT NOT NULL,
+    statements TEXT NOT NULL,
+    databases TEXT,
+    first_seen TEXT NOT NULL,
+    last_seen TEXT NOT NULL,
+    deadlocks INTEGER NOT NULL,
+    PRIMARY KEY (server, fingerprint)
+);
+CREATE TABLE IF NOT EXISTS hourly (
+    server TEXT NOT NULL,
+    hour TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    deadlocks INTEGER NOT NULL,
+    PRIMARY KEY (server, hour, fingerprint)
+);
+CREATE TABLE IF NOT EXISTS victims (
+    server TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    victim TEXT NOT NULL,
+    deadlocks INTEGER NOT NULL,
+    PRIMARY KEY (server, fingerprint, victim)
+);
+"""
+
+# objects: "<lock type> <object> (<index>)" per resource; statements: "<procedure>: <statement>" or the
+# normalized statement per process; both sorted, so the order processes are listed in does not matter
+Deadlock = namedtuple('Deadlock', [
+    'timestamp', 'fingerprint', 'objects', 'statements', 'victims', 'databases', 'client_hosts'
+])
+
+def _resource(element):
+    name = element.get("objectname") or element.get("associatedObjectId") or ""
+    index = element.get("indexname")
+    return " ".join(part for part in (element.tag, name, f"({index})" if index else "") if part)
+
+def _statement(process):
+    """What one process was running: the top frame of its stack, else its input buffer"""
+    frame = process.find("executionStack/frame")
+    procedure = frame.get("procname") if frame is not None else None
+    text = (frame.text or "").strip() if frame is not None else ""
+    if not text:
+        text = (process.findtext("inputbuf") or "").strip()
+    statement = normalize(text)[:STATEMENT_CHARS]
+    if procedure and procedure not in ("adhoc", "unknown"):
+        return f"{procedure}: {statement}" if statement else procedure
+    return statement or "(no statement text)"
+
+def _graph(event):
+    graph = next(event.iter("deadlock"), None)
+    if graph is None:
+        # Before SQL Server 2012 the report was XML escaped as text
+        text = event.findtext("data/value") or ""
+        if "<deadlock" in text:
+            graph = next(ElementTree.fromstring(text).iter("deadlock"), None)
+    return graph
+
+def fingerprint_deadlock(objects, statements):
+    """Stable 16-hex-digit hash of a deadlock's sorted objects and statements"""
+    text = "\n".join(objects) + "\n\n" + "\n".join(statements)
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=8).hexdigest()
+
+def parse_deadlock_event(element):
+    """Deadlock from one xml_deadlock_report <event> element; None for other events"""
+    if element.get("name") != "xml_deadlock_report":
+        return None
+    graph = _graph(element)
+    if graph is None:
+        return None
+    victim_ids = {v.get("id") for v in graph.iter("victimProcess")}
+    processes = graph.findall("process-list/process")
+    statements = {p.get("id"): _statement(p) for p in processes}
+    resources = graph.find("resource-list")
+    objects = tuple(sorted({_resource(r) for r in resources})) if resources is not None else ()
+    ordered = tuple(sorted(statements.values()))
+    return Deadlock(
+        timestamp=_local_time(element.get("timestamp")),
+        fingerprint=fingerprint_deadlock(objects, ordered),
+        objects=objects,
+        statements=ordered,
+        victims=tuple(sorted(statements[i] for i in victim_ids if i in statements)),
+        databases=tuple(sorted({p.get("currentdbname") for p in processes if p.get("currentdbname")})),
+        client_hosts=tuple(sorted({p.get("hostname") for p in processes if p.get("hostname")})))
+
+class SystemHealthReader(XeSessionReader):
+    """Incremental reader of the deadlock reports of one server's system_health session"""
+
+    session = SESSION_NAME
+    read_file_query = DEADLOCK_FILE_QUERY
+    ring_buffer_query = DEADLOCK_RING_BUFFER_QUERY
+    initial_minutes = INITIAL_HOURS * 60
+    parse = staticmethod(parse_deadlock_event)
+
+    def __init__(self, server, bookmark_file=BOOKMARK_FILE):
+        super().__init__(server, None, bookmark_file)
+
+    def ensure_target(self, conn):
+        """Read the event file when system_health has one, else its ring buffer; raises XeUnavailable"""
+        cursor = conn.cursor()
+        try:
+            cursor.execute(TARGETS_QUERY, SESSION_NAME)
+            targets = {row.TargetName for row in cursor.fetchall()}
+        except Exception as e:
+            raise XeUnavailable(f"cannot read event sessions (needs VIEW SERVER STATE): {_message(e)}")
+        if not targets:
+            raise XeUnavailable(f"the {SESSION_NAME} event session is not running")
+        self.target = "event_file" if "event_file" in targets else "ring_buffer" if "ring_buffer" in targets else None
+        if self.target is None:
+            raise XeUnavailable(f"the {SESSION_NAME} event session has no event_file or ring_buffer target")
+        self.ready = True
+
+    def read(self, conn):
+        if not self.ready:
+            self.ensure_target(conn)
+        return super().read(conn)
+
+def _timestamp(value):
+    return value.strftime(TIMESTAMP_FORMAT)
+
+class DeadlockCollector:
+    """Deadlock counts per fingerprint of one server; not thread-safe, collect from one thread"""
+
+    def __init__(self, server, path=DEADLOCK_DB, bookmark_file=BOOKMARK_FILE):
+        self.server = server.lower()
+        self.path = path
+        self.reader = SystemHealthReader(server, bookmark_file)
+        self.db = open_state_db(path, SCHEMA, timeout=LOCK_TIMEOUT_SECONDS)
+
+    def close(self):
+        self.db.close()
+
+    def collect(self, conn):
+        """Deadlocks reported since the previous read, oldest first, counted in the local copy"""
+        # The monitor and health checks share the bookmark and this file: holding the write lock
+        # from reading the bookmark to storing the counts keeps two processes from counting a report twice
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            deadlocks = self.reader.read(conn)
+            if deadlocks:
+                self._store(deadlocks)
+        except BaseException:
+            self.db.rollback()
+            raise
+        self.db.commit()
+        return deadlocks
+
+    def _store(self, deadlocks):
+        shapes, hours, victims = {}, {}, {}
+        for d in deadlocks:
+            seen = shapes.setdefault(d.fingerprint, [d, d.timestamp, d.timestamp, 0])
+            seen[1], seen[2] = min(seen[1], d.timestamp), max(seen[2], d.timestamp)
+            seen[3] += 1
+            hour = d.timestamp.strftime("%Y-%m-%d %H")
+            hours[(hour, d.fingerprint)] = hours.get((hour, d.fingerprint), 0) + 1
+            for victim in d.victims:
+                victims[(d.fingerprint, victim)] = victims.get((d.fingerprint, victim), 0) + 1
+        self.db.executemany("""
+            INSERT INTO fingerprints (server, fingerprint, objects, statements, databases,
+                first_seen, last_seen, deadlocks)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (server, fingerprint) DO UPDATE SET
+                first_seen = MIN(first_seen, excluded.first_seen),
+                last_seen = MAX(last_seen, excluded.last_seen),
+                deadlocks = deadlocks + excluded.deadlocks
+        """, [(self.server, key, "\n".join(d.objects), "\n".join(d.statements), ", ".join(d.databases),
+               _timestamp(first), _timestamp(last), count) for key, (d, first, last, count) in shapes.items()])
+        self.db.executemany("""
+            INSERT INTO hourly (server, hour, fingerprint, deadlocks) VALUES (?, ?, ?, ?)
+            ON CONFLICT (server, hour, fingerprint) DO UPDATE SET deadlocks = deadlocks + excluded.deadlocks
+        """, [(self.server, hour, key, count) for (hour, key), count in hours.items()])
+        self.db.executemany("""
+            INSERT INTO victims (server, fingerprint, victim, deadlocks) VALUES (?, ?, ?, ?)
+            ON CONFLICT (server, fingerprint, victim) DO UPDATE SET deadlocks = deadlocks + excluded.deadlocks
+        """, [(self.server, key, victim, count) for (key, victim), count in victims.items()])
+        cutoff = datetime.now() - timedelta(days=RETENTION_DAYS)
+        self.db.execute("DELETE FROM hourly WHERE server = ? AND hour < ?",
+                        (self.server, cutoff.strftime("%Y-%m-%d %H")))
+        self.db.execute("DELETE FROM fingerprints WHERE server = ? AND last_seen < ?",
+                        (self.server, _timestamp(cutoff)))
+        self.db.execute("DELETE FROM victims WHERE server = ? AND fingerprint NOT IN "
+                        "(SELECT fingerprint FROM fingerprints WHERE server = ?)", (self.server, self.server))
+
+    def top(self, hours=24, n=10):
+        """Deadlock fingerprints with the most deadlocks in the last hours"""
+        since = (datetime.now() - timedelta(hours=hours)).strftime("%Y-%m-%d %H")
+        return self.db.execute("""
+            SELECT f.fingerprint, f.objects, f.statements, f.databases, f.first_seen, f.last_seen,
+                f.deadlocks AS total, SUM(h.deadlocks) AS deadlocks, COUNT(*) AS hours,
+                (SELECT v.victim FROM victims v WHERE v.server = f.server AND v.fingerprint = f.fingerprint
+                 ORDER BY v.deadlocks DESC LIMIT 1) AS victim
+            FROM hourly h
+            JOIN fingerprints f ON f.server = h.server AND f.fingerprint = h.fingerprint
+            WHERE h.server = ? AND h.hour >= ?
+            GROUP BY f.fingerprint
+            ORDER BY deadlocks DESC
+            LIMIT ?
+        """, (self.server, since, n)).fetchall()
+
+    def print_report(self, hours=24, n=10):
+        """Most frequent deadlock shapes of the last hours"""
+        rows = self.top(hours, n)
+        if not rows:
+            print(f"✓ No deadlocks recorded in the last {hours} hours (local copy: {self.path})")
+            return 0
+        since = (datetime.now() - timedelta(hours=hours)).strftime("%Y-%m-%d %H")
+        total, shapes = self.db.execute(
+            "SELECT SUM(deadlocks), COUNT(DISTINCT fingerprint) FROM hourly WHERE server = ? AND hour >= ?",
+            (self.server, since)).fetchone()
+        print(f"\n[Deadlocks - last {hours} hours: {total} deadlocks, {shapes} distinct shapes]")
+        print(tabulate(
+            [[r["fingerprint"], r["deadlocks"], r["last_seen"][5:16], _cell(r["objects"], r["databases"]),
+              _cell(r["statements"], r["databases"]), _cell(r["victim"] or "", r["databases"])] for r in rows],
+            headers=['Fingerprint', 'Deadlocks', 'Last Seen', 'Objects', 'Statements', 'Usual Victim'],
+            tablefmt='grid'))
+        return total
+
+    def print_fingerprint(self, key):
+        """Everything kept of one deadlock shape"""
+        row = self.db.execute("SELECT * FROM fingerprints WHERE server = ? AND fingerprint = ?",
+                              (self.server, key)).fetchone()
+        if row is None:
+            print(f"No deadlock with fingerprint {key} recorded for {self.server}")
+            return
+        print(f"\n[Deadlock {key}: {row['deadlocks']} since {row['first_seen']}, last {row['last_seen']}]")
+        print(f"Databases: {row['databases'] or 'unknown'}")
+        print("Objects:")
+        for line in row["objects"].splitlines():
+            print(f"  {line}")
+        print("Statements:")
+        for line in row["statements"].splitlines():
+            print(f"  {line}")
+        victims = self.db.execute("SELECT victim, deadlocks FROM victims WHERE server = ? AND fingerprint = ? "
+                                  "ORDER BY deadlocks DESC", (self.server, key)).fetchall()
+        if victims:
+            print(tabulate([[v["deadlocks"], v["victim"][:100]] for v in victims],
+                           headers=['Chosen As Victim', 'Statement'], tablefmt='grid'))
+        hourly = self.db.execute("SELECT hour, deadlocks FROM hourly WHERE server = ? AND fingerprint = ? "
+                                 "ORDER BY hour", (self.server, key)).fetchall()
+        print(tabulate([[h["hour"] + ":00", h["deadlocks"]] for h in hourly],
+                       headers=['Hour', 'Deadlocks'], tablefmt='grid'))
+
+def _cell(text, databases=None, width=40, lines=3):
+    """Table cell of at most a few lines, each cut to width; names lose their database prefix"""
+    for database in (databases or "").split(", "):
+        if database:
+            text = text.replace(f"{database}.", "")
+    parts = text.splitlines()
+    cell = [line[:width] for line in parts[:lines]]
+    if len(parts) > lines:
+        cell.append(f"... {len(parts) - lines} more")
+    return "\n".join(cell)
+
+def print_deadlocks(deadlocks, prefix=""):
+    """Deadlocks of one read, one line per fingerprint"""
+    shapes = {}
+    for d in deadlocks:
+        shapes.setdefault(d.fingerprint, []).append(d)
+    for key, group in sorted(shapes.items(), key=lambda item: len(item[1]), reverse=True):
+        last = group[-1]
+        print(f"[{last.timestamp.strftime('%H:%M:%S')}] ⚠ {prefix}Deadlock {key} x{len(group)} on "
+              f"{', '.join(last.objects) or 'unknown objects'}")
+        for statement in last.statements:
+            print(f"  {'Victim' if statement in last.victims else 'Winner'}: {statement[:100]}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Report collected deadlocks from the local copy')
+    parser.add_argument('--server', default='inscolpvault.insulationsinc.local', help='server the deadlocks were read from')
+    parser.add_argument('--hours', type=int, default=24, help='how far back to report (default: 24)')
+    parser.add_argument('--top', type=int, default=10, help='deadlock shapes to show (default: 10)')
+    parser.add_argument('--fingerprint', help='show everything kept of one deadlock shape')
+    parser.add_argument('--db', default=DEADLOCK_DB, help='local copy file')
+    args = parser.parse_args()
+
+    collector = DeadlockCollector(args.server, args.db)
+    if args.fingerprint:
+        collector.print_fingerprint(args.fingerprint)
+    else:
+        collector.print_report(args.hours, args.top)
+    collector.close()
+
+if __name__ == "__main__":
+    main()
@@ -3,9 +3,12 @@ Invoice Timeout Diagnostic Script for pVault
 Specifically diagnoses the LoadInvoicesByStatusID timeout issue
 """
 
-import pyodbc
 import sys
 from datetime import datetime
+from sql_connection import ConnectionFactory, ConnectionFailed
+from fragmentation_cache import FragmentationCache, describe
+from query_store import QueryStoreCollector, QueryStoreUnavailable
+from plan_cache_sampler import PlanCacheSampler, print_sample
 
 # Connection parameters
 SERVER = "inscolpvault.insulationsinc.local"
@@ -14,27 +17,14 @@ DATABASE = "PaperlessEnvironments"
 
 def connect_to_sql(username, password):
     """Establish SQL Server connection"""
-    drivers = ["ODBC Driver 18 for SQL Server", "ODBC Driver 17 for SQL Server"]
-
-    for driver in drivers:
-        try:
-            connection_string = (
-                f"DRIVER={{{driver}}};"
-                f"SERVER={SERVER},{PORT};"
-                f"DATABASE={DATABASE};"
-                f"UID={username};"
-                f"PWD={password};"
-                f"TrustServerCertificate=yes;"
-                f"Encrypt=yes;"
-            )
-            conn = pyodbc.connect(connection_string, timeout=30)
-            print(f"✓ Connected using {driver}")
-            return conn
-        except:
-            continue
-
-    print("✗ Failed to connect")
-    sys.exit(1)
+    factory = ConnectionFactory(SERVER, PORT, DATABASE, username, password, timeout=30)
+    try:
+        conn = factory.connect()
+        print(f"✓ Connected using {factory.strategy['name']}")
+        return conn
+    except ConnectionFailed:
+        print("✗ Failed to connect")
+        sys.exit(1)
 
 def diagnose_invoice_tables(conn):
     """Analyze invoice-related tables"""
@@ -83,6 +73,8 @@ def check_invoice_indexes(conn):
     print("\n[2. Existing Indexes on Invoice Tables]")
     cursor.execute("""
     SELECT
+        i.object_id,
+        i.index_id,
         t.name AS TableName,
         i.name AS IndexName,
         i.type_desc AS IndexType,
@@ -94,18 +86,21 @@ def check_invoice_indexes(conn):
             ORDER BY ic.key_ordinal
             FOR XML PATH('')
         ), 1, 2, '') AS IndexColumns,
-        ps.avg_fragmentation_in_percent AS Fragmentation,
         i.is_disabled AS IsDisabled
     FROM sys.tables t
     INNER JOIN sys.indexes i ON t.object_id = i.object_id
-    LEFT JOIN sys.dm_db_index_physical_stats(DB_ID(), NULL, NULL, NULL, 'LIMITED') ps
-        ON i.object_id = ps.object_id AND i.index_id = ps.index_id
     WHERE (t.name LIKE '%invoice%' OR t.name LIKE '%status%')
         AND i.name IS NOT NULL
     ORDER BY t.name, i.index_id
     """)
 
     indexes = cursor.fetchall()
+
+    # Fragmentation comes from the local cache; only changed indexes are rescanned
+    cache = FragmentationCache(conn, SERVER, DATABASE)
+    fragmentation = {(f.object_id, f.index_id): f for f in cache.refresh(['%invoice%', '%status%'])}
+    cache.print_summary(fragmentation.values())
+
     if indexes:
         current_table = ""
         for idx in indexes:
@@ -115,8 +110,9 @@ def check_invoice_indexes(conn):
 
             print(f"  • {idx.IndexName} ({idx.IndexType})")
             print(f"    Columns: {idx.IndexColumns}")
-            if idx.Fragmentation and idx.Fragmentation > 30:
-                print(f"    ⚠ FRAGMENTED: {idx.Fragmentation:.1f}%")
+            frag = fragmentation.get((idx.object_id, idx.index_id))
+            if frag and frag.fragmentation and frag.fragmentation > 30:
+                print(f"    ⚠ FRAGMENTED: {frag.fragmentation:.1f}% {describe(frag)}")
             if idx.IsDisabled:
                 print(f"    ⚠ DISABLED INDEX!")
 
@@ -220,6 +216,36 @@ def analyze_invoice_queries(conn):
 
             print(f"Query: {str(q.QueryText)[:200]}...")
 
+def analyze_plan_cache_deltas(conn):
+    """What the top plans cost since the previous run, instead of over each plan's lifetime"""
+    print("\n" + "="*60)
+    print("PLAN CACHE SINCE LAST RUN")
+    print("="*60)
+
+    # The totals above are cumulative since each plan was cached; this run's sample minus the last
+    sampler = PlanCacheSampler(SERVER)
+    sample = sampler.sample(conn)
+    print_sample(sample, by="elapsed", title="All queries since the last run")
+    if sample.seconds is not None:
+        print(f"  Per-hour history: python plan_cache_sampler.py --by elapsed")
+    sampler.close()
+
+def analyze_query_store(conn):
+    """Invoice procedure history from Query Store, including plans since evicted from the cache"""
+    print("\n" + "="*60)
+    print("QUERY STORE HISTORY")
+    print("="*60)
+
+    # Only intervals since the last run are fetched; earlier ones come from the local copy
+    collector = QueryStoreCollector(SERVER, DATABASE)
+    try:
+        collector.collect(conn)
+    except QueryStoreUnavailable as e:
+        print(f"ℹ {e}; the plan cache figures above miss plans evicted since they ran")
+        print(f"  To enable: ALTER DATABASE [{DATABASE}] SET QUERY_STORE = ON (OPERATION_MODE = READ_WRITE);")
+    collector.print_report()
+    collector.close()
+
 def check_invoice_statistics(conn):
     """Check statistics on invoice tables"""
     print("\n" + "="*60)
@@ -322,6 +348,18 @@ def generate_fix_script(conn):
     print("// In your data access layer:")
     print("command.CommandTimeout = 60; // 60 seconds instead of default 30")
 
+def run_diagnostics(conn):
+    """Run all diagnostics in report order"""
+    diagnose_invoice_tables(conn)
+    check_invoice_indexes(conn)
+    check_missing_invoice_indexes(conn)
+    analyze_invoice_queries(conn)
+    analyze_plan_cache_deltas(conn)
+    analyze_query_store(conn)
+    check_invoice_statistics(conn)
+    check_current_invoice_queries(conn)
+    generate_fix_script(conn)
+
 def main():
     print("="*60)
     print("PVAULT INVOICE TIMEOUT DIAGNOSTIC")
@@ -335,15 +373,7 @@ def main():
 
     try:
         conn = connect_to_sql(username, password)
-
-        # Run all diagnostics
-        diagnose_invoice_tables(conn)
-        check_invoice_indexes(conn)
-        check_missing_invoice_indexes(conn)
-        analyze_invoice_queries(conn)
-        check_invoice_statistics(conn)
-        check_current_invoice_queries(conn)
-        generate_fix_script(conn)
+        run_diagnostics(conn)
 
         print("\n" + "="*60)
         print("DIAGNOSTIC SUMMARY")
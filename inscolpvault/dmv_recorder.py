@@ -0,0 +1,326 @@
+"""
+Record and replay raw DMV result sets for pVault scripts
+Recording wraps a pyodbc connection and writes every statement with its result sets to a
+gzip'd JSON-lines file; replay serves those result sets back through a pyodbc-style connection
+
+Record: set PVAULT_RECORD=incident.dmv.gz before running any script (see sql_connection.py)
+Replay: python dmv_replay.py incident.dmv.gz
+"""
+
+import atexit
+import gzip
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from datetime import date, datetime
+from decimal import Decimal
+
+from dmv_snapshot import record_type
+
+RECORDING_VERSION = 1
+FLUSH_RECORDS = 50  # executions between flushes, so a killed process loses little
+
+class ReplayError(Exception):
+    """A recorded statement failed, or the replay has no recording for a statement"""
+
+def _encode(value):
+    """JSON form of the non-JSON types pyodbc returns"""
+    if isinstance(value, (bytes, bytearray)):
+        return {"b": bytes(value).hex()}
+    if isinstance(value, datetime):
+        return {"t": value.isoformat()}
+    if isinstance(value, date):
+        return {"d": value.isoformat()}
+    if isinstance(value, Decimal):
+        return {"n": str(value)}
+    raise TypeError(f"Cannot record {type(value).__name__} values")
+
+def _decode(obj):
+    if len(obj) == 1:
+        (tag, text), = obj.items()
+        if tag == "b":
+            return bytes.fromhex(text)
+        if tag == "t":
+            return datetime.fromisoformat(text)
+        if tag == "d":
+            return date.fromisoformat(text)
+        if tag == "n":
+            return Decimal(text)
+    return obj
+
+def normalize_sql(sql):
+    """Statement text with whitespace collapsed"""
+    return " ".join(sql.split())
+
+def execution_key(sql, params):
+    """What recorded executions are matched on: statement text and parameter values"""
+    return normalize_sql(sql), json.dumps(list(params), default=_encode)
+
+class BufferedCursor:
+    """pyodbc-style cursor over result sets that are already in memory"""
+
+    record_name = 'replay'  # namedtuple type of the rows (see dmv_snapshot.record_type)
+
+    def __init__(self):
+        self.sets = deque()
+        self.rows = deque()
+        self.description = None
+
+    def _load(self, sets):
+        self.sets = deque(sets)
+        self._next()
+
+    def _next(self):
+        if not self.sets:
+            self.rows = deque()
+            self.description = None
+            return False
+        columns, rows = self.sets.popleft()
+        record = record_type(self.record_name, tuple(columns))
+        self.description = [(c, None, None, None, None, None, True) for c in columns]
+        self.rows = deque(record._make(row) for row in rows)
+        return True
+
+    def nextset(self):
+        return self._next()
+
+    def fetchone(self):
+        return self.rows.popleft() if self.rows else None
+
+    def fetchmany(self, size=1):
+        return [self.rows.popleft() for _ in range(min(size, len(self.rows)))]
+
+    def fetchall(self):
+        rows, self.rows = list(self.rows), deque()
+        return rows
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def close(self):
+        self.sets = deque()
+        self.rows = deque()
+
+class _RecordingCursor(BufferedCursor):
+    def __init__(self, cursor, recorder, connection_id):
+        super().__init__()
+        self.cursor = cursor
+        self.recorder = recorder
+        self.connection_id = connection_id
+
+    def execute(self, sql, *params):
+        """Run on the real cursor, then read every result set up front and record them"""
+        started = time.monotonic()
+        try:
+            self.cursor.execute(sql, *params)
+            sets = []
+            while True:
+                if self.cursor.description is not None:
+                    columns = [column[0] for column in self.cursor.description]
+                    sets.append((columns, [list(row) for row in self.cursor.fetchall()]))
+                if not self.cursor.nextset():
+                    break
+        except Exception as e:
+            self.recorder.record(self.connection_id, sql, params, started, error=e)
+            raise
+        self.recorder.record(self.connection_id, sql, params, started, sets=sets)
+        self._load(sets)
+        return self
+
+    def cancel(self):
+        self.cursor.cancel()
+
+    def close(self):
+        super().close()
+        self.cursor.close()
+
+class RecordingConnection:
+    """Wraps a pyodbc connection so every statement run on it is recorded"""
+
+    def __init__(self, connection, recorder, connection_id):
+        self.connection = connection
+        self.recorder = recorder
+        self.connection_id = connection_id
+
+    def cursor(self):
+        return _RecordingCursor(self.connection.cursor(), self.recorder, self.connection_id)
+
+    @property
+    def timeout(self):
+        return self.connection.timeout
+
+    @timeout.setter
+    def timeout(self, seconds):
+        self.connection.timeout = seconds  # statement timeout belongs to the real connection
+
+    @property
+    def autocommit(self):
+        return self.connection.autocommit
+
+    @autocommit.setter
+    def autocommit(self, value):
+        self.connection.autocommit = value
+
+    def close(self):
+        self.connection.close()
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+class SnapshotRecorder:
+    """Thread-safe writer of one recording; statement text is written once and referenced by id"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.origin = time.monotonic()
+        self.sql_ids = {}
+        self.connections = 0
+        self.executions = 0
+        self.file = gzip.open(path, "wt", encoding="utf-8")
+        self._write({"type": "header", "version": RECORDING_VERSION,
+                     "script": os.path.basename(sys.argv[0]),
+                     "started": datetime.now().isoformat()})
+        atexit.register(self.close)
+        print(f"● Recording DMV result sets to {path}")
+
+    def _write(self, entry):
+        self.file.write(json.dumps(entry, default=_encode, separators=(",", ":")) + "\n")
+
+    def wrap(self, connection, label=""):
+        """Recording connection for a freshly opened connection; label names the instance"""
+        with self.lock:
+            self.connections += 1
+            connection_id = self.connections
+            self._write({"type": "conn", "id": connection_id, "label": label})
+        return RecordingConnection(connection, self, connection_id)
+
+    def record(self, connection_id, sql, params, started, sets=None, error=None):
+        finished = time.monotonic()
+        entry = {"type": "exec", "conn": connection_id,
+                 "t": datetime.now().isoformat(), "o": round(started - self.origin, 6),
+                 "ms": round((finished - started) * 1000.0, 3),
+                 "params": list(params)}
+        if error is not None:
+            entry["error"] = str(error)
+        else:
+            entry["sets"] = sets
+        key = normalize_sql(sql)
+        with self.lock:
+            if self.file is None:
+                return
+            sql_id = self.sql_ids.get(key)
+            if sql_id is None:
+                sql_id = self.sql_ids[key] = len(self.sql_ids) + 1
+                self._write({"type": "sql", "id": sql_id, "text": sql})
+            entry["sql"] = sql_id
+            self._write(entry)
+            self.executions += 1
+            if self.executions % FLUSH_RECORDS == 0:
+                self.file.flush()
+
+    def close(self):
+        with self.lock:
+            if self.file is None:
+                return
+            self.file.close()
+            self.file = None
+        print(f"✓ Recorded {self.executions} DMV executions to {self.path}")
+
+class Execution:
+    """One recorded statement execution"""
+
+    __slots__ = ("connection", "label", "sql", "params", "time", "offset", "ms", "sets", "error")
+
+    def __init__(self, connection, label, sql, entry):
+        self.connection = connection
+        self.label = label
+        self.sql = sql
+        self.params = entry["params"]
+        self.time = datetime.fromisoformat(entry["t"])
+        self.offset = entry["o"]
+        self.ms = entry["ms"]
+        self.sets = entry.get("sets") or []
+        self.error = entry.get("error")
+
+def read_recording(path):
+    """(header, [Execution]) in recorded order; a truncated file yields what was written"""
+    header = None
+    sql_texts = {}
+    labels = {}
+    executions = []
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        try:
+            for line in f:
+                if not line.endswith("\n"):
+                    break  # cut off mid-record
+                entry = json.loads(line, object_hook=_decode)
+                kind = entry["type"]
+                if kind == "exec":
+                    executions.append(Execution(entry["conn"], labels.get(entry["conn"], ""),
+                                                sql_texts[entry["sql"]], entry))
+                elif kind == "sql":
+                    sql_texts[entry["id"]] = entry["text"]
+                elif kind == "conn":
+                    labels[entry["id"]] = entry["label"]
+                elif kind == "header":
+                    header = entry
+        except EOFError:
+            pass  # the recording process was killed before closing the file
+    if header is None:
+        raise ValueError(f"{path} is not a DMV recording")
+    return header, executions
+
+class _ReplayCursor(BufferedCursor):
+    def __init__(self, connection):
+        super().__init__()
+        self.connection = connection
+
+    def execute(self, sql, *params):
+        execution = self.connection.take(sql, params)
+        if execution.error is not None:
+            raise ReplayError(execution.error)
+        self._load(execution.sets)
+        return self
+
+    def cancel(self):
+        """Recorded results are answered at once: nothing is ever left to cancel"""
+
+class ReplayConnection:
+    """pyodbc-style connection answering each statement with its next recorded execution.
+
+    Executions are matched on statement text and parameters, in recorded
+    order per statement, so the caller may interleave statements
+    differently than the recording did.
+    """
+
+    def __init__(self, executions):
+        self.queues = {}
+        for execution in executions:
+            self.queues.setdefault(execution_key(execution.sql, execution.params), deque()).append(execution)
+        self.last = None  # execution served most recently
+        self.served = 0
+
+    def take(self, sql, params=()):
+        queue = self.queues.get(execution_key(sql, params))
+        if not queue:
+            raise ReplayError(f"No recorded execution left for: {normalize_sql(sql)[:120]}")
+        self.last = queue.popleft()
+        self.served += 1
+        return self.last
+
+    def remaining(self):
+        return sum(len(queue) for queue in self.queues.values())
+
+    def clock(self):
+        """Recorded monotonic time of the last statement served, for replaying interval maths"""
+        return self.last.offset if self.last else 0.0
+
+    def cursor(self):
+        return _ReplayCursor(self)
+
+    def close(self):
+        pass
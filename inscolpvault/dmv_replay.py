@@ -0,0 +1,236 @@
+"""
+Replay a DMV recording through the pVault collectors, checks and analyzers
+Runs as fast as possible against recorded result sets, never touching SQL Server
+
+Record first (any script, e.g. the monitor during an incident):
+    PVAULT_RECORD=incident.dmv.gz python monitor_query_performance.py
+
+Usage: python dmv_replay.py RECORDING [--mode monitor|health_check|quick_check|diagnose]
+                            [--repeat N] [--quiet] [--log PATH]
+"""
+
+import argparse
+import contextlib
+import importlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+from dmv_recorder import ReplayConnection, ReplayError, normalize_sql, read_recording
+
+# Recording script -> replay mode
+SCRIPT_MODES = {
+    'monitor_query_performance.py': 'monitor',
+    'fleet_monitor.py': 'monitor',
+    'sql_health_check.py': 'health_check',
+    'run_sql_health_check.py': 'health_check',
+    'quick_health_check.py': 'quick_check',
+    'diagnose_invoice_timeout.py': 'diagnose',
+}
+
+# Replay mode -> module it drives, imported before the clock starts
+MODE_MODULES = {
+    'monitor': 'monitor_query_performance',
+    'health_check': 'sql_health_check',
+    'quick_check': 'quick_health_check',
+    'diagnose': 'diagnose_invoice_timeout',
+}
+
+class _CountingWriter:
+    """Log writer wrapper counting the rows written during a replay"""
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.rows = 0
+
+    def write_row(self, row):
+        self.rows += 1
+        self.writer.write_row(row)
+
+    def flush(self):
+        self.writer.flush()
+
+    def close(self):
+        self.writer.close()
+
+def replay_monitor(executions, log_path):
+    """Feed every recorded request (and wait stats) tick through a QueryMonitor per instance"""
+    from monitor_query_performance import QueryMonitor, REQUESTS_QUERY
+    from perf_log import open_log_writer
+    from wait_stats import WAIT_STATS_QUERY
+
+    requests_sql = normalize_sql(REQUESTS_QUERY.sql.strip())
+    wait_stats_sql = normalize_sql(WAIT_STATS_QUERY)
+    labels = sorted({e.label for e in executions})
+    writer = _CountingWriter(open_log_writer(log_path, "csv"))
+    monitors = {}
+    for label in labels:
+        server, _, database = label.partition('/')
+        monitor = monitors[label] = QueryMonitor('', '', server or 'replay', database=database or None,
+                                                 name=label if len(labels) > 1 else None)
+        monitor.log_writer = writer
+
+    connections = {}
+    for execution in executions:
+        connections.setdefault(execution.connection, []).append(execution)
+    connections = {cid: ReplayConnection(stream) for cid, stream in connections.items()}
+
+    ticks = mismatches = 0
+    for execution in executions:
+        sql = normalize_sql(execution.sql)
+        if requests_sql in sql:
+            collect = 'collect_requests'
+        elif sql == wait_stats_sql:
+            collect = 'collect_wait_stats'
+        else:
+            continue  # served to the collector that issued it (text lookups, idle sessions)
+        monitor = monitors[execution.label]
+        # Replay the recorded batching decision rather than re-deriving it from jittery tick times
+        monitor.last_wait_sample = None if wait_stats_sql in sql else execution.offset
+        monitor.clock = lambda: execution.offset
+        monitor.now = lambda: execution.time
+        try:
+            getattr(monitor, collect)(connections[execution.connection])
+            ticks += 1
+        except ReplayError as e:
+            mismatches += 1
+            print(f"⚠ Tick at {execution.time:%H:%M:%S} not replayable: {e}")
+
+    for monitor in monitors.values():
+        monitor.report_blocking()
+        monitor.get_performance_stats()
+        monitor.print_query_summary()
+        monitor.print_latency_summary()
+    writer.close()
+    return {'ticks': ticks, 'rows': writer.rows, 'mismatches': mismatches}
+
+def analyze_replay_log(log_path):
+    """Run the log analyzer over the replayed log; returns its duration"""
+    try:
+        from log_analysis import LogAnalyzer
+    except ImportError:
+        print("Install numpy to analyze the replayed log (pip install numpy)")
+        return None
+    start = time.perf_counter()
+    analyzer = LogAnalyzer().analyze([log_path])
+    elapsed = time.perf_counter() - start
+    analyzer.print_summary()
+    return elapsed
+
+def replay_health_check(executions):
+    """Run every check of sql_health_check.py against the recording"""
+    from sql_health_check import SQLServerHealthCheck
+
+    server, _, database = executions[0].label.partition('/')
+    connection = ReplayConnection(executions)
+    health_check = SQLServerHealthCheck(server or 'replay', database, '', '')
+    health_check.connection = connection
+    health_check.clock = connection.clock
+    health_check.sleep = lambda seconds: None
+
+    timings = health_check.results['timings'] = {}
+    failed = 0
+    start = time.perf_counter()
+    for name in health_check.CHECKS:
+        check_start = time.perf_counter()
+        try:
+            getattr(health_check, name)()
+        except ReplayError as e:
+            failed += 1
+            print(f"\n⚠ {name} not replayable: {e}")
+        timings[name] = time.perf_counter() - check_start
+    health_check.generate_report()
+    health_check.print_timing_summary(timings, time.perf_counter() - start)
+    return {'checks': len(health_check.CHECKS) - failed, 'mismatches': failed}
+
+def _replay_script(run, executions):
+    """Run a whole-script replay; a statement missing from the recording ends it"""
+    try:
+        run(ReplayConnection(executions))
+    except ReplayError as e:
+        print(f"\n⚠ Not replayable: {e}")
+        return {'checks': 0, 'mismatches': 1}
+    return {'checks': 1, 'mismatches': 0}
+
+def replay_quick_check(executions):
+    from quick_health_check import run_quick_checks
+    return _replay_script(lambda connection: run_quick_checks(connection, save_baseline=False), executions)
+
+def replay_diagnose(executions):
+    from diagnose_invoice_timeout import run_diagnostics
+    return _replay_script(run_diagnostics, executions)
+
+def replay(mode, executions, log_path, quiet=False):
+    """One replay; returns (stats, seconds)"""
+    output = io.StringIO() if quiet else sys.stdout
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(output):
+        if mode == 'monitor':
+            stats = replay_monitor(executions, log_path)
+        elif mode == 'health_check':
+            stats = replay_health_check(executions)
+        elif mode == 'quick_check':
+            stats = replay_quick_check(executions)
+        else:
+            stats = replay_diagnose(executions)
+    return stats, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a DMV recording as fast as possible')
+    parser.add_argument('recording', help='file written with PVAULT_RECORD set')
+    parser.add_argument('--mode', choices=sorted(set(SCRIPT_MODES.values())),
+                        help='what to replay through (default: the script that made the recording)')
+    parser.add_argument('--repeat', type=int, default=1, help='replay N times and report each run')
+    parser.add_argument('--quiet', action='store_true', help='suppress script output, print only throughput')
+    parser.add_argument('--log', help='monitor mode: replayed log path (default: a temporary file)')
+    parser.add_argument('--keep-state', action='store_true',
+                        help='use the real ~/.pvault_sql state (caches, baselines) instead of a scratch copy')
+    args = parser.parse_args()
+
+    # Replays must not record themselves or touch the local caches and baselines
+    os.environ.pop('PVAULT_RECORD', None)
+    scratch = tempfile.mkdtemp(prefix='pvault_replay_')
+    if not args.keep_state:
+        os.environ['PVAULT_STATE_DIR'] = scratch
+
+    load_start = time.perf_counter()
+    try:
+        header, executions = read_recording(args.recording)
+    except (OSError, ValueError) as e:
+        print(f"✗ Cannot read {args.recording}: {e}")
+        sys.exit(1)
+    load_seconds = time.perf_counter() - load_start
+    if not executions:
+        print("Recording contains no executions")
+        sys.exit(1)
+
+    mode = args.mode or SCRIPT_MODES.get(header.get('script'))
+    if mode is None:
+        print(f"Cannot tell how to replay a recording of {header.get('script')}; pass --mode")
+        sys.exit(1)
+    span = executions[-1].offset - executions[0].offset
+    rows = sum(len(rows) for e in executions for _, rows in e.sets)
+    print(f"Recording of {header.get('script')} started {header.get('started')}: {len(executions):,} executions, "
+          f"{rows:,} rows over {span:.0f}s (loaded in {load_seconds:.2f}s)")
+
+    importlib.import_module(MODE_MODULES[mode])
+    log_path = args.log or os.path.join(scratch, 'replay_performance.csv')
+    for run in range(1, args.repeat + 1):
+        if os.path.exists(log_path):
+            os.remove(log_path)
+        stats, seconds = replay(mode, executions, log_path, args.quiet)
+        detail = ", ".join(f"{k} {v:,}" for k, v in stats.items())
+        speedup = f", {span / seconds:,.0f}x real time" if seconds and span else ""
+        print(f"[REPLAY {run}/{args.repeat}] {mode}: {seconds:.3f}s, {len(executions) / seconds:,.0f} executions/s"
+              f"{speedup} ({detail})")
+
+    if mode == 'monitor':
+        with contextlib.redirect_stdout(io.StringIO() if args.quiet else sys.stdout):
+            analysis_seconds = analyze_replay_log(log_path)
+        if analysis_seconds is not None:
+            print(f"[REPLAY] log analysis: {analysis_seconds:.3f}s")
+
+if __name__ == "__main__":
+    main()
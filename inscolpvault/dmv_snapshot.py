@@ -0,0 +1,42 @@
+"""
+Single-round-trip DMV snapshots for pVault monitoring
+Sends several queries as one T-SQL batch and reads every result set with nextset()
+"""
+
+from collections import namedtuple
+
+SnapshotQuery = namedtuple('SnapshotQuery', ['name', 'sql'])
+
+_record_types = {}
+
+def record_type(name, columns):
+    """namedtuple class for a result set, reused while its columns stay the same"""
+    key = (name, columns)
+    record = _record_types.get(key)
+    if record is None:
+        type_name = ''.join(part.capitalize() for part in name.split('_')) + 'Record'
+        record = _record_types[key] = namedtuple(type_name, columns, rename=True)
+    return record
+
+def batch_sql(queries):
+    """One batch with every query in order; NOCOUNT keeps row counts out of the result sets"""
+    statements = [query.sql.strip().rstrip(';') for query in queries]
+    return "SET NOCOUNT ON;\n" + ";\n".join(statements) + ";"
+
+def collect_snapshot(connection, queries):
+    """Run queries in one round trip; returns {name: [record, ...]} in query order.
+
+    All result sets come from one batch, so they describe (nearly) the same
+    point in time. Queries must return exactly one result set each.
+    """
+    cursor = connection.cursor()
+    cursor.execute(batch_sql(queries))
+    snapshot = {}
+    for i, query in enumerate(queries):
+        if i and not cursor.nextset():
+            raise RuntimeError(f"Snapshot batch ended before the '{query.name}' result set")
+        if cursor.description is None:
+            raise RuntimeError(f"Snapshot query '{query.name}' returned no result set")
+        record = record_type(query.name, tuple(column[0] for column in cursor.description))
+        snapshot[query.name] = [record._make(row) for row in cursor.fetchall()]
+    return snapshot
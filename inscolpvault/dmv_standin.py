@@ -0,0 +1,1076 @@
+"""
+Stand-in SQL Server for the DMV layer of the pVault scripts
+A pyodbc-compatible connection answering the scripts' DMV queries from synthetic (or recorded)
+data with tunable per-query latency, so everything runs without a live instance
+
+Select it through the connection factory:
+    PVAULT_STANDIN=synthetic python sql_health_check.py
+    PVAULT_STANDIN="synthetic:requests=500,blocked=20,indexes=5000" python monitor_query_performance.py
+    PVAULT_STANDIN=standin.json python quick_health_check.py       # settings file, see DEFAULTS
+    PVAULT_STANDIN=incident.dmv.gz python diagnose_invoice_timeout.py   # recorded result sets first
+
+Usage: python dmv_standin.py [SPEC] [--sql STATEMENT]   (prints what the stand-in answers)
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import ntpath
+import random
+import re
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from xml.sax.saxutils import escape
+from functools import lru_cache
+
+from dmv_recorder import BufferedCursor, execution_key, normalize_sql, read_recording
+
+try:
+    import pyodbc
+    ProgrammingError = pyodbc.ProgrammingError
+    OperationalError = pyodbc.OperationalError
+except ImportError:
+    pyodbc = None
+
+    class ProgrammingError(Exception):
+        pass
+
+    class OperationalError(Exception):
+        pass
+
+# Synthetic instance shape; any key can be overridden by a settings file or "synthetic:key=value,..."
+DEFAULTS = {
+    "seed": 1,
+    "server_name": "INSCOLPVAULT",
+    "database": "PaperlessEnvironments",
+    "databases": 4,            # user databases
+    "offline_databases": 0,
+    "requests": 40,            # concurrently executing requests
+    "blocked": 3,              # of which blocked behind the first session
+    "tables": 60,
+    "indexes": 240,            # across all tables (at least one per table)
+    "fragmented_pct": 20,      # share of indexes over 30% fragmentation
+    "missing_indexes": 8,
+    "cached_plans": 50,
+    "plan_churn_seconds": 300,  # each period every 10th plan is recompiled and another evicted or cached again
+    "errorlog": 40,            # error log entries
+    "memory_mb": 24576,
+    "memory_low": False,
+    "cpu_pct": 35,             # average SQL Server CPU in the ring buffer
+    "query_store": "READ_WRITE",  # actual_state_desc of sys.database_query_store_options ("OFF" disables it)
+    "xe_session": "",          # target of an existing pvault_timeouts event session ("" = created on first use)
+    "xe_permission": True,     # False: creating the event session fails as without ALTER ANY EVENT SESSION
+    "xe_timeouts_per_hour": 30,  # client command timeouts the event session captures
+    "system_health": "event_file",  # targets of the system_health session: event_file (and ring_buffer),
+                                    # ring_buffer only, or "" when the session is stopped
+    "deadlocks_per_hour": 60,  # xml_deadlock_report events system_health captures
+    "recording": None,         # dmv_recorder file whose result sets are served before synthetic data
+    # Seconds per statement, by DMV (see HANDLERS); "default" for the rest. A batch pays each statement
+    "latency": {"default": 0.0},
+    "jitter": 0.0,             # +/- fraction applied to every latency
+}
+
+# Statements the synthetic requests run: (text, typical seconds, command)
+STATEMENTS = [
+    ("EXEC dbo.LoadInvoicesByStatusID @StatusID = @p1", 12.0, "EXECUTE"),
+    ("SELECT i.InvoiceID, i.VendorID, i.Amount, i.StatusID FROM dbo.Invoices i WHERE i.StatusID = @p1", 4.0, "SELECT"),
+    ("UPDATE dbo.InvoiceStatus SET StatusID = @p1, ModifiedAt = GETDATE() WHERE InvoiceID = @p2", 0.4, "UPDATE"),
+    ("SELECT d.DocumentID, d.StoragePath FROM dbo.Documents d WHERE d.InvoiceID = @p1", 0.8, "SELECT"),
+    ("INSERT INTO dbo.AuditLog (EventType, UserID, CreatedAt) VALUES (@p1, @p2, GETDATE())", 0.05, "INSERT"),
+    ("SELECT COUNT(*) FROM dbo.Invoices WHERE StatusID = @p1 AND CreatedAt > @p2", 2.5, "SELECT"),
+    ("EXEC dbo.ApproveInvoiceBatch @BatchID = @p1", 6.0, "EXECUTE"),
+    ("SELECT v.VendorID, v.Name FROM dbo.Vendors v ORDER BY v.Name", 0.2, "SELECT"),
+]
+STATEMENT_WEIGHTS = [3, 3, 2, 2, 4, 1, 1, 2]
+
+NAMED_TABLES = ["Invoices", "InvoiceStatus", "InvoiceLines", "InvoiceHistory", "Documents",
+                "DocumentPages", "Vendors", "AuditLog", "Users", "Batches", "StatusCodes", "Approvals"]
+
+# Non-benign waits and their share of wait time: (wait_type, ms waited per second, signal share, avg ms)
+WAITS = [
+    ("PAGEIOLATCH_SH", 900.0, 0.02, 8.0),
+    ("LCK_M_S", 600.0, 0.01, 1500.0),
+    ("CXPACKET", 500.0, 0.10, 20.0),
+    ("SOS_SCHEDULER_YIELD", 300.0, 0.95, 2.0),
+    ("WRITELOG", 150.0, 0.05, 3.0),
+    ("ASYNC_NETWORK_IO", 120.0, 0.02, 15.0),
+    ("PAGELATCH_EX", 60.0, 0.20, 1.0),
+    ("LCK_M_U", 40.0, 0.01, 900.0),
+]
+UPTIME_SECONDS = 12 * 86400  # counters start as if the instance had been up this long
+
+# Query Store statements: (object, text, [(plan seconds, logical reads, hours of day the plan is used)], runs/hour).
+# LoadInvoicesByStatusID flips to a scanning plan after the nightly statistics job, timing out around 3 a.m.
+QUERY_STORE_QUERIES = [
+    ("LoadInvoicesByStatusID",
+     "SELECT i.InvoiceID, i.VendorID, i.Amount, s.StatusID FROM dbo.Invoices i JOIN dbo.InvoiceStatus s "
+     "ON s.InvoiceID = i.InvoiceID WHERE s.StatusID = @StatusID ORDER BY i.CreatedAt DESC",
+     [(1.8, 42000, None), (26.0, 3800000, (2, 3, 4))], 120),
+    ("LoadInvoicesByStatusID",
+     "SELECT COUNT(*) FROM dbo.InvoiceLines l WHERE l.InvoiceID IN (SELECT InvoiceID FROM #Invoices)",
+     [(0.3, 9000, None)], 120),
+    ("ApproveInvoiceBatch",
+     "UPDATE dbo.Invoices SET StatusID = 3, ApprovedAt = GETDATE() WHERE BatchID = @BatchID",
+     [(1.2, 15000, None)], 20),
+    (None, "SELECT v.VendorID, v.Name FROM dbo.Vendors v ORDER BY v.Name", [(0.2, 800, None)], 300),
+]
+QUERY_STORE_DAYS = 7  # history the synthetic Query Store holds
+
+XE_LOG_DIR = r"C:\Program Files\Microsoft SQL Server\MSSQL15.MSSQLSERVER\MSSQL\Log"
+XE_EVENTS_PER_FILE = 40    # event file rollover
+XE_DISPATCH_SECONDS = 5    # events are written in one buffer (one file_offset) per dispatch
+XE_ROLLOVER_FILES = 4
+XE_RING_BUFFER_EVENTS = 1000
+SYSTEM_HEALTH_HOURS = 6    # deadlock history system_health holds when the stand-in starts
+SYSTEM_HEALTH_EVENTS_PER_FILE = 100
+SYSTEM_HEALTH_RING_BUFFER_EVENTS = 200
+SYSTEM_HEALTH_DIAGNOSTICS_SECONDS = 300  # sp_server_diagnostics results system_health writes between deadlocks
+SYSTEM_HEALTH_COMPONENTS = ("system", "resource", "query_processing", "io_subsystem", "events")
+
+ERRORLOG_TEXTS = [
+    "Login succeeded for user 'pvault_app'. Connection made using SQL Server authentication.",
+    "Error: 1205, Severity: 13, State: 51. Transaction was deadlocked on lock resources with another process.",
+    "Error: 18456, Severity: 14, State: 8. Login failed for user 'sa'. Reason: Password did not match.",
+    "SQL Server has encountered 3 occurrence(s) of I/O requests taking longer than 15 seconds to complete.",
+    "Log was backed up. Database: PaperlessEnvironments.",
+    "Autogrow of file 'PaperlessEnvironments_log' in database 'PaperlessEnvironments' took 4200 milliseconds.",
+    "CHECKDB for database 'PaperlessEnvironments' finished without errors.",
+]
+
+class StandinError(ProgrammingError):
+    """The stand-in has no answer for a statement"""
+
+def _hash(text, size):
+    return hashlib.sha1(text.encode("utf-8")).digest()[:size]
+
+def _row(**values):
+    return {name.lower(): value for name, value in values.items()}
+
+def _event_name(xml):
+    return xml[len('<event name="'):xml.index('"', len('<event name="'))]
+
+def _like(pattern):
+    """Regex for a T-SQL LIKE pattern"""
+    parts = [".*" if c == "%" else "." if c == "_" else re.escape(c) for c in pattern]
+    return re.compile("^" + "".join(parts) + "$", re.IGNORECASE)
+
+def like_patterns(sql, params):
+    """LIKE filters of a statement: literals in the text and string parameters with wildcards"""
+    patterns = re.findall(r"LIKE\s+'([^']*)'", sql, re.IGNORECASE)
+    patterns += [p for p in params if isinstance(p, str) and "%" in p]
+    return [_like(p) for p in patterns]
+
+def _matches(patterns, text):
+    return not patterns or any(p.match(text or "") for p in patterns)
+
+def _split_select_list(text):
+    """Top-level items of the first SELECT list, and its TOP n (or None)"""
+    match = re.search(r"\bSELECT\b", text, re.IGNORECASE)
+    if not match:
+        return None, None
+    i = match.end()
+    limit = None
+    top = re.match(r"\s*TOP\s*\(?\s*(\d+)\s*\)?", text[i:], re.IGNORECASE)
+    if top:
+        limit = int(top.group(1))
+        i += top.end()
+    items, depth, start, j = [], 0, i, i
+    while j < len(text):
+        c = text[j]
+        if c == "'":
+            j = text.index("'", j + 1)
+        elif c == "(":
+            depth += 1
+        elif c == ")":
+            depth -= 1
+        elif depth == 0 and c == ",":
+            items.append(text[start:j])
+            start = j + 1
+        elif depth == 0 and re.match(r"FROM\b", text[j:j + 5], re.IGNORECASE) and not (text[j - 1].isalnum() or text[j - 1] == "_"):
+            break
+        j += 1
+    items.append(text[start:j])
+    return items, limit
+
+@lru_cache(maxsize=512)
+def select_columns(sql):
+    """(column names, TOP n) of a statement's result set, or (None, None) without a SELECT list"""
+    items, limit = _split_select_list(re.sub(r"--[^\n]*", "", sql))
+    if items is None:
+        return None, None
+    columns = []
+    for item in items:
+        name = re.search(r"\[?(\w+|\*)\]?\s*$", item.strip())
+        columns.append(name.group(1) if name else "")
+    return tuple(columns), limit
+
+class RecordedResults:
+    """Result sets of a recording, served by statement and parameters, cycling when exhausted"""
+
+    def __init__(self, path):
+        _, executions = read_recording(path)
+        self.by_key = {}
+        self.by_sql = {}
+        for execution in executions:
+            if execution.error is None:
+                key = execution_key(execution.sql, execution.params)
+                self.by_key.setdefault(key, []).append(execution.sets)
+                self.by_sql.setdefault(key[0], []).append(execution.sets)
+        self.turns = {}
+
+    def sets(self, sql, params):
+        key = execution_key(sql, params)
+        options = self.by_key.get(key) or self.by_sql.get(key[0])
+        if not options:
+            return None
+        turn = self.turns.get(key, 0)
+        self.turns[key] = turn + 1
+        return options[turn % len(options)]
+
+class StandinServer:
+    """Synthetic instance state shared by every stand-in connection to it.
+
+    Static inventory (tables, indexes, statistics) is built once from the seed;
+    requests, wait counters and plan cache totals advance with the clock, so
+    samplers see requests start and finish and counters grow between samples.
+    """
+
+    def __init__(self, settings=None):
+        self.settings = dict(DEFAULTS, **(settings or {}))
+        self.settings["latency"] = dict(DEFAULTS["latency"], **self.settings.get("latency", {}))
+        self.lock = threading.Lock()
+        self.origin = time.monotonic()
+        self.started_at = datetime.now()
+        self.random = random.Random(self.settings["seed"])
+        self.recorded = RecordedResults(self.settings["recording"]) if self.settings["recording"] else None
+        self.executions = 0
+        self._build_inventory()
+        self.slots = [None] * self.settings["requests"]  # [k, start, duration, statement] per session
+        # Timeout event session: target and when it started capturing (an existing one has an hour of events)
+        self.xe_session = self.settings["xe_session"] or None
+        self.xe_running = self.xe_session is not None
+        self.xe_since = self.started_at - timedelta(hours=1) if self.xe_session else None
+        self.deadlocks = []  # system_health deadlock reports generated so far
+
+    def connect(self, timeout=0):
+        return StandinConnection(self, timeout)
+
+    def elapsed(self):
+        return time.monotonic() - self.origin
+
+    def _build_inventory(self):
+        s, rng = self.settings, self.random
+        self.databases = [s["database"]] + [f"pvault_{name}" for name in ("archive", "reporting", "staging", "import",
+                                                                          "audit", "export")][:s["databases"] - 1]
+        self.databases += [f"pvault_db{i}" for i in range(len(self.databases), s["databases"])]
+
+        tables = NAMED_TABLES[:s["tables"]] + [f"Table_{i:04d}" for i in range(len(NAMED_TABLES), s["tables"])]
+        self.tables = []
+        for t, name in enumerate(tables):
+            rows = int(rng.lognormvariate(math.log(2000000 if t < len(NAMED_TABLES) else 50000), 1.5))
+            self.tables.append({"object_id": 1001 + t * 16, "name": name, "rows": rows,
+                                "row_bytes": rng.choice([120, 250, 600, 1500]), "indexes": 1,
+                                "hot": name.startswith("Invoice")})
+        for _ in range(max(s["indexes"] - len(self.tables), 0)):
+            rng.choice(self.tables)["indexes"] += 1
+
+        self.indexes = []
+        now = self.started_at
+        for table in self.tables:
+            for index_id in range(1, table["indexes"] + 1):
+                clustered = index_id == 1
+                pages = max(int(table["rows"] * (table["row_bytes"] if clustered else 40) / 8060), 1)
+                fragmented = rng.random() * 100 < s["fragmented_pct"]
+                updated = now - timedelta(days=rng.choice([0, 1, 3, 9, 20, 45]), hours=rng.randint(0, 23))
+                name = f"PK_{table['name']}" if clustered else f"IX_{table['name']}_{index_id}"
+                self.indexes.append({
+                    "table": table, "object_id": table["object_id"], "index_id": index_id, "name": name,
+                    "type": "CLUSTERED" if clustered else "NONCLUSTERED", "pages": pages,
+                    "disabled": not clustered and rng.random() < 0.01,
+                    "fragmentation": rng.uniform(31, 95) if fragmented else rng.uniform(0, 12),
+                    "columns": ", ".join(rng.sample(["InvoiceID", "StatusID", "VendorID", "CreatedAt",
+                                                     "BatchID", "DocumentID", "UserID"], 2 if clustered else 3)),
+                    "stats_updated": updated,
+                    "modifications": int(table["rows"] * rng.choice([0.0, 0.01, 0.05, 0.3])),
+                })
+        self.index_by_id = {(i["object_id"], i["index_id"]): i for i in self.indexes}
+
+        self.missing = []
+        for n in range(s["missing_indexes"]):
+            table = self.tables[n % min(len(self.tables), 6)]
+            seeks = rng.randint(100, 50000)
+            cost, impact = rng.uniform(5, 400), rng.uniform(30, 99)
+            self.missing.append({"table": table, "handle": 100 + n, "seeks": seeks, "cost": cost, "impact": impact,
+                                 "equality": "[StatusID]", "inequality": "[CreatedAt]" if n % 2 else None,
+                                 "included": "[InvoiceID], [VendorID], [Amount]" if n % 3 == 0 else None})
+
+        self.plans = []
+        for n in range(s["cached_plans"]):
+            text, typical, _ = STATEMENTS[n % len(STATEMENTS)]
+            if n >= len(STATEMENTS):
+                text = f"{text} /* variant {n} */"
+            self.plans.append({"text": text, "typical": typical, "rate": rng.uniform(0.05, 3.0),
+                               "created": now - timedelta(hours=rng.randint(1, 72)),
+                               "reads": rng.randint(10, 200000)})
+
+        self.errorlog = [(now - timedelta(minutes=17 * n + rng.randint(0, 10)),
+                          rng.choice(["spid51", "spid87", "Logon", "Backup", "Server"]),
+                          ERRORLOG_TEXTS[rng.randrange(len(ERRORLOG_TEXTS))])
+                         for n in range(s["errorlog"])]
+        self.cpu = [max(0, min(100, int(rng.gauss(s["cpu_pct"], 12)))) for _ in range(256)]
+
+    # -- time-dependent state -------------------------------------------------
+
+    def _slot_request(self, slot, k):
+        """Statement and duration of the k-th request run by one session"""
+        rng = random.Random(self.settings["seed"] * 1000003 + slot * 7919 + k)
+        index = rng.choices(range(len(STATEMENTS)), STATEMENT_WEIGHTS)[0]
+        if slot == 0 and self.settings["blocked"]:
+            return index, 3600.0  # the head blocker keeps its locks for the whole run
+        return index, rng.lognormvariate(math.log(STATEMENTS[index][1]), 0.9)
+
+    def requests(self):
+        """Executing requests right now, as wide rows"""
+        elapsed = self.elapsed()
+        blocked = self.settings["blocked"]
+        rows = []
+        with self.lock:
+            for slot in range(len(self.slots)):
+                state = self.slots[slot]
+                if state is None:
+                    index, duration = self._slot_request(slot, 0)
+                    # Stagger the first requests so they do not all start together
+                    started = -random.Random(slot).uniform(0, 120.0 if slot == 0 else duration)
+                    state = self.slots[slot] = [0, started, duration, index]
+                while state[1] + state[2] < elapsed:
+                    k = state[0] + 1
+                    index, duration = self._slot_request(slot, k)
+                    state[:] = [k, state[1] + state[2], duration, index]
+                rows.append(self._request_row(slot, state, elapsed, blocked))
+        rows.sort(key=lambda r: r["total_elapsed_time"], reverse=True)
+        return rows
+
+    def _request_row(self, slot, state, elapsed, blocked):
+        k, start, _, index = state
+        text, _, command = STATEMENTS[index]
+        seconds = elapsed - start
+        session_id = 51 + slot
+        blocking = 51 if 0 < slot <= blocked else 0
+        rng = random.Random(slot * 31 + k)
+        wait_type = "LCK_M_U" if blocking else rng.choice([None, None, "PAGEIOLATCH_SH", "CXPACKET", "ASYNC_NETWORK_IO"])
+        wait = seconds if blocking else (rng.uniform(0, min(seconds, 2.0)) if wait_type else 0.0)
+        cpu = max(seconds - wait, 0.0) * rng.uniform(0.2, 0.9)
+        reads = int(seconds * rng.uniform(500, 50000))
+        return _row(
+            session_id=session_id, request_id=0, start_time=self.started_at + timedelta(seconds=start),
+            status="suspended" if wait_type else "running", command=command,
+            total_elapsed_time=int(seconds * 1000), ElapsedSec=round(seconds, 3),
+            wait_type=wait_type, wait_time=int(wait * 1000), WaitSec=round(wait, 3), blocking_session_id=blocking,
+            cpu_time=int(cpu * 1000), CPUSec=round(cpu, 3), reads=reads, writes=int(reads * 0.02), logical_reads=reads * 4,
+            database_id=5, DatabaseName=self.settings["database"],
+            query_hash=_hash(f"q{index}", 8), query_plan_hash=_hash(f"p{index}", 8),
+            sql_handle=_hash(text, 20), statement_start_offset=0, statement_end_offset=-1,
+            text=text, QueryText=text)
+
+    def wait_stats(self):
+        seconds = UPTIME_SECONDS + self.elapsed()
+        rows = []
+        for wait_type, ms_per_sec, signal_share, avg_ms in WAITS:
+            wait_ms = int(ms_per_sec * seconds)
+            signal_ms = int(wait_ms * signal_share)
+            count = int(wait_ms / avg_ms)
+            rows.append(_row(wait_type=wait_type, waiting_tasks_count=count, wait_time_ms=wait_ms,
+                             signal_wait_time_ms=signal_ms, WaitSec=wait_ms / 1000.0,
+                             ResourceSec=(wait_ms - signal_ms) / 1000.0, SignalSec=signal_ms / 1000.0,
+                             WaitCount=count, Count=count))
+        total = sum(r["wait_time_ms"] for r in rows)
+        for r in rows:
+            r["percentage"] = 100.0 * r["wait_time_ms"] / total
+        return sorted(rows, key=lambda r: r["wait_time_ms"], reverse=True)
+
+    def plan_stats(self):
+        seconds = self.elapsed()
+        rows = []
+        churn = self.settings["plan_churn_seconds"]
+        period = int(seconds // churn) if churn else 0
+        for n, plan in enumerate(self.plans):
+            created, generation = plan["created"], 1
+            if period and n % 10 == 1 and period % 2:
+                continue  # evicted, cached again next period
+            if period and n % 10 in (0, 1):
+                # recompiled or cached again: new creation time, the totals restart
+                created = self.started_at + timedelta(seconds=period * churn)
+                generation = period + 1 if n % 10 == 0 else 1
+            age = (self.started_at - created).total_seconds() + seconds
+            executions = max(int(age * plan["rate"]), 1)
+            total_us = int(executions * plan["typical"] * 1000000)
+            rows.append(_row(
+                sql_handle=_hash(plan["text"], 20), plan_handle=_hash(f"plan{n}", 24),
+                query_hash=_hash(f"q{n % len(STATEMENTS)}", 8), query_plan_hash=_hash(f"p{n}", 8),
+                statement_start_offset=0, statement_end_offset=-1,
+                plan_generation_num=generation, creation_time=created, last_execution_time=datetime.now(),
+                SampledAt=datetime.now(),
+                execution_count=executions, total_elapsed_time=total_us,
+                max_elapsed_time=int(plan["typical"] * 4 * 1000000),
+                total_worker_time=int(total_us * 0.6), total_logical_reads=executions * plan["reads"],
+                TotalElapsedSec=total_us // 1000000, AvgElapsedSec=total_us / executions / 1000000.0,
+                MaxElapsedSec=plan["typical"] * 4, AvgLogicalReads=plan["reads"],
+                TotalCPUSec=total_us * 0.6 / 1000000.0, text=plan["text"], QueryText=plan["text"]))
+        return sorted(rows, key=lambda r: r["total_elapsed_time"], reverse=True)
+
+    def modifications(self, index):
+        """Modification counter; hot tables keep changing while the stand-in runs"""
+        growth = int(self.elapsed() * 50) if index["table"]["hot"] else 0
+        return index["modifications"] + growth
+
+    # -- statement handlers: wide rows, projected onto each statement's SELECT list -------
+
+    def _errorlog(self, sql, params):
+        entries = self.errorlog
+        search = re.search(r"sp_readerrorlog\s+0\s*,\s*1\s*,\s*'([^']*)'", sql, re.IGNORECASE)
+        if search:
+            entries = [e for e in entries if search.group(1).lower() in e[2].lower()]
+        return [_row(LogDate=d, ProcessInfo=p, Text=t) for d, p, t in entries]
+
+    def _sql_text(self, sql, params):
+        texts = {_hash(text, 20): text for text, _, _ in STATEMENTS}
+        texts.update((_hash(plan["text"], 20), plan["text"]) for plan in self.plans)
+        return [_row(sql_handle=bytes(h), text=texts[bytes(h)]) for h in params if bytes(h) in texts]
+
+    def _idle_sessions(self, sql, params):
+        return [_row(session_id=session_id, status="sleeping", login_name="pvault_app",
+                     host_name=f"PVAULT-WEB{session_id % 3 + 1}", program_name="pVault",
+                     open_transaction_count=1, IdleSec=120, most_recent_sql_handle=_hash(STATEMENTS[2][0], 20))
+                for session_id in params]
+
+    def _physical_stats(self, sql, params):
+        index = self.index_by_id.get(tuple(params[:2]))
+        if index is None or index["disabled"]:
+            return []
+        return [_row(avg_fragmentation_in_percent=index["fragmentation"], page_count=index["pages"])]
+
+    def _index_rows(self, sql, params):
+        patterns = like_patterns(sql, params)
+        rows = []
+        for index in self.indexes:
+            table = index["table"]
+            if not _matches(patterns, table["name"]):
+                continue
+            rows.append(_row(
+                object_id=index["object_id"], index_id=index["index_id"], SchemaName="dbo",
+                TableName=table["name"], IndexName=index["name"], IndexType=index["type"],
+                IsDisabled=index["disabled"], PageCount=index["pages"],
+                RowCnt=table["rows"], Modifications=self.modifications(index),
+                StatsUpdated=index["stats_updated"], IndexColumns=index["columns"]))
+        return rows
+
+    def _statistics(self, sql, params):
+        patterns = like_patterns(sql, params)
+        stale_only = "modification_counter > 1000" in sql
+        now = datetime.now()
+        rows = []
+        for index in self.indexes:
+            table = index["table"]
+            if not _matches(patterns, table["name"]):
+                continue
+            days = (now - index["stats_updated"]).days
+            modifications = self.modifications(index)
+            if stale_only and not (days > 7 or modifications > 1000):
+                continue
+            status = ("CRITICAL" if modifications > table["rows"] * 0.2 else
+                      "WARNING" if modifications > table["rows"] * 0.1 else
+                      "STALE" if days > 30 else "OK")
+            rows.append(_row(TableName=table["name"], StatisticName=index["name"],
+                             last_updated=index["stats_updated"], DaysOld=days, rows=table["rows"],
+                             ModificationsSinceUpdate=modifications, Status=status))
+        return sorted(rows, key=lambda r: (r["daysold"], r["modificationssinceupdate"]), reverse=True)
+
+    def _table_sizes(self, sql, params):
+        patterns = like_patterns(sql, params)
+        minimum = 100000 if "p.rows > 100000" in sql else -1
+        rows = []
+        for table in self.tables:
+            if table["rows"] <= minimum or not _matches(patterns, table["name"]):
+                continue
+            pages = sum(i["pages"] for i in self.indexes if i["table"] is table)
+            size_mb = pages * 8 / 1024.0
+            category = ("VERY LARGE" if table["rows"] > 10000000 else "LARGE" if table["rows"] > 1000000 else
+                        "MEDIUM" if table["rows"] > 100000 else "SMALL")
+            rows.append(_row(SchemaName="dbo", TableName=table["name"], RowCnt=table["rows"],
+                             TotalSpaceMB=size_mb, UsedSpaceMB=size_mb * 0.92, SizeMB=size_mb,
+                             SizeCategory=category))
+        return sorted(rows, key=lambda r: r["rowcnt"], reverse=True)
+
+    def _missing_indexes(self, sql, params):
+        patterns = like_patterns(sql, params)
+        database = self.settings["database"]
+        rows = []
+        for m in self.missing:
+            statement = f"[{database}].[dbo].[{m['table']['name']}]"
+            if not _matches(patterns, statement):
+                continue
+            columns = m["equality"] + ("," + m["inequality"] if m["inequality"] else "")
+            include = f" INCLUDE ({m['included']})" if m["included"] else ""
+            rows.append(_row(
+                IndexAdvantage=Decimal(f"{m['seeks'] * m['cost'] * m['impact'] * 0.01:.2f}"),
+                last_user_seek=datetime.now() - timedelta(minutes=m["handle"] % 50), TableName=statement,
+                equality_columns=m["equality"], EqualityColumns=m["equality"],
+                inequality_columns=m["inequality"], InequalityColumns=m["inequality"],
+                included_columns=m["included"], IncludedColumns=m["included"],
+                user_seeks=m["seeks"], UserSeeks=m["seeks"], avg_total_user_cost=m["cost"],
+                avg_user_impact=m["impact"], AvgUserImpact=m["impact"],
+                CreateStatement=f"CREATE INDEX IX_{m['table']['name']}_{m['handle']} ON {statement} ({columns}){include}"))
+        return sorted(rows, key=lambda r: r["indexadvantage"], reverse=True)
+
+    def _plan_cache(self, sql, params):
+        patterns = like_patterns(sql, params)
+        handles = {bytes(p) for p in params if isinstance(p, (bytes, bytearray))}
+        return [r for r in self.plan_stats() if _matches(patterns, r["text"])
+                and (not handles or r["plan_handle"] in handles)]
+
+    def _requests(self, sql, params):
+        rows = self.requests()
+        if "AS blocking" in sql:
+            by_session = {r["session_id"]: r for r in rows}
+            return [_row(BlockingSessionID=r["blocking_session_id"], BlockedSessionID=r["session_id"],
+                         WaitTimeSec=r["waitsec"], wait_type=r["wait_type"],
+                         BlockingQuery=by_session[r["blocking_session_id"]]["text"], BlockedQuery=r["text"])
+                    for r in rows if r["blocking_session_id"] in by_session]
+        if "total_elapsed_time > 30000" in sql:
+            blocked_too = "blocking_session_id > 0" in sql
+            rows = [r for r in rows if r["total_elapsed_time"] > 30000 or (blocked_too and r["blocking_session_id"])]
+        patterns = like_patterns(sql, params)
+        return [r for r in rows if _matches(patterns, r["text"])]
+
+    def _cpu(self, sql, params):
+        now = datetime.now()
+        count = len(self.cpu)
+        return [_row(record_id=count - n, EventTime=now - timedelta(minutes=n), SQL_CPU=cpu,
+                     SQLProcessUtilization=cpu, Other_CPU=min(100 - cpu, 5), System_Idle=max(95 - cpu, 0),
+                     SystemIdle=max(95 - cpu, 0))
+                for n, cpu in enumerate(self.cpu)]
+
+    def _memory(self, sql, params):
+        s = self.settings
+        return [_row(Memory_Used_MB=s["memory_mb"], MemoryMB=s["memory_mb"],
+                     physical_memory_in_use_kb=s["memory_mb"] * 1024, Total_VAS_MB=134217728,
+                     total_virtual_address_space_kb=137438953344,
+                     process_physical_memory_low=s["memory_low"], LowMemory=s["memory_low"],
+                     process_virtual_memory_low=False)]
+
+    def _wait_stats(self, sql, params):
+        return self.wait_stats()
+
+    def _connections(self, sql, params):
+        sessions = len(self.slots) + 25
+        return [_row(ActiveConnections=sessions, UniqueSessions=sessions)]
+
+    def _files(self, sql, params):
+        rows = []
+        for n, name in enumerate(self.databases):
+            data_mb = 1024.0 * (400 if n == 0 else 20 + 10 * n)
+            for file_type, suffix, size_mb in (("ROWS", "", data_mb), ("LOG", "_log", data_mb / 8)):
+                rows.append(_row(DatabaseName=name, FileType=file_type, FileName=f"{name}{suffix}",
+                                 Path=f"D:\\SQLData\\{name}{suffix}.{'ldf' if suffix else 'mdf'}",
+                                 SizeMB=size_mb, MaxSizeMB="Unlimited", GrowthMB=256.0))
+        return rows
+
+    def _databases(self, sql, params):
+        system = [] if "WHERE" in sql.upper() else ["master", "tempdb", "model", "msdb"]
+        offline = self.databases[len(self.databases) - self.settings["offline_databases"]:] \
+            if self.settings["offline_databases"] else []
+        rows = []
+        for database_id, name in enumerate(system + self.databases, 1 if system else 5):
+            state = "OFFLINE" if name in offline else "ONLINE"
+            rows.append(_row(name=name, DatabaseName=name, database_id=database_id,
+                             state_desc=state, Status=state, recovery_model_desc="FULL", RecoveryModel="FULL",
+                             compatibility_level=150, CompatibilityLevel=150, is_read_only=False, IsReadOnly=False,
+                             is_auto_close_on=False, AutoClose=False, is_auto_shrink_on=False, AutoShrink=False,
+                             page_verify_option_desc="CHECKSUM", PageVerifyOption="CHECKSUM"))
+        return sorted(rows, key=lambda r: r["name"])
+
+    def query_store_intervals(self):
+        """(runtime_stats_interval_id, start) of the hourly intervals up to the open one"""
+        first = (self.started_at - timedelta(days=QUERY_STORE_DAYS)).replace(minute=0, second=0, microsecond=0)
+        count = int((datetime.now() - first).total_seconds() // 3600) + 1
+        return [(n + 1, first + timedelta(hours=n)) for n in range(count)]
+
+    def _query_store_options(self, sql, params):
+        state = self.settings["query_store"]
+        return [_row(actual_state_desc=state, desired_state_desc=state,
+                     readonly_reason=0, current_storage_size_mb=412, max_storage_size_mb=1000,
+                     interval_length_minutes=60)]
+
+    def _query_store_runtime(self, sql, params):
+        if self.settings["query_store"] == "OFF":
+            return []
+        since = params[0] if params else 0
+        oldest = datetime.now() - timedelta(days=params[1] if len(params) > 1 else QUERY_STORE_DAYS)
+        patterns = like_patterns(sql, params)
+        rows = []
+        for interval_id, start in self.query_store_intervals():
+            if interval_id < since or start < oldest:
+                continue
+            rng = random.Random(self.settings["seed"] * 7919 + interval_id)
+            busy = 1.0 if 7 <= start.hour < 19 else 0.25
+            plan_id = 0
+            for query_id, (name, text, plans, per_hour) in enumerate(QUERY_STORE_QUERIES, 1):
+                if patterns and not (name and _matches(patterns, name)):
+                    plan_id += len(plans)
+                    continue
+                for seconds, reads, hours in plans:
+                    plan_id += 1
+                    if (hours is None) == any(start.hour in (p[2] or ()) for p in plans):
+                        continue  # the other plan is in use this hour
+                    executions = max(int(per_hour * busy * rng.uniform(0.6, 1.4)), 1)
+                    aborted = int(executions * rng.uniform(0.1, 0.3)) if seconds > 20 else 0
+                    common = dict(runtime_stats_interval_id=interval_id, IntervalStart=start,
+                                  IntervalEnd=start + timedelta(hours=1), plan_id=plan_id, query_id=query_id,
+                                  query_plan_hash=_hash(f"qs{plan_id}", 8), is_forced_plan=False, ObjectName=name,
+                                  avg_physical_io_reads=reads * 0.05)
+                    duration = seconds * rng.uniform(0.7, 1.3)
+                    rows.append(_row(runtime_stats_id=interval_id * 100 + plan_id * 2, execution_type=0,
+                                     execution_type_desc="Regular", count_executions=executions - aborted,
+                                     avg_duration=duration * 1e6, max_duration=duration * 3.5e6,
+                                     avg_cpu_time=duration * 0.55e6, avg_logical_io_reads=reads, **common))
+                    if aborted:
+                        rows.append(_row(runtime_stats_id=interval_id * 100 + plan_id * 2 + 1, execution_type=3,
+                                         execution_type_desc="Aborted", count_executions=aborted,
+                                         avg_duration=30e6, max_duration=30.2e6, avg_cpu_time=17e6,
+                                         avg_logical_io_reads=reads * 1.2, **common))
+        return rows
+
+    def _query_store_texts(self, sql, params):
+        return [_row(query_id=query_id, query_hash=_hash(f"qsq{query_id}", 8), query_sql_text=text)
+                for query_id, (_, text, _, _) in enumerate(QUERY_STORE_QUERIES, 1) if query_id in params]
+
+    def xe_events(self):
+        """(time, XML) of the timeout events captured so far, oldest first: an attention then the aborted call"""
+        rate = self.settings["xe_timeouts_per_hour"]
+        if self.xe_since is None or not rate:
+            return []
+        period = 3600.0 / rate
+        count = int((datetime.now() - self.xe_since).total_seconds() // period)
+        events = []
+        for k in range(count):
+            at = self.xe_since + timedelta(seconds=(k + 1) * period)
+            index = 6 if k % 3 == 2 else 0
+            text = STATEMENTS[index][0]
+            session_id = 51 + k % 40
+            actions = {"client_app_name": "pVault", "client_hostname": f"PVAULT-WEB{k % 3 + 1}",
+                       "database_name": self.settings["database"],
+                       "query_hash": int.from_bytes(_hash(f"q{index}", 8), "big"), "session_id": session_id}
+            if k % 5 != 4:  # every fifth call is killed rather than timed out: no attention
+                events.append((at, self._xe_event("attention", at, {"duration": 30000000 + k},
+                                                  dict(actions, sql_text=text))))
+            name, field = ("sql_batch_completed", "batch_text") if k % 4 == 3 else ("rpc_completed", "statement")
+            completed = at + timedelta(milliseconds=2)
+            events.append((completed, self._xe_event(name, completed,
+                                                     {"duration": 30000000 + k * 1000, "cpu_time": 17000000,
+                                                      "logical_reads": 3800000, "result": (2, "Abort"), field: text},
+                                                     actions)))
+        return events
+
+    def _xe_event(self, name, at, data, actions):
+        stamp = at.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+        parts = [f'<event name="{name}" package="sqlserver" timestamp="{stamp}">']
+        for field, value in data.items():
+            if isinstance(value, tuple):
+                parts.append(f'<data name="{field}"><value>{value[0]}</value><text>{value[1]}</text></data>')
+            else:
+                parts.append(f'<data name="{field}"><value>{escape(str(value))}</value></data>')
+        for action, value in actions.items():
+            parts.append(f'<action name="{action}" package="sqlserver"><value>{escape(str(value))}</value></action>')
+        parts.append("</event>")
+        return "".join(parts)
+
+    def deadlock_events(self):
+        """(time, XML) of the deadlock reports system_health captured so far, oldest first"""
+        rate = self.settings["deadlocks_per_hour"]
+        if not self.settings["system_health"] or not rate:
+            return []
+        period = 3600.0 / rate
+        since = self.started_at - timedelta(hours=SYSTEM_HEALTH_HOURS)
+        count = int((datetime.now() - since).total_seconds() // period)
+        with self.lock:
+            while len(self.deadlocks) < count:
+                k = len(self.deadlocks)
+                at = since + timedelta(seconds=(k + 1) * period)
+                self.deadlocks.append((at, self._deadlock_event(k, at)))
+            return self.deadlocks[:count]
+
+    def system_health_events(self):
+        """(time, XML) of everything system_health captured so far: the deadlock reports between
+        the sp_server_diagnostics results written every few minutes, oldest first"""
+        if not self.settings["system_health"]:
+            return []
+        since = self.started_at - timedelta(hours=SYSTEM_HEALTH_HOURS)
+        count = int((datetime.now() - since).total_seconds() // SYSTEM_HEALTH_DIAGNOSTICS_SECONDS)
+        diagnostics = []
+        for k in range(count):
+            at = since + timedelta(seconds=(k + 1) * SYSTEM_HEALTH_DIAGNOSTICS_SECONDS)
+            stamp = at.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+            diagnostics.extend((at, f'<event name="sp_server_diagnostics_component_result" package="sqlserver" '
+                                    f'timestamp="{stamp}"><data name="component"><text>{component.upper()}</text>'
+                                    f'</data><data name="state"><text>CLEAN</text></data></event>')
+                               for component in SYSTEM_HEALTH_COMPONENTS)
+        return sorted(diagnostics + self.deadlock_events(), key=lambda event: event[0])
+
+    def _deadlock_event(self, k, at):
+        """Two shapes: invoice approval against status updates (either listed first), and an
+        invoice load against the audit insert; literals differ between reports of one shape"""
+        database = self.settings["database"]
+        first, second = 51 + k % 40, 91 + k % 30
+        if k % 5 < 4:
+            processes = [
+                (first, f"{database}.dbo.ApproveInvoiceBatch", "UPDATE dbo.Invoices SET StatusID = 4 "
+                 "WHERE BatchID = @BatchID", f"EXEC dbo.ApproveInvoiceBatch @BatchID = {7000 + k}", "U"),
+                (second, "unknown", f"UPDATE dbo.InvoiceStatus SET StatusID = {k % 6 + 1}, ModifiedAt = GETDATE() "
+                 f"WHERE InvoiceID = {150000 + k * 13}", "(@p1 int,@p2 int)UPDATE dbo.InvoiceStatus", "X"),
+            ]
+            resources = [("keylock", f"{database}.dbo.Invoices", "PK_Invoices"),
+                         ("keylock", f"{database}.dbo.InvoiceStatus", "PK_InvoiceStatus")]
+            if k % 2:
+                processes.reverse()
+        else:
+            processes = [
+                (first, f"{database}.dbo.LoadInvoicesByStatusID", "SELECT i.InvoiceID, i.VendorID, i.Amount "
+                 "FROM dbo.Invoices i WHERE i.StatusID = @StatusID", "Proc [Database Id = 7 Object Id = 981578535]", "S"),
+                (second, "adhoc", f"INSERT INTO dbo.AuditLog (EventType, UserID, CreatedAt) VALUES ({k % 9}, "
+                 f"{k % 200}, GETDATE())", "INSERT INTO dbo.AuditLog", "IX"),
+            ]
+            resources = [("pagelock", f"{database}.dbo.AuditLog", None),
+                         ("keylock", f"{database}.dbo.Invoices", "IX_Invoices_StatusID")]
+        victim = processes[k // 2 % 2][0]
+        parts = [f'<deadlock><victim-list><victimProcess id="process{victim}"/></victim-list><process-list>']
+        for spid, procedure, statement, inputbuf, mode in processes:
+            parts.append(f'<process id="process{spid}" waittime="{1000 + k % 4000}" lockMode="{mode}" spid="{spid}" '
+                         f'clientapp="pVault" hostname="PVAULT-WEB{k % 3 + 1}" loginname="pvault_app" '
+                         f'isolationlevel="read committed (2)" currentdb="7" currentdbname="{database}">'
+                         f'<executionStack><frame procname="{procedure}" line="{12 + k % 3}">{escape(statement)}'
+                         f'</frame></executionStack><inputbuf>{escape(inputbuf)}</inputbuf></process>')
+        parts.append("</process-list><resource-list>")
+        for n, (kind, name, index) in enumerate(resources):
+            owner, waiter = processes[n][0], processes[1 - n][0]
+            parts.append(f'<{kind} dbid="7" objectname="{name}"' + (f' indexname="{index}"' if index else "")
+                         + f' mode="X"><owner-list><owner id="process{owner}" mode="X"/></owner-list>'
+                         f'<waiter-list><waiter id="process{waiter}" mode="U" requestType="wait"/></waiter-list></{kind}>')
+        parts.append("</resource-list></deadlock>")
+        stamp = at.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+        return (f'<event name="xml_deadlock_report" package="sqlserver" timestamp="{stamp}">'
+                f'<data name="xml_report"><type name="xml" package="package0"/><value>{"".join(parts)}</value>'
+                f'</data></event>')
+
+    def _xe_target(self, session):
+        """(events, events per file, files kept, ring buffer events) of a session's target.
+
+        Only events of buffers already dispatched are visible; a buffer never changes once written.
+        """
+        if session == "system_health":
+            events, shape = self.system_health_events(), (SYSTEM_HEALTH_EVENTS_PER_FILE, 5, SYSTEM_HEALTH_RING_BUFFER_EVENTS)
+        else:
+            events, shape = self.xe_events(), (XE_EVENTS_PER_FILE, XE_ROLLOVER_FILES, XE_RING_BUFFER_EVENTS)
+        dispatched = time.time() // XE_DISPATCH_SECONDS
+        return [(int(at.timestamp() // XE_DISPATCH_SECONDS), xml) for at, xml in events
+                if at.timestamp() // XE_DISPATCH_SECONDS < dispatched], *shape
+
+    def _xe_targets(self, session):
+        if session == "system_health":
+            targets = self.settings["system_health"]
+            return ["event_file", "ring_buffer"] if targets == "event_file" else [targets] if targets else []
+        return [self.xe_session] if self.xe_running else []
+
+    def xe_file(self, index, session="pvault_timeouts"):
+        return f"{XE_LOG_DIR}\\{session}_0_{133000000000000000 + index}.xel"
+
+    def _xe_sessions(self, sql, params):
+        if self.xe_session is None:
+            return []
+        return [_row(name="pvault_timeouts", TargetName=self.xe_session, Running=int(self.xe_running))]
+
+    def _xe_create(self, sql, params):
+        if not self.settings["xe_permission"]:
+            raise ProgrammingError("42000", "[42000] User does not have permission to perform this action. (15247)")
+        self.xe_session = "ring_buffer" if "ring_buffer" in sql else "event_file"
+        return []
+
+    def _xe_start(self, sql, params):
+        if not self.settings["xe_permission"]:
+            raise ProgrammingError("42000", "[42000] User does not have permission to perform this action. (15247)")
+        if not self.xe_running:
+            self.xe_running = True
+            self.xe_since = datetime.now()
+        return []
+
+    def _xe_session_targets(self, sql, params):
+        return [_row(TargetName=target) for target in self._xe_targets(params[0])]
+
+    def _xe_file_name(self, sql, params):
+        session = params[0]
+        if "event_file" not in self._xe_targets(session):
+            return []
+        events, per_file, _, _ = self._xe_target(session)
+        return [_row(FileName=self.xe_file(max(len(events) - 1, 0) // per_file, session))]
+
+    def _xe_read_file(self, sql, params):
+        session = ntpath.basename(params[0]).partition("*")[0]
+        events, per_file, kept, _ = self._xe_target(session)
+        # file_offset: one 4 KB step per dispatched buffer, counted from the first buffer of the file
+        positions = [(i // per_file, (buffer - events[i - i % per_file][0] + 1) * 4096)
+                     for i, (buffer, _) in enumerate(events)]
+        oldest = max(positions[-1][0] - kept + 1, 0) if positions else 0
+        after = None
+        if len(params) > 2 and params[1] is not None:
+            files = {self.xe_file(n, session): n for n in range(oldest, positions[-1][0] + 1)} if positions else {}
+            if params[1] not in files:
+                raise OperationalError("S0001", f"[S0001] The file \"{params[1]}\" could not be found. (25718)")
+            after = (files[params[1]], params[2])
+        # The readers filter on object_name in a WHERE clause or blank other events with CASE WHEN
+        wanted = re.search(r"object_name = N'(\w+)'", sql)
+        rows = []
+        for (n, offset), (_, event) in zip(positions, events):
+            if n < oldest or (after is not None and (n, offset) <= after):
+                continue
+            if wanted and _event_name(event) != wanted.group(1):
+                if "CASE WHEN" not in sql:
+                    continue
+                event = None
+            rows.append(_row(file_name=self.xe_file(n, session), file_offset=offset, event_data=event))
+        return rows
+
+    def _xe_ring_buffer(self, sql, params):
+        session = params[0]
+        if "ring_buffer" not in self._xe_targets(session):
+            return []
+        events, _, _, buffered = self._xe_target(session)
+        events = events[-buffered:]
+        wanted = re.search(r'event\[@name="(\w+)"\]', sql)
+        if wanted:
+            events = [(buffer, event) for buffer, event in events if _event_name(event) == wanted.group(1)]
+        return [_row(TargetData=f'<RingBufferTarget truncated="0" eventCount="{len(events)}">'
+                                + "".join(event for _, event in events) + "</RingBufferTarget>")]
+
+    def _server(self, sql, params):
+        version = ("Microsoft SQL Server 2019 (RTM-CU22) (KB5027702) - 15.0.4322.2 (X64)\n"
+                   "\tStandard Edition (64-bit) on Windows Server 2019 Standard 10.0 <X64> (pVault stand-in)")
+        return [_row(Version=version, ServerName=self.settings["server_name"], Edition="Standard Edition (64-bit)",
+                     ProductLevel="RTM", ProductVersion="15.0.4322.2")]
+
+    # (text that identifies the statement, latency key, handler, columns when there is no SELECT list),
+    # most specific first
+    HANDLERS = [
+        ("sp_readerrorlog", "sp_readerrorlog", _errorlog, ("LogDate", "ProcessInfo", "Text")),
+        ("FROM (VALUES", "dm_exec_sql_text", _sql_text, None),
+        ("CREATE EVENT SESSION", "dm_xe_sessions", _xe_create, ()),
+        ("ALTER EVENT SESSION", "dm_xe_sessions", _xe_start, ()),
+        ("fn_xe_file_target_read_file", "xe_file_target", _xe_read_file, None),
+        ("EventFileTarget", "dm_xe_sessions", _xe_file_name, None),
+        ("'ring_buffer'", "dm_xe_sessions", _xe_ring_buffer, None),
+        ("target_name AS TargetName", "dm_xe_sessions", _xe_session_targets, None),
+        ("server_event_sessions", "dm_xe_sessions", _xe_sessions, None),
+        ("database_query_store_options", "query_store", _query_store_options, None),
+        ("query_store_query_text", "query_store", _query_store_texts, None),
+        ("query_store_runtime_stats", "query_store", _query_store_runtime, None),
+        ("dm_exec_sessions", "dm_exec_sessions", _idle_sessions, None),
+        ("dm_db_index_physical_stats", "dm_db_index_physical_stats", _physical_stats, None),
+        ("dm_db_partition_stats", "dm_db_partition_stats", _index_rows, None),
+        ("sys.allocation_units", "sys.allocation_units", _table_sizes, None),
+        ("dm_db_missing_index_details", "dm_db_missing_index_details", _missing_indexes, None),
+        ("sys.index_columns", "sys.indexes", _index_rows, None),
+        ("dm_db_stats_properties", "dm_db_stats_properties", _statistics, None),
+        ("dm_exec_query_stats", "dm_exec_query_stats", _plan_cache, None),
+        ("dm_exec_requests", "dm_exec_requests", _requests, None),
+        ("dm_os_ring_buffers", "dm_os_ring_buffers", _cpu, None),
+        ("dm_os_process_memory", "dm_os_process_memory", _memory, None),
+        ("dm_os_wait_stats", "dm_os_wait_stats", _wait_stats, None),
+        ("dm_exec_connections", "dm_exec_connections", _connections, None),
+        ("sys.master_files", "sys.master_files", _files, None),
+        ("sys.databases", "sys.databases", _databases, None),
+        ("@@SERVERNAME", "serverproperty", _server, None),
+        ("@@VERSION", "serverproperty", _server, None),
+    ]
+
+    def answer(self, sql, params):
+        """(result sets, seconds of latency) for one statement or batch"""
+        if self.recorded is not None:
+            with self.lock:
+                sets = self.recorded.sets(sql, params)
+            if sets is not None:
+                return sets, self.latency("recorded")
+
+        statements = [sql]
+        if sql.lstrip().upper().startswith("SET NOCOUNT ON;"):
+            statements = [s for s in sql.lstrip()[len("SET NOCOUNT ON;"):].split(";\n") if s.strip(" ;\n")]
+        sets, delay = [], 0.0
+        for statement in statements:
+            for marker, key, handler, fixed_columns in self.HANDLERS:
+                if marker in statement:
+                    break
+            else:
+                raise StandinError(f"[42000] pVault stand-in has no data for: {normalize_sql(statement)[:120]}")
+            rows = handler(self, statement, params)
+            columns, limit = select_columns(statement)
+            columns = columns or fixed_columns
+            if "*" in columns:
+                columns = tuple(rows[0]) if rows else ()
+            sets.append((list(columns), [[row.get(c.lower()) for c in columns] for row in rows[:limit]]))
+            delay += self.latency(key)
+        with self.lock:
+            self.executions += 1
+        return sets, delay
+
+    def latency(self, key):
+        latency = self.settings["latency"]
+        seconds = latency.get(key, latency.get("default", 0.0))
+        jitter = self.settings["jitter"]
+        if seconds and jitter:
+            seconds *= 1 + random.uniform(-jitter, jitter)
+        return seconds
+
+class StandinCursor(BufferedCursor):
+    record_name = 'standin'
+
+    def __init__(self, connection):
+        super().__init__()
+        self.connection = connection
+        # Like pyodbc: the statement timeout is Connection.timeout when the cursor is created
+        self.timeout = connection.timeout
+        self.canceled = threading.Event()
+        self.rowcount = -1
+
+    def execute(self, sql, *params):
+        if len(params) == 1 and isinstance(params[0], (list, tuple)):
+            params = tuple(params[0])
+        self.canceled.clear()
+        sets, delay = self.connection.server.answer(sql, params)
+        timeout = self.timeout
+        if delay > 0:
+            # cancel() interrupts from another thread
+            if self.canceled.wait(min(delay, timeout) if timeout else delay):
+                raise OperationalError("HY008", "[HY008] Operation canceled")
+            if timeout and delay > timeout:
+                raise OperationalError("HYT00", "[HYT00] Query timeout expired")
+        self._load(sets)
+        return self
+
+    def cancel(self):
+        self.canceled.set()
+
+class StandinConnection:
+    """pyodbc-style connection to a StandinServer"""
+
+    def __init__(self, server, timeout=0):
+        self.server = server
+        self.timeout = timeout  # statement timeout in seconds, 0 = none (pyodbc semantics)
+        self.autocommit = False
+        self.closed = False
+
+    def cursor(self):
+        if self.closed:
+            raise ProgrammingError("Attempt to use a closed connection.")
+        return StandinCursor(self)
+
+    def execute(self, sql, *params):
+        return self.cursor().execute(sql, *params)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+def parse_spec(spec):
+    """Settings for a PVAULT_STANDIN value: synthetic[:key=value,...], a .json file or a recording"""
+    if spec.endswith(".gz"):
+        return {"recording": spec}
+    if spec.endswith(".json"):
+        with open(spec) as f:
+            return _checked(json.load(f))
+    name, _, overrides = spec.partition(":")
+    if name != "synthetic":
+        raise ValueError(f"Unknown stand-in '{spec}' (expected synthetic[:key=value,...], a .json file or a .dmv.gz recording)")
+    settings = {}
+    for item in filter(None, overrides.split(",")):
+        key, _, value = item.partition("=")
+        if key.startswith("latency."):
+            settings.setdefault("latency", {})[key[len("latency."):]] = float(value)
+        elif key not in DEFAULTS:
+            raise ValueError(f"Unknown stand-in setting '{key}'")
+        else:
+            try:
+                settings[key] = json.loads(value) if value and value[:1] in "0123456789-[{tf" else value
+            except ValueError:
+                settings[key] = value  # left for the type check to report
+    return _checked(settings)
+
+def _checked(settings):
+    """Settings with a scalar latency taken as the default one, each value of its default's type"""
+    if "latency" in settings and not isinstance(settings["latency"], dict):
+        settings["latency"] = {"default": settings["latency"]}
+    for key, value in settings.items():
+        default = DEFAULTS.get(key)
+        if key == "latency":
+            ok = all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in value.values())
+        elif default is None:  # recording: a file name or nothing
+            ok = value is None or isinstance(value, str)
+        elif isinstance(default, bool):
+            ok = isinstance(value, bool)
+        elif isinstance(default, (int, float)):
+            ok = isinstance(value, int if isinstance(default, int) else (int, float)) and not isinstance(value, bool)
+        else:
+            ok = isinstance(value, type(default))
+        if not ok:
+            raise ValueError(f"Stand-in setting '{key}' must be {_kind(default)}, not {value!r}")
+    return settings
+
+def _kind(default):
+    if isinstance(default, dict):
+        return "seconds or a mapping of DMV to seconds"
+    if default is None:
+        return "a file name"
+    return {bool: "true or false", int: "a whole number", float: "a number", str: "text"}[type(default)]
+
+_servers = {}
+_servers_lock = threading.Lock()
+
+def standin_server(spec):
+    """The StandinServer for a spec, shared by every connection of the process"""
+    if isinstance(spec, StandinServer):
+        return spec
+    with _servers_lock:
+        server = _servers.get(spec)
+        if server is None:
+            server = _servers[spec] = StandinServer(parse_spec(spec))
+        return server
+
+def main():
+    parser = argparse.ArgumentParser(description='Show what the stand-in server answers')
+    parser.add_argument('spec', nargs='?', default='synthetic', help='synthetic[:key=value,...], settings .json or recording')
+    parser.add_argument('--sql', help='statement to run (default: summary of the synthetic instance)')
+    args = parser.parse_args()
+
+    server = standin_server(args.spec)
+    if not args.sql:
+        s = server.settings
+        print(f"Stand-in {s['server_name']}: {len(server.databases)} databases, {len(server.tables)} tables, "
+              f"{len(server.indexes)} indexes, {s['requests']} requests ({s['blocked']} blocked), "
+              f"{len(server.plans)} cached plans")
+        print(f"Latency: {s['latency']} (jitter {s['jitter']:.0%})")
+        return
+    cursor = server.connect().cursor().execute(args.sql)
+    while True:
+        if cursor.description:
+            print(" | ".join(column[0] for column in cursor.description))
+            for row in cursor.fetchall():
+                print(" | ".join(str(value) for value in row))
+        if not cursor.nextset():
+            break
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""
+Fleet mode for the pVault query monitor
+Samples several SQL Server instances concurrently on one shared clock into one log tagged by server
+
+Targets file (JSON list); port defaults to 1433 and database to the pVault database:
+[
+    {"name": "pvault", "server": "inscolpvault.insulationsinc.local", "port": 55859},
+    {"name": "erp", "server": "erp-sql.insulationsinc.local", "database": "ERP"}
+]
+"""
+
+import json
+import os
+import sys
+from datetime import datetime
+
+from collector_scheduler import CollectorScheduler
+from metrics_exporter import MetricsExporter, MetricsRegistry
+from monitor_query_performance import (QueryMonitor, DATABASE, EXPORT_METRICS, LOG_FORMAT,
+                                       STATS_REPORT_SECONDS, STATUS_SECONDS)
+from perf_log import LockedLogWriter, columnar_available, open_log_writer
+
+try:
+    from log_analysis import LogAnalyzer
+except ImportError:  # numpy not installed; analysis is skipped
+    LogAnalyzer = None
+
+TARGETS_FILE = "fleet_targets.json"
+DEFAULT_PORT = 1433
+FLEET_LOG_FILE = f"fleet_performance_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+FLEET_LOG_DIR = FLEET_LOG_FILE[:-len(".csv")]
+
+def load_targets(path=TARGETS_FILE):
+    """Read and validate the targets list"""
+    with open(path) as f:
+        targets = json.load(f)
+    if not isinstance(targets, list) or not targets:
+        raise ValueError(f"{path} must contain a non-empty JSON list of targets")
+
+    names = set()
+    for target in targets:
+        if not target.get("server"):
+            raise ValueError(f"Target without a server in {path}: {target}")
+        target.setdefault("name", target["server"])
+        target.setdefault("port", DEFAULT_PORT)
+        target.setdefault("database", DATABASE)
+        if target["name"] in names:
+            raise ValueError(f"Duplicate target name in {path}: {target['name']}")
+        names.add(target["name"])
+    return targets
+
+class FleetMonitor:
+    """One QueryMonitor per target; every collector has its own thread and connection,
+    so a slow or unreachable instance only delays its own collectors"""
+
+    def __init__(self, targets, username, password):
+        self.monitors = [
+            QueryMonitor(username, password, t["server"], t["port"], t["database"], name=t["name"])
+            for t in targets
+        ]
+        self.scheduler = None
+        self.exporter = None
+        self.log_writer = None
+        self.log_path = FLEET_LOG_DIR if LOG_FORMAT == "columnar" else FLEET_LOG_FILE
+
+    def setup_logging(self):
+        """One log shared by all monitors; the Server column tells instances apart"""
+        log_format = LOG_FORMAT
+        if log_format == "columnar" and not columnar_available():
+            print("⚠ numpy is not installed - falling back to CSV logging")
+            log_format = "csv"
+        self.log_path = FLEET_LOG_DIR if log_format == "columnar" else FLEET_LOG_FILE
+        self.log_writer = LockedLogWriter(open_log_writer(self.log_path, log_format))
+        for monitor in self.monitors:
+            monitor.log_writer = self.log_writer
+            monitor.log_path = self.log_path
+        print(f"✓ Logging to {self.log_path}")
+
+    def print_status(self):
+        """One status line per instance"""
+        now = datetime.now().strftime('%H:%M:%S')
+        for monitor in self.monitors:
+            requests = monitor.collectors["requests"]
+            if requests.failing:
+                print(f"[{now}] {monitor.prefix}UNREACHABLE ({requests.last_error})")
+            else:
+                print(f"[{now}] {monitor.prefix}{monitor.last_query_count} active queries, "
+                      f"sampling every {monitor.interval.current:.1f}s")
+
+    def report(self):
+        for monitor in self.monitors:
+            if monitor.collectors["requests"].runs:
+                monitor.get_performance_stats()
+                monitor.print_query_summary()
+                monitor.print_latency_summary()
+        self.scheduler.print_report()
+
+    def run(self):
+        self.setup_logging()
+        self.scheduler = CollectorScheduler()
+        for monitor in self.monitors:
+            monitor.add_collectors(self.scheduler, reports=False)
+        self.scheduler.add("status", STATUS_SECONDS, self.print_status, delay=STATUS_SECONDS)
+        self.scheduler.add("report", STATS_REPORT_SECONDS, self.report, delay=STATS_REPORT_SECONDS)
+        if EXPORT_METRICS:
+            self.start_exporter()
+
+        print(f"\n✓ Monitoring {len(self.monitors)} instances: "
+              f"{', '.join(m.name for m in self.monitors)}")
+        print("Press Ctrl+C to stop monitoring\n")
+        try:
+            self.scheduler.start()
+            self.scheduler.wait()
+        except KeyboardInterrupt:
+            print("\n\n✓ Monitoring stopped")
+        finally:
+            self.cleanup()
+
+    def start_exporter(self):
+        """One endpoint for the fleet; series carry a server label"""
+        registry = MetricsRegistry()
+        registry.watch_scheduler(self.scheduler)
+        for monitor in self.monitors:
+            monitor.metrics = registry
+        self.exporter = MetricsExporter(registry)
+        if not self.exporter.start():
+            self.exporter = None
+            for monitor in self.monitors:
+                monitor.metrics = None
+
+    def cleanup(self):
+        if self.exporter:
+            self.exporter.stop()
+        if self.scheduler:
+            self.scheduler.stop()
+            self.scheduler.print_report()
+        if self.log_writer:
+            self.log_writer.close()
+            print(f"✓ Performance log saved to {self.log_path}")
+        for monitor in self.monitors:
+            sketches = monitor.save_sketches()
+            if sketches:
+                print(f"✓ {monitor.prefix}Latency sketches saved to {sketches}")
+
+    def analyze_log(self):
+        """Per-instance analysis of the shared log"""
+        if LogAnalyzer is None:
+            print("Install numpy to analyze fleet logs (pip install numpy)")
+            return
+        for monitor in self.monitors:
+            print("\n" + "="*60)
+            print(f"PERFORMANCE ANALYSIS - {monitor.name}")
+            print("="*60)
+            LogAnalyzer(server=monitor.name).analyze([self.log_path]).print_summary()
+
+def main():
+    print("="*60)
+    print("QUERY PERFORMANCE MONITOR - FLEET MODE")
+    print("="*60)
+
+    path = sys.argv[1] if len(sys.argv) > 1 else TARGETS_FILE
+    if not os.path.exists(path):
+        print(f"Targets file not found: {path}")
+        print("Usage: python fleet_monitor.py [targets.json]")
+        sys.exit(1)
+    try:
+        targets = load_targets(path)
+    except ValueError as e:
+        print(f"✗ {e}")
+        sys.exit(1)
+
+    for target in targets:
+        print(f"  {target['name']}: {target['server']}:{target['port']} / {target['database']}")
+
+    username = input("\nSQL Username: ")
+    password = input("SQL Password: ")
+
+    fleet = FleetMonitor(targets, username, password)
+    fleet.run()
+
+    choice = input("\nAnalyze collected data? (Y/N): ").lower()
+    if choice == 'y':
+        fleet.analyze_log()
+
+if __name__ == "__main__":
+    main()
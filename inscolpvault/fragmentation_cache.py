@@ -0,0 +1,253 @@
+"""
+Change-aware index fragmentation cache for pVault health checks
+Rescans only indexes that changed since their last scan, within a time budget per run
+"""
+
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from sql_connection import STATE_DIR
+
+FRAGMENTATION_CACHE_FILE = os.path.join(STATE_DIR, "fragmentation_cache.json")
+SCAN_BUDGET_SECONDS = 60     # dm_db_index_physical_stats time per run; the rest comes from cache
+MODIFICATION_RATIO = 0.05    # rescan after modifications to 5% of the rows...
+MIN_MODIFICATIONS = 1000     # ...but never for fewer than this many
+PAGE_CHANGE_RATIO = 0.05     # rescan when the page count moved by 5%...
+MIN_PAGE_CHANGE = 100        # ...and by at least this many pages
+MAX_CACHE_AGE_DAYS = 7       # rescan anything older than this even if it looks unchanged
+
+# One row per named index: size from dm_db_partition_stats and the modification counter of
+# the index statistics; metadata only, no index pages are read
+INVENTORY_QUERY = """
+SELECT
+    i.object_id,
+    i.index_id,
+    s.name AS SchemaName,
+    t.name AS TableName,
+    i.name AS IndexName,
+    i.type_desc AS IndexType,
+    i.is_disabled AS IsDisabled,
+    ISNULL(ps.PageCount, 0) AS PageCount,
+    ISNULL(ps.RowCnt, 0) AS RowCnt,
+    sp.modification_counter AS Modifications,
+    sp.last_updated AS StatsUpdated
+FROM sys.tables t
+INNER JOIN sys.schemas s ON t.schema_id = s.schema_id
+INNER JOIN sys.indexes i ON t.object_id = i.object_id
+OUTER APPLY (
+    SELECT SUM(p.used_page_count) AS PageCount, SUM(p.row_count) AS RowCnt
+    FROM sys.dm_db_partition_stats p
+    WHERE p.object_id = i.object_id AND p.index_id = i.index_id
+) ps
+OUTER APPLY sys.dm_db_stats_properties(i.object_id, i.index_id) sp
+WHERE i.name IS NOT NULL{}
+"""
+
+SCAN_QUERY = """
+SELECT avg_fragmentation_in_percent, page_count
+FROM sys.dm_db_index_physical_stats(DB_ID(), ?, ?, NULL, 'LIMITED')
+WHERE alloc_unit_type_desc = 'IN_ROW_DATA'
+"""
+
+# status: scanned (this run), cached (unchanged), deferred (changed, over budget; cached value),
+# unscanned (never scanned, over budget), empty (no pages to scan)
+IndexFragmentation = namedtuple('IndexFragmentation', [
+    'object_id', 'index_id', 'schema', 'table', 'index', 'index_type', 'is_disabled',
+    'fragmentation', 'page_count', 'status', 'reason', 'age_seconds'])
+
+_cache_lock = threading.Lock()
+
+def format_age(seconds):
+    """Short age for report lines, e.g. 45s, 20m, 5h, 3d"""
+    if seconds is None:
+        return "never"
+    for unit, size in (('d', 86400), ('h', 3600), ('m', 60)):
+        if seconds >= size:
+            return f"{seconds // size:.0f}{unit}"
+    return f"{seconds:.0f}s"
+
+def describe(index):
+    """Suffix for a fragmentation figure telling how fresh it is"""
+    if index.status == 'scanned':
+        return "(scanned now)"
+    if index.status == 'deferred':
+        return f"(cached {format_age(index.age_seconds)} ago, rescan deferred: {index.reason})"
+    if index.status == 'cached':
+        return f"(cached {format_age(index.age_seconds)} ago)"
+    return ""
+
+def _load(cache_file):
+    try:
+        with open(cache_file, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+class FragmentationCache:
+    """Per-index dm_db_index_physical_stats results for one database, kept between runs"""
+
+    def __init__(self, connection, server, database, budget=SCAN_BUDGET_SECONDS,
+                 cache_file=FRAGMENTATION_CACHE_FILE):
+        self.connection = connection
+        self.key = f"{server}/{database}".lower()
+        self.budget = budget
+        self.cache_file = cache_file
+        self.entries = _load(cache_file).get(self.key, {})
+        self.scanned = set()  # keys rescanned by the last refresh()
+        self.deferred = 0
+        self.scan_seconds = 0.0
+
+    def _change_reason(self, entry, row, now):
+        """Why an index needs a rescan, or None if its cached result still holds"""
+        if entry is None:
+            return "never scanned"
+        if entry["index"] != row.IndexName:
+            return "index recreated"
+        stats_updated = row.StatsUpdated.isoformat() if row.StatsUpdated else None
+        if stats_updated != entry["stats_updated"]:
+            # Rebuilds update statistics, so a cached fragmentation may be obsolete
+            return "statistics updated"
+        if row.Modifications is not None:
+            modifications = row.Modifications - (entry["modifications"] or 0)
+            if modifications >= max(MIN_MODIFICATIONS, MODIFICATION_RATIO * max(row.RowCnt, entry["rows"])):
+                return f"{modifications:,} modifications"
+        page_change = abs(row.PageCount - entry["inventory_pages"])
+        if page_change >= max(MIN_PAGE_CHANGE, PAGE_CHANGE_RATIO * entry["inventory_pages"]):
+            return f"pages {entry['inventory_pages']:,} -> {row.PageCount:,}"
+        if now - datetime.fromisoformat(entry["scanned_at"]) > timedelta(days=MAX_CACHE_AGE_DAYS):
+            return f"older than {MAX_CACHE_AGE_DAYS} days"
+        return None
+
+    def _seconds_per_page(self):
+        """Scan cost observed on earlier runs, used to skip scans that cannot finish in budget"""
+        pages = sum(e["page_count"] or 0 for e in self.entries.values())
+        seconds = sum(e["scan_seconds"] for e in self.entries.values())
+        return seconds / pages if pages and seconds else None
+
+    def _scan(self, row, now):
+        cursor = self.connection.cursor()
+        start = time.perf_counter()
+        cursor.execute(SCAN_QUERY, row.object_id, row.index_id)
+        partitions = cursor.fetchall()
+        elapsed = time.perf_counter() - start
+
+        pages = sum(p.page_count for p in partitions)
+        fragmentation = None
+        if pages:
+            fragmentation = sum(p.avg_fragmentation_in_percent * p.page_count for p in partitions) / pages
+        key = f"{row.object_id}.{row.index_id}"
+        self.entries[key] = {
+            "index": row.IndexName,
+            "fragmentation": fragmentation,
+            "page_count": pages,
+            "inventory_pages": row.PageCount,
+            "rows": row.RowCnt,
+            "modifications": row.Modifications,
+            "stats_updated": row.StatsUpdated.isoformat() if row.StatsUpdated else None,
+            "scanned_at": now.isoformat(timespec="seconds"),
+            "scan_seconds": round(elapsed, 3),
+        }
+        self.scanned.add(key)
+        self.scan_seconds += elapsed
+
+    def refresh(self, table_patterns=None):
+        """IndexFragmentation for every named index (tables matching any LIKE pattern, if given).
+
+        Changed indexes are rescanned, most changed first, until the budget is
+        used up; everything else is served from the cache with its age.
+        """
+        where = ""
+        params = []
+        if table_patterns:
+            where = "\n    AND (" + " OR ".join("t.name LIKE ?" for _ in table_patterns) + ")"
+            params = list(table_patterns)
+        cursor = self.connection.cursor()
+        cursor.execute(INVENTORY_QUERY.format(where), *params)
+        inventory = cursor.fetchall()
+
+        now = datetime.now()
+        self.scanned = set()
+        self.scan_seconds = 0.0
+        reasons = {}
+        for row in inventory:
+            entry = self.entries.get(f"{row.object_id}.{row.index_id}")
+            if row.PageCount and not row.IsDisabled:
+                reason = self._change_reason(entry, row, now)
+                if reason:
+                    reasons[(row.object_id, row.index_id)] = reason
+
+        # Never-scanned indexes first, then the biggest relative change
+        def priority(row):
+            entry = self.entries.get(f"{row.object_id}.{row.index_id}")
+            if entry is None:
+                return (0, -row.PageCount)
+            pages = max(entry["inventory_pages"], 1)
+            return (1, -abs(row.PageCount - entry["inventory_pages"]) / pages
+                    - ((row.Modifications or 0) - (entry["modifications"] or 0)) / max(row.RowCnt, 1))
+
+        due = sorted((row for row in inventory if (row.object_id, row.index_id) in reasons), key=priority)
+        per_page = self._seconds_per_page()
+        start = time.perf_counter()
+        for row in due:
+            remaining = self.budget - (time.perf_counter() - start)
+            if remaining <= 0:
+                break
+            if per_page is not None and per_page * row.PageCount > remaining:
+                continue  # a smaller index may still fit
+            try:
+                self._scan(row, now)
+            except Exception as e:
+                # One index that cannot be scanned (dropped meanwhile, lock timeout) keeps its cached value
+                reasons[(row.object_id, row.index_id)] = f"scan failed: {str(e)[:80]}"
+                continue
+            del reasons[(row.object_id, row.index_id)]
+        self.deferred = len(reasons)
+        self.save()
+
+        return [self._result(row, reasons.get((row.object_id, row.index_id)), now) for row in inventory]
+
+    def _result(self, row, reason, now):
+        key = f"{row.object_id}.{row.index_id}"
+        entry = self.entries.get(key)
+        if not row.PageCount or row.IsDisabled:
+            status, fragmentation, age = 'empty', None, None
+        elif entry is None:
+            status, fragmentation, age = 'unscanned', None, None
+        else:
+            age = (now - datetime.fromisoformat(entry["scanned_at"])).total_seconds()
+            fragmentation = entry["fragmentation"]
+            if reason:
+                status = 'deferred'
+            elif key in self.scanned:
+                status = 'scanned'
+            else:
+                status = 'cached'
+        return IndexFragmentation(row.object_id, row.index_id, row.SchemaName, row.TableName,
+                                  row.IndexName, row.IndexType, bool(row.IsDisabled), fragmentation,
+                                  row.PageCount, status, reason, age)
+
+    def save(self):
+        """Merge this database's entries into the cache file"""
+        with _cache_lock:
+            cache = _load(self.cache_file)
+            cache[self.key] = self.entries
+            try:
+                os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+                tmp_file = f"{self.cache_file}.{os.getpid()}.tmp"
+                with open(tmp_file, "w") as f:
+                    json.dump(cache, f, indent=1)
+                os.replace(tmp_file, self.cache_file)
+            except OSError:
+                pass  # without the cache every run rescans what fits in the budget
+
+    def print_summary(self, results):
+        """One line saying how much was rescanned versus served from cache"""
+        cached = sum(1 for r in results if r.status == 'cached')
+        unscanned = sum(1 for r in results if r.status == 'unscanned')
+        print(f"[INFO] Fragmentation: {len(self.scanned)} index(es) rescanned in {self.scan_seconds:.1f}s, "
+              f"{cached} unchanged from cache, {self.deferred} deferred "
+              f"({unscanned} never scanned), budget {self.budget}s")
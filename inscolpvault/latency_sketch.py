@@ -0,0 +1,210 @@
+"""
+Mergeable streaming latency sketches for pVault monitoring
+Per-fingerprint duration histograms in constant memory, using the log_analysis bin layout
+
+Usage: python latency_sketch.py SKETCH.json [SKETCH.json ...] [--fingerprint KEY] [--top N]
+(the monitor writes sketches to ~/.pvault_sql/latency_sketches)
+"""
+
+import argparse
+import glob
+import json
+import math
+import os
+import re
+import sys
+
+SKETCH_VERSION = 1
+
+# Log-spaced duration bins: bin i covers [HIST_MIN * HIST_GROWTH**i, HIST_MIN * HIST_GROWTH**(i+1)),
+# so quantiles are accurate to about half the growth factor (~2.5%)
+HIST_MIN = 0.001        # seconds; anything faster lands in bin 0
+HIST_GROWTH = 1.05
+HIST_BINS = int(math.ceil(math.log(86400.0 / HIST_MIN) / math.log(HIST_GROWTH))) + 1
+_LOG_GROWTH = math.log(HIST_GROWTH)
+
+def bin_of(seconds):
+    """Bin index of one duration"""
+    return min(int(math.log(max(seconds, HIST_MIN) / HIST_MIN) / _LOG_GROWTH), HIST_BINS - 1)
+
+def bin_midpoint(index):
+    """Representative duration (geometric bin midpoint) of a bin"""
+    return HIST_MIN * HIST_GROWTH ** (index + 0.5)
+
+class LatencySketch:
+    """Sparse duration histogram; at most HIST_BINS counters however many values are added"""
+
+    def __init__(self):
+        self.bins = {}  # bin index -> count
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, seconds, count=1):
+        seconds = float(seconds)
+        index = bin_of(seconds)
+        self.bins[index] = self.bins.get(index, 0) + count
+        self.count += count
+        self.total += seconds * count
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+
+    def merge(self, other):
+        """Fold another sketch in; the result is the sketch of both value streams"""
+        for index, count in other.bins.items():
+            self.bins[index] = self.bins.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        if other.count:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+        return self
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def quantiles(self, quantiles):
+        """Durations at each quantile (0-1), clamped to the observed min and max"""
+        if not self.count:
+            return [0.0 for _ in quantiles]
+        ordered = sorted(self.bins.items())
+        result = []
+        for q in quantiles:
+            target = q * self.count * (1 - 1e-9)
+            cumulative = 0
+            for index, count in ordered:
+                cumulative += count
+                if cumulative >= target:
+                    break
+            result.append(min(max(bin_midpoint(index), self.min), self.max))
+        return result
+
+    def to_dict(self):
+        return {"count": self.count, "sum": self.total, "min": self.min, "max": self.max,
+                "bins": {str(index): count for index, count in sorted(self.bins.items())}}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls()
+        sketch.bins = {int(index): count for index, count in data["bins"].items()}
+        sketch.count = data["count"]
+        sketch.total = data["sum"]
+        sketch.min = data["min"]
+        sketch.max = data["max"]
+        return sketch
+
+class SketchSet:
+    """Sketches and a sample statement per query fingerprint"""
+
+    def __init__(self):
+        self.sketches = {}  # fingerprint -> LatencySketch
+        self.queries = {}   # fingerprint -> sample statement
+        self.servers = set()
+        self.start = None
+        self.end = None
+
+    def add(self, key, seconds, query=""):
+        sketch = self.sketches.get(key)
+        if sketch is None:
+            sketch = self.sketches[key] = LatencySketch()
+            self.queries[key] = query[:200]
+        sketch.add(seconds)
+
+    def merge(self, other):
+        for key, sketch in other.sketches.items():
+            if key in self.sketches:
+                self.sketches[key].merge(sketch)
+            else:
+                self.sketches[key] = LatencySketch().merge(sketch)
+                self.queries[key] = other.queries.get(key, "")
+        self.servers |= other.servers
+        self.start = min(filter(None, (self.start, other.start)), default=None)
+        self.end = max(filter(None, (self.end, other.end)), default=None)
+        return self
+
+    def percentiles(self, n=10, quantiles=(0.5, 0.95, 0.99)):
+        """[(fingerprint, query, count, mean, p50, p95, p99, max)] slowest p95 first"""
+        rows = [(key, self.queries.get(key, ""), s.count, s.mean(), *s.quantiles(quantiles), s.max)
+                for key, s in self.sketches.items() if s.count]
+        return sorted(rows, key=lambda r: r[5], reverse=True)[:n]
+
+    def to_dict(self):
+        return {
+            "version": SKETCH_VERSION,
+            "hist_min": HIST_MIN,
+            "hist_growth": HIST_GROWTH,
+            "servers": sorted(self.servers),
+            "start": self.start,
+            "end": self.end,
+            "fingerprints": {key: dict(sketch.to_dict(), query=self.queries.get(key, ""))
+                             for key, sketch in self.sketches.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        if data.get("hist_min") != HIST_MIN or data.get("hist_growth") != HIST_GROWTH:
+            raise ValueError("sketch was written with a different bin layout")
+        sketches = cls()
+        for key, entry in data["fingerprints"].items():
+            sketches.sketches[key] = LatencySketch.from_dict(entry)
+            sketches.queries[key] = entry.get("query", "")
+        sketches.servers = set(data.get("servers", []))
+        sketches.start = data.get("start")
+        sketches.end = data.get("end")
+        return sketches
+
+    def save(self, path):
+        """Write atomically, so a reader never sees a half-written file"""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_file = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(self.to_dict(), f)
+        os.replace(tmp_file, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
+
+def sketch_path(directory, name, day, started):
+    """One file per monitored instance, day and monitor run, so concurrent monitors never collide"""
+    safe_name = re.sub(r'[^A-Za-z0-9_.-]', '_', name)
+    return os.path.join(directory, f"{safe_name}_{day}_{started}.json")
+
+def print_percentiles(sketches, n=10, prefix=""):
+    rows = sketches.percentiles(n)
+    if not rows:
+        return
+    print(f"\n{prefix}[Query Duration Percentiles - completed executions, slowest p95 first]")
+    for key, query, count, mean, p50, p95, p99, max_elapsed in rows:
+        print(f"  {key or '(unknown)'}: {query[:80]}")
+        print(f"    Executions: {count:,}  Mean: {mean:.2f}s  p50: {p50:.2f}s  "
+              f"p95: {p95:.2f}s  p99: {p99:.2f}s  Max: {max_elapsed:.2f}s")
+
+def main():
+    parser = argparse.ArgumentParser(description='Merge latency sketches and print per-query percentiles')
+    parser.add_argument('sketches', nargs='+', help='sketch files or globs')
+    parser.add_argument('--fingerprint', help='only this fingerprint')
+    parser.add_argument('--top', type=int, default=10, help='fingerprints to show (default: 10)')
+    args = parser.parse_args()
+
+    paths = sorted({path for pattern in args.sketches for path in (glob.glob(pattern) or [pattern])})
+    merged = SketchSet()
+    for path in paths:
+        try:
+            merged.merge(SketchSet.load(path))
+        except (OSError, ValueError, KeyError) as e:
+            print(f"⚠ Skipping {path}: {e}")
+    if not merged.sketches:
+        print("No sketches found")
+        sys.exit(1)
+
+    if args.fingerprint:
+        merged.sketches = {k: v for k, v in merged.sketches.items() if k == args.fingerprint}
+    print(f"Merged {len(paths)} sketch file(s): {', '.join(sorted(merged.servers)) or 'unknown server'}, "
+          f"{merged.start} to {merged.end}")
+    print_percentiles(merged, args.top)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,390 @@
+"""
+Vectorized, streaming analysis of pVault query performance logs
+Processes CSV or columnar monitor logs in fixed-size chunks with bounded memory
+
+Usage: python log_analysis.py LOG [LOG ...] [--start "YYYY-MM-DD HH:MM:SS"] [--end ...] [--server NAME]
+"""
+
+import argparse
+import csv
+import os
+import sys
+from datetime import datetime
+
+import numpy as np
+
+try:
+    import pandas as pd
+except ImportError:  # CSV logs are then parsed with the csv module
+    pd = None
+
+from perf_log import (ColumnarLogReader, is_columnar_log, LEGACY_SAMPLE_INTERVAL, TIMED_OUT_ALERT,
+                      TIMESTAMP_FORMAT)
+from query_fingerprint import fingerprint
+from latency_sketch import HIST_BINS, HIST_GROWTH, HIST_MIN
+
+ANALYSIS_COLUMNS = ['ElapsedSec', 'BlockingSession', 'QuerySnippet', 'Alert', 'Fingerprint',
+                    'SampleInterval', 'Server']
+STRING_COLUMNS = ('QuerySnippet', 'Alert', 'Fingerprint', 'Server')
+FLOAT_COLUMNS = ('ElapsedSec', 'SampleInterval')
+NUMERIC_COLUMNS = ('SessionID', 'BlockingSession') + FLOAT_COLUMNS
+
+# Duration histograms share the latency sketch bin layout, so both can be compared and merged
+_LOG_GROWTH = np.log(HIST_GROWTH)
+
+MAX_SESSION_ID = 32767  # session_id is a smallint
+
+def bin_index(seconds):
+    """Histogram bin for each duration (vectorized)"""
+    scaled = np.maximum(np.asarray(seconds, dtype=np.float64), HIST_MIN) / HIST_MIN
+    return np.minimum((np.log(scaled) / _LOG_GROWTH).astype(np.int64), HIST_BINS - 1)
+
+def bin_value(index):
+    """Representative duration (geometric bin midpoint) for each bin index"""
+    return HIST_MIN * HIST_GROWTH ** (np.asarray(index, dtype=np.float64) + 0.5)
+
+def histogram_percentiles(hist, totals, quantiles):
+    """Percentiles per histogram row; hist is (rows, HIST_BINS) counts or weights, totals the row sums"""
+    cumulative = np.cumsum(hist, axis=1)
+    result = np.empty((hist.shape[0], len(quantiles)))
+    for i, q in enumerate(quantiles):
+        # Relative slack so float weights summing to exactly q * total still qualify
+        target = (q * np.asarray(totals, dtype=np.float64) * (1 - 1e-9))[:, None]
+        result[:, i] = bin_value(np.argmax(cumulative >= target, axis=1))
+    return result
+
+def _encode(values):
+    """(codes, dictionary) for an array of strings"""
+    if pd is not None:
+        codes, uniques = pd.factorize(values, use_na_sentinel=False)
+        return codes, [("" if v is None or v != v else str(v)) for v in uniques]
+    uniques, codes = np.unique(np.asarray(values, dtype=object).astype(str), return_inverse=True)
+    return codes, list(uniques)
+
+def _slice(chunk, start, stop):
+    return {k: (v if k.endswith('.dictionary') else v[start:stop]) for k, v in chunk.items()}
+
+def _iter_columnar(path, columns, start, end, chunk_rows):
+    reader = ColumnarLogReader(path)
+    for segment in reader.iter_segments(columns, start, end, decode=False):
+        rows = len(segment[columns[0]])
+        for offset in range(0, rows, chunk_rows):
+            yield _slice(segment, offset, offset + chunk_rows)
+
+def _csv_chunk(frame, columns):
+    chunk = {}
+    for column in columns:
+        values = frame[column]
+        if column in STRING_COLUMNS:
+            codes, dictionary = _encode(values)
+            chunk[column] = codes
+            chunk[f"{column}.dictionary"] = dictionary
+        elif column == 'Timestamp':
+            chunk[column] = np.asarray(values, dtype=object)
+        elif column in FLOAT_COLUMNS:
+            chunk[column] = np.asarray(values, dtype=np.float64)
+        else:
+            chunk[column] = np.asarray(values, dtype=np.int64)
+    return chunk
+
+def _iter_csv(path, columns, start, end, chunk_rows):
+    start_text = start.strftime(TIMESTAMP_FORMAT) if start else None
+    end_text = end.strftime(TIMESTAMP_FORMAT) if end else None
+    read_columns = list(dict.fromkeys(columns + ['Timestamp']))
+
+    with open(path, newline='') as f:
+        header = next(csv.reader(f), [])
+    present = [c for c in read_columns if c in header]
+
+    def frames():
+        # Columns missing from logs written by older versions read as empty/zero
+        if pd is not None:
+            dtypes = {c: str for c in STRING_COLUMNS + ('Timestamp',) if c in present}
+            for frame in pd.read_csv(path, usecols=present, chunksize=chunk_rows,
+                                     dtype=dtypes, keep_default_na=False):
+                for column in read_columns:
+                    if column not in frame:
+                        frame[column] = "" if column in STRING_COLUMNS else 0
+                for column in NUMERIC_COLUMNS:
+                    if column in frame:
+                        frame[column] = pd.to_numeric(frame[column], errors='coerce').fillna(0)
+                yield {c: frame[c].to_numpy() for c in read_columns}
+            return
+        with open(path, newline='') as f:
+            reader = csv.DictReader(f)
+            while True:
+                rows = [row for _, row in zip(range(chunk_rows), reader)]
+                if not rows:
+                    return
+                yield {c: np.array([(row.get(c) or (0 if c in NUMERIC_COLUMNS else ""))
+                                    for row in rows], dtype=object) for c in read_columns}
+
+    for frame in frames():
+        # Timestamps are zero-padded, so string comparison orders them
+        if start_text or end_text:
+            timestamps = frame['Timestamp'].astype(str)
+            mask = np.ones(len(timestamps), dtype=bool)
+            if start_text:
+                mask &= timestamps >= start_text
+            if end_text:
+                mask &= timestamps <= end_text
+            frame = {c: v[mask] for c, v in frame.items()}
+        if len(frame['Timestamp']):
+            yield _csv_chunk(frame, columns)
+
+def iter_log_chunks(paths, columns=ANALYSIS_COLUMNS, start=None, end=None, chunk_rows=1000000):
+    """Yield column chunks of at most chunk_rows rows from each log in turn.
+
+    String columns are given as integer codes plus a '<column>.dictionary'
+    list, so they can be processed without materializing Python strings.
+    """
+    for path in paths:
+        if is_columnar_log(path):
+            yield from _iter_columnar(path, columns, start, end, chunk_rows)
+        else:
+            yield from _iter_csv(path, columns, start, end, chunk_rows)
+
+class LogAnalyzer:
+    """Accumulates monitor log summaries chunk by chunk in bounded memory.
+
+    Samples are grouped by query fingerprint. Logs written before the
+    Fingerprint column existed are fingerprinted from QuerySnippet.
+
+    The monitor samples faster while queries are at risk, so every sample is
+    weighted by its SampleInterval: durations, percentiles and blocking are
+    time-weighted rather than per-sample. Logs without the column are
+    weighted as if sampled every LEGACY_SAMPLE_INTERVAL seconds.
+
+    Timeouts read from the event session (Alert TIMED_OUT) are events, not
+    samples: they are counted per fingerprint and left out of the rest.
+
+    server restricts the analysis to rows from one instance of a fleet log.
+    """
+
+    QUANTILES = (0.50, 0.95, 0.99)
+
+    def __init__(self, server=None):
+        self.server = server
+        self.total_rows = 0
+        # Per blocking session_id (dense array, session_id <= 32767)
+        self.blocker_count = np.zeros(MAX_SESSION_ID + 1, dtype=np.int64)
+        self.blocker_seconds = np.zeros(MAX_SESSION_ID + 1)
+        # Per fingerprint: global ids, a sample query, timeout risk and duration histograms
+        self.fingerprint_ids = {}
+        self.fingerprints = []
+        self.query_texts = []
+        self.timeout_count = np.zeros(0, dtype=np.int64)
+        self.timeout_max = np.zeros(0)
+        self.timeout_seconds = np.zeros(0)
+        self.timed_out_count = np.zeros(0, dtype=np.int64)
+        self.timed_out_max = np.zeros(0)
+        self.query_hist = np.zeros((0, HIST_BINS))  # sample seconds per duration bin
+        self.query_count = np.zeros(0, dtype=np.int64)
+        self.query_seconds = np.zeros(0)
+        self.query_sum = np.zeros(0)  # elapsed weighted by sample seconds
+        self.query_max = np.zeros(0)
+
+    def _fingerprint_id(self, value):
+        key = self.fingerprint_ids.get(value)
+        if key is None:
+            key = self.fingerprint_ids[value] = len(self.fingerprints)
+            self.fingerprints.append(value)
+            self.query_texts.append("")
+        return key
+
+    def _global_fingerprint_ids(self, chunk):
+        """Global fingerprint id per row, falling back to hashing QuerySnippet"""
+        snippet_codes = chunk['QuerySnippet']
+        snippets = chunk['QuerySnippet.dictionary']
+        fingerprint_codes = chunk['Fingerprint']
+        fingerprints = chunk['Fingerprint.dictionary']
+
+        lut = np.array([self._fingerprint_id(v) if v else -1 for v in fingerprints], dtype=np.int64)
+        ids = lut[fingerprint_codes] if len(lut) else np.full(len(snippet_codes), -1, dtype=np.int64)
+        missing = ids < 0
+        if missing.any():
+            fallback = np.array([self._fingerprint_id(fingerprint(text)) for text in snippets],
+                                dtype=np.int64)
+            ids[missing] = fallback[snippet_codes[missing]]
+
+        # Remember one sample query per new fingerprint
+        self._grow(len(self.fingerprints))
+        first_ids, first_index = np.unique(ids, return_index=True)
+        for key, index in zip(first_ids.tolist(), first_index.tolist()):
+            if not self.query_texts[key]:
+                self.query_texts[key] = snippets[snippet_codes[index]]
+        return ids
+
+    def _grow(self, size):
+        capacity = self.query_hist.shape[0]
+        if size <= capacity:
+            return
+        extra = max(size, capacity * 2, 64) - capacity
+        self.query_hist = np.vstack([self.query_hist, np.zeros((extra, HIST_BINS))])
+        self.query_count = np.concatenate([self.query_count, np.zeros(extra, dtype=np.int64)])
+        self.query_seconds = np.concatenate([self.query_seconds, np.zeros(extra)])
+        self.query_sum = np.concatenate([self.query_sum, np.zeros(extra)])
+        self.query_max = np.concatenate([self.query_max, np.zeros(extra)])
+        self.timeout_count = np.concatenate([self.timeout_count, np.zeros(extra, dtype=np.int64)])
+        self.timeout_max = np.concatenate([self.timeout_max, np.zeros(extra)])
+        self.timeout_seconds = np.concatenate([self.timeout_seconds, np.zeros(extra)])
+        self.timed_out_count = np.concatenate([self.timed_out_count, np.zeros(extra, dtype=np.int64)])
+        self.timed_out_max = np.concatenate([self.timed_out_max, np.zeros(extra)])
+
+    def _server_rows(self, chunk):
+        matches = np.array([v == self.server for v in chunk['Server.dictionary']], dtype=bool)
+        keep = matches[chunk['Server']] if len(matches) else np.zeros(len(chunk['Server']), dtype=bool)
+        return {k: (v if k.endswith('.dictionary') else v[keep]) for k, v in chunk.items()}
+
+    def add_chunk(self, chunk):
+        if self.server is not None:
+            chunk = self._server_rows(chunk)
+        rows = len(chunk['ElapsedSec'])
+        if not rows:
+            return
+        self.total_rows += rows
+
+        elapsed = np.asarray(chunk['ElapsedSec'], dtype=np.float64)
+        weights = np.asarray(chunk['SampleInterval'], dtype=np.float64)
+        weights = np.where(weights > 0, weights, LEGACY_SAMPLE_INTERVAL)
+        blockers = np.clip(np.asarray(chunk['BlockingSession'], dtype=np.int64), 0, MAX_SESSION_ID)
+        queries = self._global_fingerprint_ids(chunk)
+        size = self.query_hist.shape[0]
+
+        # Alert text is tested once per distinct value, then broadcast through the codes
+        alert_dictionary = chunk['Alert.dictionary']
+        is_timeout = np.array(['TIMEOUT_RISK' in a for a in alert_dictionary], dtype=bool)
+        timeout = is_timeout[chunk['Alert']] if len(alert_dictionary) else np.zeros(rows, dtype=bool)
+        is_event = np.array([a.startswith(TIMED_OUT_ALERT) for a in alert_dictionary], dtype=bool)
+        event = is_event[chunk['Alert']] if len(alert_dictionary) else np.zeros(rows, dtype=bool)
+
+        # Timed out executions per fingerprint; the remaining rows are samples
+        if event.any():
+            self.timed_out_count += np.bincount(queries[event], minlength=size)
+            np.maximum.at(self.timed_out_max, queries[event], elapsed[event])
+            sample = ~event
+            elapsed, weights, blockers, queries, timeout = (
+                elapsed[sample], weights[sample], blockers[sample], queries[sample], timeout[sample])
+
+        # Timeout risk per fingerprint
+        if timeout.any():
+            self.timeout_count += np.bincount(queries[timeout], minlength=size)
+            self.timeout_seconds += np.bincount(queries[timeout], weights=weights[timeout], minlength=size)
+            np.maximum.at(self.timeout_max, queries[timeout], elapsed[timeout])
+
+        # Blocking counts per blocker
+        blocked = blockers > 0
+        if blocked.any():
+            self.blocker_count += np.bincount(blockers[blocked], minlength=MAX_SESSION_ID + 1)
+            self.blocker_seconds += np.bincount(blockers[blocked], weights=weights[blocked],
+                                                minlength=MAX_SESSION_ID + 1)
+
+        # Duration histograms per fingerprint
+        self.query_count += np.bincount(queries, minlength=size)
+        self.query_seconds += np.bincount(queries, weights=weights, minlength=size)
+        self.query_sum += np.bincount(queries, weights=elapsed * weights, minlength=size)
+        np.maximum.at(self.query_max, queries, elapsed)
+        flat = queries * HIST_BINS + bin_index(elapsed)
+        cells, inverse = np.unique(flat, return_inverse=True)
+        self.query_hist.reshape(-1)[cells] += np.bincount(inverse.reshape(-1), weights=weights)
+
+    def analyze(self, paths, start=None, end=None, chunk_rows=1000000):
+        for chunk in iter_log_chunks(paths, ANALYSIS_COLUMNS, start, end, chunk_rows):
+            self.add_chunk(chunk)
+        return self
+
+    def timeout_queries(self, n=5):
+        """[(fingerprint, occurrences, seconds_at_risk, max_elapsed, query)] ordered by max elapsed"""
+        keys = np.nonzero(self.timeout_count)[0]
+        order = keys[np.argsort(-self.timeout_max[keys], kind='stable')][:n]
+        return [(self.fingerprints[k], int(self.timeout_count[k]), float(self.timeout_seconds[k]),
+                 float(self.timeout_max[k]), self.query_texts[k]) for k in order]
+
+    def timed_out_queries(self, n=5):
+        """[(fingerprint, timeouts, max_elapsed, query)] ordered by number of timeouts"""
+        keys = np.nonzero(self.timed_out_count)[0]
+        order = keys[np.argsort(-self.timed_out_count[keys], kind='stable')][:n]
+        return [(self.fingerprints[k], int(self.timed_out_count[k]), float(self.timed_out_max[k]),
+                 self.query_texts[k]) for k in order]
+
+    def top_blockers(self, n=5):
+        """[(session_id, blocked_samples, blocked_seconds)] ordered by blocked time"""
+        blockers = np.nonzero(self.blocker_count)[0]
+        order = blockers[np.argsort(-self.blocker_seconds[blockers], kind='stable')][:n]
+        return [(int(b), int(self.blocker_count[b]), float(self.blocker_seconds[b])) for b in order]
+
+    def query_percentiles(self, n=10):
+        """[(fingerprint, query, samples, mean, p50, p95, p99, max)] ordered by p95, time-weighted"""
+        counts = self.query_count
+        active = np.nonzero(counts)[0]
+        if not len(active):
+            return []
+        seconds = self.query_seconds[active]
+        pct = histogram_percentiles(self.query_hist[active], seconds, self.QUANTILES)
+        pct = np.minimum(pct, self.query_max[active][:, None])
+        order = np.argsort(-pct[:, 1], kind='stable')[:n]
+        return [(self.fingerprints[active[i]], self.query_texts[active[i]], int(counts[active[i]]),
+                 float(self.query_sum[active[i]] / seconds[i]),
+                 float(pct[i, 0]), float(pct[i, 1]), float(pct[i, 2]),
+                 float(self.query_max[active[i]])) for i in order]
+
+    def print_summary(self):
+        print(f"\nAnalyzed {self.total_rows} monitoring records")
+
+        timeouts = self.timeout_queries()
+        if timeouts:
+            print("\n[Queries with Timeout Risk]")
+            for key, count, seconds, max_elapsed, query in timeouts:
+                print(f"  Fingerprint {key or '(unknown)'}:")
+                print(f"    Occurrences: {count} samples (~{seconds:.0f}s at risk)")
+                print(f"    Max Duration: {max_elapsed:.1f}s")
+                print(f"    Query: {query[:80]}...")
+
+        timed_out = self.timed_out_queries()
+        if timed_out:
+            print("\n[Timed Out Executions]")
+            for key, count, max_elapsed, query in timed_out:
+                print(f"  Fingerprint {key or '(unknown)'}: {count} timeouts, longest {max_elapsed:.1f}s")
+                print(f"    Query: {query[:80]}...")
+
+        blockers = self.top_blockers()
+        if blockers:
+            print("\n[Top Blocking Sessions]")
+            for blocker, count, seconds in blockers:
+                print(f"  Session {blocker}: blocked {count} queries (~{seconds:.0f}s of blocked samples)")
+
+        percentiles = self.query_percentiles()
+        if percentiles:
+            print("\n[Query Duration Percentiles (time-weighted elapsed time, slowest p95 first)]")
+            for key, query, count, mean, p50, p95, p99, max_elapsed in percentiles:
+                print(f"  {key or '(unknown)'}: {query[:80]}")
+                print(f"    Samples: {count:,}  Mean: {mean:.2f}s  p50: {p50:.2f}s  "
+                      f"p95: {p95:.2f}s  p99: {p99:.2f}s  Max: {max_elapsed:.2f}s")
+
+def _parse_time(text):
+    return datetime.strptime(text, TIMESTAMP_FORMAT) if text else None
+
+def main():
+    parser = argparse.ArgumentParser(description='Analyze pVault query performance logs')
+    parser.add_argument('logs', nargs='+', help='CSV log files or columnar log directories')
+    parser.add_argument('--start', help='Only samples at or after this time (YYYY-MM-DD HH:MM:SS)')
+    parser.add_argument('--end', help='Only samples at or before this time (YYYY-MM-DD HH:MM:SS)')
+    parser.add_argument('--server', help='Only samples from this instance (fleet logs)')
+    parser.add_argument('--chunk-rows', type=int, default=1000000,
+                        help='Rows processed per chunk (default: 1000000)')
+    args = parser.parse_args()
+
+    missing = [path for path in args.logs if not os.path.exists(path)]
+    if missing:
+        print(f"Log not found: {', '.join(missing)}")
+        sys.exit(1)
+
+    print("="*60)
+    print("PERFORMANCE ANALYSIS")
+    print("="*60)
+    analyzer = LogAnalyzer(args.server).analyze(args.logs, _parse_time(args.start), _parse_time(args.end),
+                                     args.chunk_rows)
+    analyzer.print_summary()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+Prometheus/OpenMetrics exporter for the pVault query monitor
+Serves the latest values published by the collectors; a scrape never touches SQL Server
+"""
+
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRICS_HOST = "127.0.0.1"  # "0.0.0.0" to allow scraping from other hosts
+METRICS_PORT = 9399
+WAIT_TYPES_EXPORTED = 10  # top wait types per interval, bounds label cardinality
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+OPENMETRICS_CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+# name -> (type, help)
+METRICS = {
+    'pvault_up': ('gauge', 'Whether the last request sample of the instance succeeded'),
+    'pvault_active_requests': ('gauge', 'Requests executing at the last sample'),
+    'pvault_blocked_requests': ('gauge', 'Requests blocked by another session at the last sample'),
+    'pvault_timeout_risk_requests': ('gauge', 'Requests past the timeout alert threshold at the last sample'),
+    'pvault_head_blockers': ('gauge', 'Sessions at the head of a blocking tree at the last sample'),
+    'pvault_blocking_max_depth': ('gauge', 'Depth of the deepest blocking tree at the last sample'),
+    'pvault_blocking_wait_seconds': ('gauge', 'Summed wait of all blocked requests at the last sample'),
+    'pvault_sample_interval_seconds': ('gauge', 'Current adaptive request sampling interval'),
+    'pvault_samples': ('counter', 'Request samples taken'),
+    'pvault_timeout_risk_samples': ('counter', 'Sampled requests past the timeout alert threshold'),
+    'pvault_timeouts': ('counter', 'Executions that timed out or were aborted, from the Extended Events session'),
+    'pvault_deadlocks': ('counter', 'Deadlocks reported by the system_health event session'),
+    'pvault_wait_interval_seconds': ('gauge', 'Length of the last wait stats interval'),
+    'pvault_wait_seconds_per_second': ('gauge', 'Wait time per second over the last interval, top wait types'),
+    'pvault_waits_per_second': ('gauge', 'Waits started per second over the last interval, top wait types'),
+    'pvault_wait_avg_milliseconds': ('gauge', 'Average wait over the last interval, top wait types'),
+    'pvault_wait_signal_ratio': ('gauge', 'Share of wait time spent waiting for CPU over the last interval'),
+    'pvault_collector_up': ('gauge', 'Whether the last run of the collector succeeded'),
+    'pvault_collector_period_seconds': ('gauge', 'Current collector period'),
+    'pvault_collector_latency_seconds': ('gauge', 'Duration of the last collector run'),
+    'pvault_collector_max_latency_seconds': ('gauge', 'Longest collector run'),
+    'pvault_collector_runs': ('counter', 'Collector runs'),
+    'pvault_collector_skipped_ticks': ('counter', 'Collector deadlines skipped because a run overran'),
+    'pvault_collector_errors': ('counter', 'Collector runs that raised'),
+}
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+class MetricsRegistry:
+    """Latest metric values, written by collectors and read by scrapes"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {name: {} for name in METRICS}  # name -> {sorted label tuple: value}
+        self.schedulers = []
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.values[name][tuple(sorted(labels.items()))] = float(value)
+
+    def inc(self, name, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.values[name]
+            series[key] = series.get(key, 0.0) + amount
+
+    def replace(self, name, series, **labels):
+        """Replace every series of name carrying labels with {extra_labels_tuple: value}"""
+        common = set(labels.items())
+        with self.lock:
+            current = self.values[name]
+            for key in [k for k in current if common.issubset(k)]:
+                del current[key]
+            for extra, value in series.items():
+                current[tuple(sorted(common | set(extra)))] = float(value)
+
+    def watch_scheduler(self, scheduler):
+        """Export collector health from a scheduler's in-memory counters"""
+        self.schedulers.append(scheduler)
+
+    def _collector_values(self):
+        values = {}
+        for scheduler in self.schedulers:
+            for c in scheduler.collectors:
+                key = (('collector', c.name),)
+                for name, value in (
+                        ('pvault_collector_up', 0.0 if c.failing else 1.0),
+                        ('pvault_collector_period_seconds', c.current_period()),
+                        ('pvault_collector_latency_seconds', c.last_latency),
+                        ('pvault_collector_max_latency_seconds', c.max_latency),
+                        ('pvault_collector_runs', c.runs),
+                        ('pvault_collector_skipped_ticks', c.skipped),
+                        ('pvault_collector_errors', c.errors)):
+                    values.setdefault(name, {})[key] = float(value)
+        return values
+
+    def render(self, openmetrics=False):
+        """Exposition text; Prometheus 0.0.4 format, or OpenMetrics 1.0"""
+        collectors = self._collector_values()
+        with self.lock:
+            snapshot = {name: dict(series) for name, series in self.values.items()}
+        for name, series in collectors.items():
+            snapshot[name].update(series)
+
+        lines = []
+        for name, (kind, help_text) in METRICS.items():
+            series = snapshot[name]
+            if not series:
+                continue
+            sample = f"{name}_total" if kind == 'counter' else name
+            family = name if openmetrics or kind != 'counter' else sample
+            lines.append(f"# HELP {family} {help_text}")
+            lines.append(f"# TYPE {family} {kind}")
+            for labels, value in sorted(series.items()):
+                lines.append(f"{sample}{_labels(labels)} {value:g}")
+        if openmetrics:
+            lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = None
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404, "Metrics are served at /metrics")
+            return
+        openmetrics = 'application/openmetrics-text' in self.headers.get('Accept', '')
+        body = self.registry.render(openmetrics).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', OPENMETRICS_CONTENT_TYPE if openmetrics else PROMETHEUS_CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        """Scrapes are not logged to the monitor console"""
+
+class MetricsExporter:
+    """HTTP endpoint on a daemon thread serving a MetricsRegistry at /metrics"""
+
+    def __init__(self, registry, host=METRICS_HOST, port=METRICS_PORT):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.server = None
+
+    def start(self):
+        """Start serving; returns False (monitoring carries on) if the port is unavailable"""
+        handler = type('MetricsHandler', (_MetricsHandler,), {'registry': self.registry})
+        try:
+            self.server = ThreadingHTTPServer((self.host, self.port), handler)
+        except OSError as e:
+            print(f"⚠ Metrics exporter disabled - cannot listen on {self.host}:{self.port}: {e}")
+            return False
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, name="metrics-exporter", daemon=True).start()
+        print(f"✓ Metrics at http://{self.host}:{self.port}/metrics")
+        return True
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
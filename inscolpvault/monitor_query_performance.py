@@ -3,187 +3,603 @@ Real-time Query Performance Monitor for pVault
 Continuously monitors and logs query performance to identify timeout patterns
 """
 
-import pyodbc
 import time
 import csv
 from datetime import datetime
 import os
 import sys
+import threading
+from collections import deque
+from sql_connection import ConnectionFactory, ConnectionFailed, STATE_DIR
+from wait_stats import WaitStatsTracker, print_wait_deltas, WAIT_STATS_QUERY
+from collector_scheduler import CollectorScheduler
+from dmv_snapshot import SnapshotQuery, collect_snapshot
+from blocking_tree import IDLE_SESSIONS_QUERY, build_blocking_trees, idle_blockers, print_blocking_trees
+from metrics_exporter import MetricsExporter, MetricsRegistry, WAIT_TYPES_EXPORTED
+from query_fingerprint import fingerprint, hash_hex
+from sql_text_cache import SqlTextCache
+from plan_cache_sampler import PlanCacheSampler, print_sample
+from xe_timeouts import XeTimeoutReader, XeUnavailable
+from deadlock_collector import DeadlockCollector, print_deadlocks
+from latency_sketch import SketchSet, print_percentiles, sketch_path
+from perf_log import (ColumnarLogReader, columnar_available, is_columnar_log,
+                      open_log_writer, LEGACY_SAMPLE_INTERVAL, TIMED_OUT_ALERT, TIMESTAMP_FORMAT)
+
+try:
+    from log_analysis import LogAnalyzer
+except ImportError:  # numpy not installed; analyze_log falls back to row-by-row parsing
+    LogAnalyzer = None
 
 # Configuration
 SERVER = "inscolpvault.insulationsinc.local"
 PORT = 55859
 DATABASE = "PaperlessEnvironments"
-MONITOR_INTERVAL = 5  # Check every 5 seconds
+MONITOR_INTERVAL = 5  # Starting sampling interval and wait stats period, in seconds
+MIN_INTERVAL = 0.5  # Sampling interval while queries are at timeout risk or blocked
+MAX_INTERVAL = 15  # Longest sampling interval when the server is quiet
+BACKOFF_FACTOR = 1.5  # Interval growth per quiet sample once QUIET_SAMPLES have passed
+QUIET_SAMPLES = 3
+BLOCKING_REPEAT_SECONDS = 60  # reprint blocking trees this often while the same heads persist
+STATS_REPORT_SECONDS = 300
+STATUS_SECONDS = 30
 LOG_FILE = f"query_performance_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+LOG_FORMAT = "csv"  # "csv" or "columnar" (time-partitioned segments, needs numpy)
+LOG_DIR = LOG_FILE[:-len(".csv")]  # columnar log location
+SNIPPET_LENGTH = 500  # characters of statement text kept per log row
+BATCHED_TICK = True  # fetch wait stats in the same round trip as requests instead of a separate collector
+EXPORT_METRICS = True  # serve Prometheus/OpenMetrics at METRICS_PORT (metrics_exporter.py)
+SKETCH_SAVE_SECONDS = 300  # how often per-query latency sketches are written to SKETCH_DIR
+SKETCH_DIR = os.path.join(STATE_DIR, "latency_sketches")
+PLAN_CACHE_SECONDS = 300  # plan cache delta samples (plan_cache_sampler.py); 0 disables them
+XE_POLL_SECONDS = 10  # client timeouts read from the Extended Events session (xe_timeouts.py); 0 disables it
+DEADLOCK_SECONDS = 60  # deadlock reports read from system_health (deadlock_collector.py); 0 disables it
+EVENT_COMMANDS = {'rpc_completed': 'RPC', 'sql_batch_completed': 'BATCH', 'attention': 'ATTENTION'}
+
+REQUESTS_QUERY = SnapshotQuery('requests', """
+    SELECT
+        r.session_id,
+        r.request_id,
+        r.start_time,
+        r.status,
+        r.command,
+        r.total_elapsed_time / 1000.0 AS ElapsedSec,
+        r.wait_type,
+        r.wait_time / 1000.0 AS WaitSec,
+        r.blocking_session_id,
+        r.cpu_time / 1000.0 AS CPUSec,
+        r.logical_reads,
+        DB_NAME(r.database_id) AS DatabaseName,
+        r.query_hash,
+        r.query_plan_hash,
+        r.sql_handle,
+        r.statement_start_offset,
+        r.statement_end_offset
+    FROM sys.dm_exec_requests r
+    WHERE r.session_id > 50
+        AND r.session_id != @@SPID
+        AND r.sql_handle IS NOT NULL
+    ORDER BY r.total_elapsed_time DESC
+""")
+WAIT_STATS_SNAPSHOT = SnapshotQuery('wait_stats', WAIT_STATS_QUERY)
+
+class AdaptiveInterval:
+    """Sampling interval that drops to the minimum on trouble and backs off while quiet"""
+
+    def __init__(self, minimum=MIN_INTERVAL, maximum=MAX_INTERVAL, start=MONITOR_INTERVAL,
+                 backoff=BACKOFF_FACTOR, quiet_samples=QUIET_SAMPLES):
+        if minimum <= 0 or minimum > maximum:
+            raise ValueError(f"Invalid sampling interval range {minimum}-{maximum}s")
+        self.minimum = minimum
+        self.maximum = maximum
+        self.backoff = backoff
+        self.quiet_samples = quiet_samples
+        self.current = min(max(start, minimum), maximum)
+        self.quiet = 0
+
+    def update(self, busy):
+        """Adjust after a sample; returns True when sampling was just tightened"""
+        if busy:
+            tightened = self.current > self.minimum
+            self.current = self.minimum
+            self.quiet = 0
+            return tightened
+        self.quiet += 1
+        if self.quiet >= self.quiet_samples:
+            self.current = min(self.current * self.backoff, self.maximum)
+        return False
 
 class QueryMonitor:
-    def __init__(self, username, password):
+    def __init__(self, username, password, server=SERVER, port=PORT, database=DATABASE, name=None,
+                 min_interval=MIN_INTERVAL, max_interval=MAX_INTERVAL):
         self.username = username
         self.password = password
+        self.server = server
+        self.port = port
+        self.database = database
+        self.name = name or server  # logged in the Server column
+        self.prefix = f"[{name}] " if name else ""  # console tag when several instances share a console
         self.connection = None
-        self.csv_writer = None
-        self.csv_file = None
+        self.factory = ConnectionFactory(server, port, database, username, password, timeout=10)
+        self.collectors = {}
+        self.scheduler = None
+        self.metrics = None  # MetricsRegistry the collectors publish to, when exporting
+        self.log_writer = None
+        self.log_path = LOG_DIR if LOG_FORMAT == "columnar" else LOG_FILE
         self.alert_threshold = 20  # Alert for queries > 20 seconds
+        self.wait_tracker = WaitStatsTracker(window_seconds=300)
+        # fingerprint -> [samples, timeout_risk_samples, max_elapsed, sample_query, seconds_at_risk]
+        self.fingerprint_stats = {}
+        self.text_cache = SqlTextCache(capacity=2048)
+        self.interval = AdaptiveInterval(min_interval, max_interval)
+        self.last_sample = None
+        self.last_wait_sample = None
+        self.last_query_count = 0
+        self.blocking_trees = []  # head blocker nodes from the last sample
+        self.blocking_heads = frozenset()
+        self.last_blocking_report = 0.0
+        self.lock = threading.Lock()  # wait_tracker is sampled and reported from different collectors
+        self.clock = time.monotonic  # sampling clocks; dmv_replay.py substitutes the recorded times
+        self.now = datetime.now
+        # (session_id, request_id, start_time) -> [fingerprint, elapsed, seen_at, query] of running requests
+        self.in_flight = {}
+        # session_id -> alert kinds last printed for it ("TIMEOUT_RISK", "BLOCKED")
+        self.alerting = {}
+        self.sketches = SketchSet()  # durations of completed executions per fingerprint
+        self.sketches.servers.add(self.name)
+        self.sketch_day = None  # day of the first completion in self.sketches
+        self.sketch_started = datetime.now().strftime('%H%M%S')
+        self.sketch_lock = threading.Lock()  # sketches are updated and saved from different collectors
+        self.plan_sampler = None  # opened by the plan cache collector on its own thread (SQLite)
+        self.plan_sample = None  # last plan cache sample, printed by the periodic report
+        self.xe_reader = None  # opened by the timeouts collector
+        self.xe_warned = False
+        self.xe_timeouts = deque()  # read by the timeouts collector, logged by the requests collector
+        self.timed_out = {}  # fingerprint -> [timeouts, max duration, sample query]
+        self.deadlock_collector = None  # opened by the deadlock collector on its own thread (SQLite)
+        self.deadlock_warned = False
+        self.deadlock_shapes = {}  # deadlock fingerprint -> [deadlocks, objects] since monitoring started
 
     def connect(self):
         """Establish database connection"""
-        drivers = ["ODBC Driver 18 for SQL Server", "ODBC Driver 17 for SQL Server"]
-
-        for driver in drivers:
-            try:
-                connection_string = (
-                    f"DRIVER={{{driver}}};"
-                    f"SERVER={SERVER},{PORT};"
-                    f"DATABASE={DATABASE};"
-                    f"UID={self.username};"
-                    f"PWD={self.password};"
-                    f"TrustServerCertificate=yes;"
-                    f"Encrypt=yes;"
-                )
-                self.connection = pyodbc.connect(connection_string, timeout=10)
-                print(f"✓ Connected using {driver}")
-                return True
-            except:
-                continue
-
-        print("✗ Failed to connect")
-        return False
+        try:
+            self.connection = self.factory.connect()
+            print(f"✓ {self.prefix}Connected using {self.factory.strategy['name']}")
+            return True
+        except ConnectionFailed:
+            print(f"✗ {self.prefix}Failed to connect")
+            return False
 
     def setup_logging(self):
-        """Initialize CSV logging"""
-        self.csv_file = open(LOG_FILE, 'w', newline='')
-        self.csv_writer = csv.writer(self.csv_file)
-        self.csv_writer.writerow([
-            'Timestamp', 'SessionID', 'Status', 'Command', 'ElapsedSec',
-            'WaitType', 'BlockingSession', 'Database', 'QuerySnippet', 'Alert'
-        ])
-        print(f"✓ Logging to {LOG_FILE}")
-
-    def monitor_queries(self):
-        """Monitor currently executing queries"""
-        cursor = self.connection.cursor()
-
-        query = """
-        SELECT
-            r.session_id,
-            r.status,
-            r.command,
-            r.total_elapsed_time / 1000.0 AS ElapsedSec,
-            r.wait_type,
-            r.blocking_session_id,
-            r.cpu_time / 1000.0 AS CPUSec,
-            r.logical_reads,
-            DB_NAME(r.database_id) AS DatabaseName,
-            SUBSTRING(t.text, 1, 200) AS QueryText
-        FROM sys.dm_exec_requests r
-        CROSS APPLY sys.dm_exec_sql_text(r.sql_handle) t
-        WHERE r.session_id > 50
-            AND r.session_id != @@SPID
-        ORDER BY r.total_elapsed_time DESC
+        """Initialize performance logging"""
+        log_format = LOG_FORMAT
+        if log_format == "columnar" and not columnar_available():
+            print("⚠ numpy is not installed - falling back to CSV logging")
+            log_format = "csv"
+        self.log_path = LOG_DIR if log_format == "columnar" else LOG_FILE
+        self.log_writer = open_log_writer(self.log_path, log_format)
+        print(f"✓ Logging to {self.log_path}")
+
+    def monitor_queries(self, connection=None, sample_interval=MONITOR_INTERVAL, queries=None):
+        """Monitor currently executing queries; each row is logged as standing for sample_interval seconds.
+
+        queries are the request rows when they were already fetched as part of a snapshot batch.
         """
+        connection = connection or self.connection
+        if queries is None:
+            cursor = connection.cursor()
+            cursor.execute(REQUESTS_QUERY.sql)
+            queries = cursor.fetchall()
+
+        # Statement text comes from the cache; only new handles cost a round trip
+        texts = self.text_cache.resolve(connection, [
+            (q.sql_handle, q.statement_start_offset, q.statement_end_offset) for q in queries
+        ])
 
-        cursor.execute(query)
-        queries = cursor.fetchall()
-
-        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        now = self.now()
+        timestamp = now.strftime(TIMESTAMP_FORMAT)
+        seen_at = self.clock()
         alerts = []
+        blocked = 0
+        running = {}
+        alerting = {}
 
         for q in queries:
             alert = ""
+            kinds = ()
+            query_text = texts[(q.sql_handle, q.statement_start_offset, q.statement_end_offset)]
+            query_fingerprint = fingerprint(query_text, q.query_hash)
+            stats = self.fingerprint_stats.get(query_fingerprint)
+            if stats is None:
+                stats = self.fingerprint_stats[query_fingerprint] = [0, 0, 0.0, query_text[:100], 0.0]
+            stats[0] += 1
+            running[(q.session_id, q.request_id, q.start_time)] = [
+                query_fingerprint, float(q.ElapsedSec), seen_at, query_text]
 
             # Check for timeout risk
             if q.ElapsedSec > self.alert_threshold:
                 alert = f"TIMEOUT_RISK ({q.ElapsedSec:.1f}s)"
+                kinds += ("TIMEOUT_RISK",)
                 alerts.append((q.session_id, q.ElapsedSec))
+                stats[1] += 1
+                stats[2] = max(stats[2], float(q.ElapsedSec))
+                stats[4] += sample_interval
 
             # Check for blocking
             if q.blocking_session_id and q.blocking_session_id > 0:
                 alert += " BLOCKED"
+                kinds += ("BLOCKED",)
+                blocked += 1
 
-            # Log to CSV
-            self.csv_writer.writerow([
-                timestamp,
+            # Log the sample
+            self.log_writer.write_row([
+                now,
                 q.session_id,
                 q.status,
                 q.command,
-                f"{q.ElapsedSec:.2f}",
+                float(q.ElapsedSec),
                 q.wait_type or "",
-                q.blocking_session_id or "",
+                q.blocking_session_id or None,
                 q.DatabaseName,
-                str(q.QueryText)[:100] if q.QueryText else "",
-                alert
+                query_text[:SNIPPET_LENGTH],
+                alert,
+                query_fingerprint,
+                hash_hex(q.query_plan_hash),
+                sample_interval,
+                self.name
             ])
 
-            # Print alerts to console
-            if alert:
-                print(f"[{timestamp}] ⚠ Session {q.session_id}: {alert}")
-                if q.QueryText:
-                    print(f"  Query: {str(q.QueryText)[:100]}...")
-
-        return len(queries), alerts
-
-    def check_blocking_chains(self):
-        """Check for blocking chain issues"""
-        cursor = self.connection.cursor()
-
-        cursor.execute("""
-        WITH BlockingChain AS (
-            SELECT
-                r1.session_id AS BlockedSession,
-                r1.blocking_session_id AS BlockingSession,
-                r1.wait_time / 1000.0 AS WaitSec,
-                r1.wait_type,
-                1 AS Level
-            FROM sys.dm_exec_requests r1
-            WHERE r1.blocking_session_id > 0
-
-            UNION ALL
-
-            SELECT
-                r2.session_id,
-                r2.blocking_session_id,
-                r2.wait_time / 1000.0,
-                r2.wait_type,
-                bc.Level + 1
-            FROM sys.dm_exec_requests r2
-            INNER JOIN BlockingChain bc ON r2.blocking_session_id = bc.BlockedSession
-            WHERE bc.Level < 5
+            # Print alerts to console when a request enters or changes alert state; every sample is logged
+            if kinds:
+                alerting[q.session_id] = kinds
+                previous = self.alerting.get(q.session_id)
+                if kinds != previous:
+                    print(f"[{timestamp}] ⚠ {self.prefix}Session {q.session_id}: {alert}")
+                    if query_text and previous is None:
+                        print(f"  Query: {query_text[:100]}...")
+
+        # Blocking trees come from the same snapshot; only idle head blockers cost a lookup
+        self.blocking_trees = build_blocking_trees(
+            (q.session_id, q.blocking_session_id, q.WaitSec, q.wait_type, q.status,
+             texts[(q.sql_handle, q.statement_start_offset, q.statement_end_offset)])
+            for q in queries
         )
-        SELECT * FROM BlockingChain
-        ORDER BY Level, WaitSec DESC
-        """)
+        self.lookup_idle_blockers(connection, idle_blockers(self.blocking_trees))
+        self.record_completions(running, now, seen_at)
+        for session_id, kinds in self.alerting.items():
+            if session_id not in alerting:
+                print(f"[{timestamp}] ✓ {self.prefix}Session {session_id}: {' '.join(kinds)} cleared")
+        self.alerting = alerting
+
+        return len(queries), alerts, blocked
+
+    def record_completions(self, running, now, seen_at):
+        """Add requests that were running at the previous sample but not now to the latency sketches.
 
-        chains = cursor.fetchall()
-        if chains:
-            print("\n⚠ BLOCKING CHAIN DETECTED:")
-            for chain in chains:
-                print(f"  Level {chain.Level}: Session {chain.BlockedSession} blocked by {chain.BlockingSession} ({chain.WaitSec:.1f}s)")
+        An execution ended between its last sighting and this sample, so its
+        duration is taken as the last elapsed time plus half that gap.
+        Executions shorter than the sampling interval may never be seen.
+        """
+        finished = [entry for key, entry in self.in_flight.items() if key not in running]
+        self.in_flight = running
+        if not finished:
+            return
+        day = now.strftime('%Y%m%d')
+        if self.sketch_day is None:
+            self.sketch_day = day
+        elif day != self.sketch_day:
+            self.save_sketches()
+            with self.sketch_lock:
+                self.sketches = SketchSet()
+                self.sketches.servers.add(self.name)
+                self.sketch_day = day
+        stamp = now.isoformat(timespec='seconds')
+        with self.sketch_lock:
+            for key, elapsed, last_seen, query in finished:
+                self.sketches.add(key, elapsed + (seen_at - last_seen) / 2, query)
+            self.sketches.start = self.sketches.start or stamp
+            self.sketches.end = stamp
+
+    def save_sketches(self):
+        """Persist this instance's latency sketches for the current day (merge them with latency_sketch.py)"""
+        with self.sketch_lock:
+            if not self.sketches.sketches:
+                return None
+            path = sketch_path(SKETCH_DIR, self.name, self.sketch_day, self.sketch_started)
+            try:
+                self.sketches.save(path)
+            except OSError as e:
+                print(f"⚠ {self.prefix}Could not save latency sketches: {e}")
+                return None
+        return path
+
+    def print_latency_summary(self, n=5):
+        """p50/p95/p99 of completed executions per fingerprint since the start of the day"""
+        with self.sketch_lock:
+            print_percentiles(self.sketches, n, self.prefix)
+
+    def lookup_idle_blockers(self, connection, heads):
+        """Attach session details and last statement to head blockers that have no request"""
+        if not heads:
+            return
+        cursor = connection.cursor()
+        cursor.execute(IDLE_SESSIONS_QUERY.format(", ".join("?" for _ in heads)),
+                       *[head.session_id for head in heads])
+        sessions = {row.session_id: row for row in cursor.fetchall()}
+        texts = self.text_cache.resolve(connection, [
+            (row.most_recent_sql_handle, 0, -1) for row in sessions.values()
+        ])
+        for head in heads:
+            head.session = sessions.get(head.session_id)
+            if head.session is not None:
+                head.query = texts[(head.session.most_recent_sql_handle, 0, -1)]
+
+    def report_blocking(self):
+        """Print blocking trees when the head blockers change, and periodically while they persist"""
+        heads = self.blocking_trees
+        head_ids = frozenset(head.session_id for head in heads)
+        now = self.clock()
+        if heads and (head_ids != self.blocking_heads or
+                      now - self.last_blocking_report >= BLOCKING_REPEAT_SECONDS):
+            print_blocking_trees(heads, self.prefix)
+            self.last_blocking_report = now
+        elif not heads and self.blocking_heads:
+            print(f"[{datetime.now().strftime('%H:%M:%S')}] ✓ {self.prefix}Blocking cleared")
+        self.blocking_heads = head_ids
 
     def get_performance_stats(self):
-        """Get overall performance statistics"""
-        cursor = self.connection.cursor()
-
-        # Get wait statistics
-        cursor.execute("""
-        SELECT TOP 5
-            wait_type,
-            wait_time_ms / 1000.0 AS TotalWaitSec,
-            waiting_tasks_count AS WaitCount,
-            wait_time_ms / NULLIF(waiting_tasks_count, 0) / 1000.0 AS AvgWaitSec
-        FROM sys.dm_os_wait_stats
-        WHERE wait_type NOT IN (
-            'SLEEP_TASK', 'BROKER_TASK_STOP', 'WAITFOR',
-            'LAZYWRITER_SLEEP', 'CHECKPOINT_QUEUE'
-        )
-        ORDER BY wait_time_ms DESC
-        """)
+        """Show wait statistics for the last interval and the rolling window"""
+        with self.lock:
+            self._print_wait_stats(self.wait_tracker)
 
-        waits = cursor.fetchall()
+    def _print_wait_stats(self, tracker):
+        if not tracker.window:
+            print(f"\n{self.prefix}[Top Wait Types] Collecting baseline...")
+            return
 
-        print("\n[Top Wait Types]")
-        for wait in waits:
-            print(f"  {wait.wait_type}: {wait.TotalWaitSec:.1f}s total, {wait.AvgWaitSec:.2f}s avg")
+        print_wait_deltas(f"{self.prefix}Top Wait Types - last interval", tracker.top_interval(5),
+                          tracker.interval_seconds)
+        print_wait_deltas(f"{self.prefix}Top Wait Types - rolling window", tracker.top_window(5),
+                          tracker.window_elapsed)
+
+        signal_ms, resource_ms = tracker.signal_resource_split(window=True)
+        total_ms = signal_ms + resource_ms
+        if total_ms:
+            print(f"  Signal (CPU) waits: {100.0 * signal_ms / total_ms:.0f}%, "
+                  f"Resource waits: {100.0 * resource_ms / total_ms:.0f}%")
+        if tracker.resets:
+            print(f"  Note: wait stats were cleared {tracker.resets} time(s) while monitoring")
+
+    def print_query_summary(self, n=5):
+        """Show the statements most often at timeout risk since monitoring started"""
+        risky = [(key, stats) for key, stats in list(self.fingerprint_stats.items()) if stats[1]]
+        if not risky:
+            return
+        print(f"\n{self.prefix}[Queries at Timeout Risk - by fingerprint]")
+        for key, (samples, timeout_samples, max_elapsed, query, risk_seconds) in sorted(
+                risky, key=lambda x: x[1][4], reverse=True)[:n]:
+            print(f"  {key}: ~{risk_seconds:.0f}s at risk ({timeout_samples}/{samples} samples), "
+                  f"max {max_elapsed:.1f}s")
+            print(f"    Query: {query[:80]}...")
+
+    def collect_requests(self, connection):
+        """Requests collector: sample, adapt the sampling interval and flush the log"""
+        tick = self.clock()
+        # Each row stands for the time since the previous sample
+        sample_interval = tick - self.last_sample if self.last_sample else self.interval.current
+        self.last_sample = tick
+
+        # Batched tick: requests and (when due) wait stats in one round trip, from one point in time
+        queries = [REQUESTS_QUERY]
+        wait_stats_due = BATCHED_TICK and (self.last_wait_sample is None or
+                                           tick - self.last_wait_sample >= MONITOR_INTERVAL)
+        if wait_stats_due:
+            queries.append(WAIT_STATS_SNAPSHOT)
+        snapshot = collect_snapshot(connection, queries)
+        if wait_stats_due:
+            self.last_wait_sample = tick
+            self.update_wait_stats(snapshot['wait_stats'], tick)
+
+        query_count, alerts, blocked = self.monitor_queries(connection, sample_interval, snapshot['requests'])
+        self.last_query_count = query_count
+        if self.metrics:
+            self.publish_requests(query_count, len(alerts), blocked)
+        self.report_blocking()
+        self.log_timeouts()
+        if self.interval.update(alerts or blocked):
+            print(f"[{datetime.now().strftime('%H:%M:%S')}] {self.prefix}Sampling every {self.interval.current}s "
+                  f"while queries are at risk")
+        self.log_writer.flush()
+
+    def collect_wait_stats(self, connection):
+        """Wait stats collector: fold a snapshot in so every report covers a known interval"""
+        cursor = connection.cursor()
+        cursor.execute(WAIT_STATS_QUERY)
+        self.update_wait_stats(cursor.fetchall(), self.clock())
+
+    def collect_xe_timeouts(self, connection):
+        """Timeouts collector: executions that timed out since the last poll, even between request samples"""
+        if self.xe_reader is None:
+            self.xe_reader = XeTimeoutReader(self.server, self.database)
+        try:
+            timeouts = self.xe_reader.poll(connection)
+        except XeUnavailable as e:
+            if not self.xe_warned:
+                print(f"⚠ {self.prefix}Timeouts between samples will be missed: {e}")
+                print(f"  Session DDL for a DBA: python xe_timeouts.py --database {self.database}")
+                self.xe_warned = True
+            return
+        self.xe_warned = False
+        self.xe_timeouts.extend(timeouts)
+
+    def log_timeouts(self):
+        """Write queued timeouts to the log as event rows (SampleInterval 0: they stand for no sampled time)"""
+        while self.xe_timeouts:
+            t = self.xe_timeouts.popleft()
+            query_fingerprint = fingerprint(t.statement, t.query_hash)
+            duration = t.duration_sec or 0.0
+            alert = f"{TIMED_OUT_ALERT} ({t.kind}, {duration:.1f}s)"
+            self.log_writer.write_row([
+                t.timestamp,
+                t.session_id,
+                'timed out',
+                EVENT_COMMANDS.get(t.event, t.event),
+                duration,
+                "",
+                None,
+                t.database,
+                t.statement[:SNIPPET_LENGTH],
+                alert,
+                query_fingerprint,
+                "",
+                0.0,
+                self.name
+            ])
+            stats = self.timed_out.setdefault(query_fingerprint, [0, 0.0, t.statement[:100]])
+            stats[0] += 1
+            stats[1] = max(stats[1], duration)
+            print(f"[{t.timestamp.strftime('%H:%M:%S')}] ⚠ {self.prefix}Session {t.session_id}: {alert} "
+                  f"from {t.client_host or 'unknown host'}")
+            if t.statement:
+                print(f"  Query: {t.statement[:100]}...")
+            if self.metrics:
+                self.metrics.inc('pvault_timeouts', server=self.name)
+
+    def print_timeout_summary(self, n=5):
+        """Show the statements that timed out most often since monitoring started"""
+        if not self.timed_out:
+            return
+        print(f"\n{self.prefix}[Timed Out Executions - Extended Events]")
+        for key, (count, max_duration, query) in sorted(
+                list(self.timed_out.items()), key=lambda x: x[1][0], reverse=True)[:n]:
+            print(f"  {key}: {count} timeouts, longest {max_duration:.1f}s")
+            print(f"    Query: {query[:80]}...")
+
+    def collect_deadlocks(self, connection):
+        """Deadlock collector: system_health deadlock reports since the last read, counted per shape"""
+        if self.deadlock_collector is None:
+            self.deadlock_collector = DeadlockCollector(self.name)
+        try:
+            deadlocks = self.deadlock_collector.collect(connection)
+        except XeUnavailable as e:
+            if not self.deadlock_warned:
+                print(f"⚠ {self.prefix}Deadlocks will not be reported: {e}")
+                self.deadlock_warned = True
+            return
+        self.deadlock_warned = False
+        if not deadlocks:
+            return
+        print_deadlocks(deadlocks, self.prefix)
+        for d in deadlocks:
+            shape = self.deadlock_shapes.setdefault(d.fingerprint, [0, ", ".join(d.objects)])
+            shape[0] += 1
+        if self.metrics:
+            self.metrics.inc('pvault_deadlocks', len(deadlocks), server=self.name)
+
+    def print_deadlock_summary(self, n=5):
+        """Deadlock shapes seen most often since monitoring started"""
+        if not self.deadlock_shapes:
+            return
+        print(f"\n{self.prefix}[Deadlocks - system_health]")
+        for key, (count, objects) in sorted(
+                list(self.deadlock_shapes.items()), key=lambda x: x[1][0], reverse=True)[:n]:
+            print(f"  {key}: {count} deadlocks on {objects[:100]}")
+        print("  Details: python deadlock_collector.py --fingerprint <fingerprint>")
+
+    def collect_plan_cache(self, connection):
+        """Plan cache collector: per-interval deltas of the top plans, stored by plan_cache_sampler"""
+        if self.plan_sampler is None:
+            self.plan_sampler = PlanCacheSampler(self.name)
+        self.plan_sample = self.plan_sampler.sample(connection)
+
+    def print_plan_cache(self, n=5):
+        sample = self.plan_sample
+        if sample is not None and sample.seconds is not None:
+            print_sample(sample, by="cpu", n=n, title=f"{self.prefix}Top plans by CPU - last plan cache sample")
+
+    def update_wait_stats(self, rows, now=None):
+        with self.lock:
+            if self.wait_tracker.update(rows, now) and self.metrics:
+                self.publish_wait_stats()
+
+    def requests_failed(self, error):
+        self.in_flight = {}  # cannot tell when these ended
+        if self.metrics:
+            self.metrics.set('pvault_up', 0, server=self.name)
+
+    def publish_requests(self, query_count, timeout_risk, blocked):
+        metrics, server = self.metrics, self.name
+        metrics.set('pvault_up', 1, server=server)
+        metrics.set('pvault_active_requests', query_count, server=server)
+        metrics.set('pvault_blocked_requests', blocked, server=server)
+        metrics.set('pvault_timeout_risk_requests', timeout_risk, server=server)
+        metrics.set('pvault_sample_interval_seconds', self.interval.current, server=server)
+        metrics.inc('pvault_samples', server=server)
+        metrics.inc('pvault_timeout_risk_samples', timeout_risk, server=server)
+        heads = self.blocking_trees
+        metrics.set('pvault_head_blockers', len(heads), server=server)
+        metrics.set('pvault_blocking_max_depth', max((h.depth for h in heads), default=0), server=server)
+        metrics.set('pvault_blocking_wait_seconds', sum(h.blocked_wait_sec for h in heads), server=server)
+
+    def publish_wait_stats(self):
+        """Export the last wait stats interval (caller holds self.lock)"""
+        tracker, metrics, server = self.wait_tracker, self.metrics, self.name
+        seconds = tracker.interval_seconds
+        top = tracker.top_interval(WAIT_TYPES_EXPORTED)
+        metrics.set('pvault_wait_interval_seconds', seconds, server=server)
+        for name, values in (
+                ('pvault_wait_seconds_per_second',
+                 {(('wait_type', d.wait_type),): d.wait_ms / 1000.0 / seconds for d in top} if seconds else {}),
+                ('pvault_waits_per_second', {(('wait_type', d.wait_type),): d.waits_per_sec for d in top}),
+                ('pvault_wait_avg_milliseconds', {(('wait_type', d.wait_type),): d.avg_wait_ms for d in top})):
+            metrics.replace(name, values, server=server)
+        signal_ms, resource_ms = tracker.signal_resource_split()
+        if signal_ms + resource_ms:
+            metrics.set('pvault_wait_signal_ratio', signal_ms / (signal_ms + resource_ms), server=server)
+
+    def report(self):
+        """Periodic report: wait stats, riskiest queries and collector health"""
+        self.get_performance_stats()
+        self.print_query_summary()
+        self.print_timeout_summary()
+        self.print_deadlock_summary()
+        self.print_latency_summary()
+        self.print_plan_cache()
+        self.scheduler.print_report()
+
+    def print_status(self):
+        cache = self.text_cache
+        print(f"[{datetime.now().strftime('%H:%M:%S')}] Monitoring... {self.last_query_count} active queries, "
+              f"sampling every {self.interval.current:.1f}s "
+              f"(text cache: {len(cache)} statements, {cache.hit_rate():.0f}% hits, "
+              f"{cache.misses} misses)")
+
+    def add_collectors(self, scheduler, reports=True):
+        """Register this instance's collectors, each with its own period, thread and connection"""
+        prefix = f"{self.name}/" if self.prefix else ""
+        connect = self.factory.connect
+        self.scheduler = scheduler
+        self.collectors = {
+            "requests": scheduler.add(f"{prefix}requests", lambda: self.interval.current,
+                                      self.collect_requests, connect, on_error=self.requests_failed),
+        }
+        self.collectors["sketches"] = scheduler.add(f"{prefix}sketches", SKETCH_SAVE_SECONDS,
+                                                    self.save_sketches, delay=SKETCH_SAVE_SECONDS)
+        if PLAN_CACHE_SECONDS:
+            self.collectors["plan_cache"] = scheduler.add(f"{prefix}plan_cache", PLAN_CACHE_SECONDS,
+                                                          self.collect_plan_cache, connect)
+        if XE_POLL_SECONDS:
+            self.collectors["xe_timeouts"] = scheduler.add(f"{prefix}xe_timeouts", XE_POLL_SECONDS,
+                                                           self.collect_xe_timeouts, connect)
+        if DEADLOCK_SECONDS:
+            self.collectors["deadlocks"] = scheduler.add(f"{prefix}deadlocks", DEADLOCK_SECONDS,
+                                                         self.collect_deadlocks, connect)
+        if not BATCHED_TICK:
+            self.collectors["wait_stats"] = scheduler.add(f"{prefix}wait_stats", MONITOR_INTERVAL,
+                                                          self.collect_wait_stats, connect)
+        if reports:
+            scheduler.add("report", STATS_REPORT_SECONDS, self.report, delay=STATS_REPORT_SECONDS)
+            scheduler.add("status", STATUS_SECONDS, self.print_status, delay=STATUS_SECONDS)
+        return scheduler
 
     def run(self):
         """Main monitoring loop"""
@@ -191,107 +607,150 @@ class QueryMonitor:
             return
 
         self.setup_logging()
-        print(f"\n✓ Monitoring started (checking every {MONITOR_INTERVAL} seconds)")
+        interval = self.interval
+        print(f"\n✓ Monitoring started (sampling every {interval.minimum}-{interval.maximum} seconds, "
+              f"faster while queries are at risk)")
         print("Press Ctrl+C to stop monitoring\n")
 
-        iteration = 0
-
+        self.add_collectors(CollectorScheduler())
+        exporter = self.start_exporter() if EXPORT_METRICS else None
         try:
-            while True:
-                iteration += 1
-
-                # Monitor queries
-                query_count, alerts = self.monitor_queries()
-
-                # Flush CSV buffer
-                self.csv_file.flush()
-
-                # Every 12 iterations (1 minute), check for blocking chains
-                if iteration % 12 == 0:
-                    self.check_blocking_chains()
-
-                # Every 60 iterations (5 minutes), show performance stats
-                if iteration % 60 == 0:
-                    self.get_performance_stats()
-
-                # Status update every 6 iterations (30 seconds)
-                if iteration % 6 == 0:
-                    print(f"[{datetime.now().strftime('%H:%M:%S')}] Monitoring... {query_count} active queries")
-
-                time.sleep(MONITOR_INTERVAL)
-
+            self.scheduler.start()
+            self.scheduler.wait()
         except KeyboardInterrupt:
             print("\n\n✓ Monitoring stopped")
         finally:
+            if exporter:
+                exporter.stop()
             self.cleanup()
 
+    def start_exporter(self):
+        """Serve this monitor's metrics; returns the exporter, or None if it could not start"""
+        self.metrics = MetricsRegistry()
+        self.metrics.watch_scheduler(self.scheduler)
+        exporter = MetricsExporter(self.metrics)
+        return exporter if exporter.start() else None
+
     def cleanup(self):
         """Clean up resources"""
-        if self.csv_file:
-            self.csv_file.close()
-            print(f"✓ Performance log saved to {LOG_FILE}")
+        if self.scheduler:
+            self.scheduler.stop()
+            self.scheduler.print_report()
+
+        if self.log_writer:
+            self.log_writer.close()
+            print(f"✓ Performance log saved to {self.log_path}")
+
+        sketches = self.save_sketches()
+        if sketches:
+            print(f"✓ Latency sketches saved to {sketches}")
 
         if self.connection:
             self.connection.close()
 
-    def analyze_log(self):
+    def _read_log(self, columns, start=None, end=None):
+        """Yield log rows as dicts of the requested columns within [start, end]"""
+        if is_columnar_log(self.log_path):
+            reader = ColumnarLogReader(self.log_path)
+            for chunk in reader.iter_segments(columns, start, end):
+                for values in zip(*(chunk[c] for c in columns)):
+                    yield dict(zip(columns, values))
+            return
+
+        start_text = start.strftime(TIMESTAMP_FORMAT) if start else None
+        end_text = end.strftime(TIMESTAMP_FORMAT) if end else None
+        with open(self.log_path, 'r') as f:
+            for row in csv.DictReader(f):
+                # Timestamps are zero-padded, so string comparison orders them
+                if start_text and row['Timestamp'] < start_text:
+                    continue
+                if end_text and row['Timestamp'] > end_text:
+                    continue
+                yield row
+
+    def analyze_log(self, start=None, end=None):
         """Analyze the collected performance data"""
         print("\n" + "="*60)
         print("PERFORMANCE ANALYSIS")
         print("="*60)
 
-        if not os.path.exists(LOG_FILE):
+        if not os.path.exists(self.log_path):
             print("No log file found")
             return
 
+        if LogAnalyzer is not None:
+            LogAnalyzer().analyze([self.log_path], start, end).print_summary()
+            return
+
         timeout_queries = {}
+        timed_out = {}
         blocked_queries = {}
         total_rows = 0
 
-        with open(LOG_FILE, 'r') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                total_rows += 1
-
-                # Track timeout-risk queries
-                if 'TIMEOUT_RISK' in row['Alert']:
-                    session_id = row['SessionID']
-                    if session_id not in timeout_queries:
-                        timeout_queries[session_id] = {
-                            'count': 0,
-                            'max_elapsed': 0,
-                            'query': row['QuerySnippet']
-                        }
-                    timeout_queries[session_id]['count'] += 1
-                    elapsed = float(row['ElapsedSec'])
-                    if elapsed > timeout_queries[session_id]['max_elapsed']:
-                        timeout_queries[session_id]['max_elapsed'] = elapsed
-
-                # Track blocked queries
-                if row['BlockingSession']:
-                    blocker = row['BlockingSession']
-                    if blocker not in blocked_queries:
-                        blocked_queries[blocker] = 0
-                    blocked_queries[blocker] += 1
+        columns = ['ElapsedSec', 'BlockingSession', 'QuerySnippet', 'Alert', 'Fingerprint',
+                   'SampleInterval']
+        for row in self._read_log(columns, start, end):
+            total_rows += 1
+            # Samples are weighted by the time they stand for (older logs: fixed interval)
+            seconds = float(row.get('SampleInterval') or 0) or LEGACY_SAMPLE_INTERVAL
+
+            # Timeouts read from the event session are events, not samples
+            if row['Alert'].startswith(TIMED_OUT_ALERT):
+                key = row.get('Fingerprint') or fingerprint(row['QuerySnippet'])
+                entry = timed_out.setdefault(key, [0, 0.0, row['QuerySnippet']])
+                entry[0] += 1
+                entry[1] = max(entry[1], float(row['ElapsedSec']))
+                continue
+
+            # Track timeout-risk queries by fingerprint (older logs: hash the snippet)
+            if 'TIMEOUT_RISK' in row['Alert']:
+                key = row.get('Fingerprint') or fingerprint(row['QuerySnippet'])
+                if key not in timeout_queries:
+                    timeout_queries[key] = {
+                        'count': 0,
+                        'seconds': 0.0,
+                        'max_elapsed': 0,
+                        'query': row['QuerySnippet']
+                    }
+                timeout_queries[key]['count'] += 1
+                timeout_queries[key]['seconds'] += seconds
+                elapsed = float(row['ElapsedSec'])
+                if elapsed > timeout_queries[key]['max_elapsed']:
+                    timeout_queries[key]['max_elapsed'] = elapsed
+
+            # Track blocked queries
+            if row['BlockingSession']:
+                blocker = row['BlockingSession']
+                if blocker not in blocked_queries:
+                    blocked_queries[blocker] = [0, 0.0]
+                blocked_queries[blocker][0] += 1
+                blocked_queries[blocker][1] += seconds
 
         print(f"\nAnalyzed {total_rows} monitoring records")
 
         if timeout_queries:
-            print("\n[Sessions with Timeout Risk]")
-            for session_id, data in sorted(timeout_queries.items(),
-                                         key=lambda x: x[1]['max_elapsed'],
-                                         reverse=True)[:5]:
-                print(f"  Session {session_id}:")
-                print(f"    Occurrences: {data['count']}")
+            print("\n[Queries with Timeout Risk]")
+            for key, data in sorted(timeout_queries.items(),
+                                    key=lambda x: x[1]['max_elapsed'],
+                                    reverse=True)[:5]:
+                print(f"  Fingerprint {key or '(unknown)'}:")
+                print(f"    Occurrences: {data['count']} samples (~{data['seconds']:.0f}s at risk)")
                 print(f"    Max Duration: {data['max_elapsed']:.1f}s")
                 print(f"    Query: {data['query'][:80]}...")
 
+        if timed_out:
+            print("\n[Timed Out Executions]")
+            for key, (count, max_elapsed, query) in sorted(timed_out.items(), key=lambda x: x[1][0],
+                                                          reverse=True)[:5]:
+                print(f"  Fingerprint {key or '(unknown)'}: {count} timeouts, longest {max_elapsed:.1f}s")
+                print(f"    Query: {query[:80]}...")
+
         if blocked_queries:
             print("\n[Top Blocking Sessions]")
-            for blocker, count in sorted(blocked_queries.items(),
-                                        key=lambda x: x[1],
-                                        reverse=True)[:5]:
-                print(f"  Session {blocker}: blocked {count} queries")
+            for blocker, (count, seconds) in sorted(blocked_queries.items(),
+                                                    key=lambda x: x[1][1],
+                                                    reverse=True)[:5]:
+                print(f"  Session {blocker}: blocked {count} queries (~{seconds:.0f}s of blocked samples)")
 
 def main():
     print("="*60)
@@ -306,11 +765,18 @@ def main():
     monitor = QueryMonitor(username, password)
 
     # Check if we should analyze existing log
-    if os.path.exists(LOG_FILE):
-        choice = input("\nExisting log found. (M)onitor or (A)nalyze? ").lower()
+    if os.path.exists(monitor.log_path):
+        if is_columnar_log(monitor.log_path):
+            choice = input("\nExisting log found. (M)onitor, (A)nalyze or (E)xport to CSV? ").lower()
+        else:
+            choice = input("\nExisting log found. (M)onitor or (A)nalyze? ").lower()
         if choice == 'a':
             monitor.analyze_log()
             return
+        if choice == 'e' and is_columnar_log(monitor.log_path):
+            rows = ColumnarLogReader(monitor.log_path).export_csv(LOG_FILE)
+            print(f"✓ Exported {rows} rows to {LOG_FILE}")
+            return
 
     # Start monitoring
     monitor.run()
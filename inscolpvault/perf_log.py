@@ -0,0 +1,280 @@
+"""
+Query performance log storage for the pVault monitor
+CSV writer plus an optional columnar backend: time-partitioned segments of typed columns
+"""
+
+import csv
+import json
+import os
+import threading
+import time
+
+try:
+    import numpy as np
+except ImportError:  # columnar backend is optional
+    np = None
+
+# Column name and type, in CSV order.
+#   time  - datetime, stored as float64 epoch seconds
+#   int   - int64, None stored as 0
+#   float - float64
+#   str   - dictionary encoded: int32 codes plus a per-segment dictionary
+LOG_SCHEMA = [
+    ('Timestamp', 'time'),
+    ('SessionID', 'int'),
+    ('Status', 'str'),
+    ('Command', 'str'),
+    ('ElapsedSec', 'float'),
+    ('WaitType', 'str'),
+    ('BlockingSession', 'int'),
+    ('Database', 'str'),
+    ('QuerySnippet', 'str'),
+    ('Alert', 'str'),
+    ('Fingerprint', 'str'),
+    ('PlanHash', 'str'),
+    ('SampleInterval', 'float'),
+    ('Server', 'str'),
+]
+LOG_COLUMNS = [name for name, kind in LOG_SCHEMA]
+COLUMN_KINDS = dict(LOG_SCHEMA)
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+# Seconds each sample stood for in logs written before SampleInterval was recorded
+LEGACY_SAMPLE_INTERVAL = 5.0
+# Alert of event rows: executions seen timing out (xe_timeouts.py), logged with SampleInterval 0
+TIMED_OUT_ALERT = 'TIMED_OUT'
+
+SEGMENT_META = 'meta.json'
+# Seconds a row stays buffered before flush() writes it out in a segment of its own:
+# bounds what a crash loses and how far analysis of a live log lags
+FLUSH_SECONDS = 60
+
+def columnar_available():
+    return np is not None
+
+def _csv_value(kind, value):
+    if value is None:
+        return ""
+    if kind == 'time':
+        return value.strftime(TIMESTAMP_FORMAT)
+    if kind == 'float':
+        return f"{value:.2f}"
+    if kind == 'int':
+        return value or ""
+    return value
+
+class CsvLogWriter:
+    """One CSV file, flushed on every flush() call"""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'w', newline='')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(LOG_COLUMNS)
+
+    def write_row(self, row):
+        self.writer.writerow([_csv_value(kind, value) for (name, kind), value in zip(LOG_SCHEMA, row)])
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+class ColumnarLogWriter:
+    """Buffers rows and writes them as segments of one .npy file per column.
+
+    A segment is rolled when it reaches segment_rows rows or when a row falls
+    into a new segment_seconds-wide time partition, whichever comes first, and
+    by flush() once its oldest row has been buffered for flush_seconds.
+    Segments are written to a temporary directory and renamed into place, so
+    readers never see a partial segment.
+    """
+
+    def __init__(self, directory, segment_rows=100000, segment_seconds=300, flush_seconds=FLUSH_SECONDS):
+        if np is None:
+            raise RuntimeError("The columnar log backend requires numpy (pip install numpy)")
+        self.path = directory
+        self.segment_rows = segment_rows
+        self.segment_seconds = segment_seconds
+        self.flush_seconds = flush_seconds
+        self.rows = []
+        self.buffered_at = None  # monotonic time the oldest buffered row arrived
+        self.partition = None
+        self.segment_count = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def write_row(self, row):
+        ts = row[0].timestamp()
+        partition = int(ts // self.segment_seconds)
+        if self.rows and (partition != self.partition or len(self.rows) >= self.segment_rows):
+            self._write_segment()
+        self.partition = partition
+        if not self.rows:
+            self.buffered_at = time.monotonic()
+        self.rows.append(row)
+
+    def flush(self):
+        """Write the buffered rows once the oldest has waited flush_seconds"""
+        if self.rows and time.monotonic() - self.buffered_at >= self.flush_seconds:
+            self._write_segment()
+
+    def close(self):
+        if self.rows:
+            self._write_segment()
+
+    def _write_segment(self):
+        rows, self.rows = self.rows, []
+        columns = list(zip(*rows))
+        start = rows[0][0]
+        name = f"seg_{start.strftime('%Y%m%d_%H%M%S')}_{self.segment_count:05d}"
+        self.segment_count += 1
+
+        final_dir = os.path.join(self.path, name)
+        tmp_dir = final_dir + '.tmp'
+        os.makedirs(tmp_dir, exist_ok=True)
+
+        meta = {'rows': len(rows), 'columns': {}}
+        for (column, kind), values in zip(LOG_SCHEMA, columns):
+            if kind == 'time':
+                data = np.array([v.timestamp() for v in values], dtype=np.float64)
+                meta['min_ts'] = float(data.min())
+                meta['max_ts'] = float(data.max())
+            elif kind == 'int':
+                data = np.array([v or 0 for v in values], dtype=np.int64)
+            elif kind == 'float':
+                data = np.array([0.0 if v is None else v for v in values], dtype=np.float64)
+            else:
+                dictionary = {}
+                codes = [dictionary.setdefault(v or "", len(dictionary)) for v in values]
+                data = np.array(codes, dtype=np.int32)
+                meta['columns'][column] = {'kind': kind, 'dictionary': list(dictionary)}
+            meta['columns'].setdefault(column, {'kind': kind})
+            np.save(os.path.join(tmp_dir, f"{column}.npy"), data)
+
+        with open(os.path.join(tmp_dir, SEGMENT_META), 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_dir, final_dir)
+
+class ColumnarLogReader:
+    """Reads only the requested columns from segments overlapping a time range"""
+
+    def __init__(self, directory):
+        if np is None:
+            raise RuntimeError("Reading a columnar log requires numpy (pip install numpy)")
+        self.path = directory
+
+    def segments(self, start=None, end=None):
+        """(segment_dir, meta) for every complete segment overlapping [start, end]"""
+        start_ts = start.timestamp() if start else None
+        end_ts = end.timestamp() if end else None
+        for name in sorted(os.listdir(self.path)):
+            segment_dir = os.path.join(self.path, name)
+            meta_file = os.path.join(segment_dir, SEGMENT_META)
+            if name.endswith('.tmp') or not os.path.exists(meta_file):
+                continue
+            with open(meta_file) as f:
+                meta = json.load(f)
+            if start_ts is not None and meta['max_ts'] < start_ts:
+                continue
+            if end_ts is not None and meta['min_ts'] > end_ts:
+                continue
+            yield segment_dir, meta
+
+    def iter_segments(self, columns, start=None, end=None, decode=True):
+        """Yield {column: array} per segment, filtered to [start, end].
+
+        String columns are decoded to object arrays unless decode=False, in
+        which case {column: codes} is returned and the dictionary is available
+        as '<column>.dictionary'.
+        """
+        start_ts = start.timestamp() if start else None
+        end_ts = end.timestamp() if end else None
+        for segment_dir, meta in self.segments(start, end):
+            mask = None
+            if (start_ts is not None and meta['min_ts'] < start_ts) or \
+               (end_ts is not None and meta['max_ts'] > end_ts):
+                ts = np.load(os.path.join(segment_dir, 'Timestamp.npy'), mmap_mode='r')
+                mask = np.ones(len(ts), dtype=bool)
+                if start_ts is not None:
+                    mask &= ts >= start_ts
+                if end_ts is not None:
+                    mask &= ts <= end_ts
+                if not mask.any():
+                    continue
+
+            chunk = {}
+            for column in columns:
+                chunk.update(self._load_column(segment_dir, meta, column, mask, decode))
+            yield chunk
+
+    def _load_column(self, segment_dir, meta, column, mask, decode):
+        info = meta['columns'].get(column)
+        kind = info['kind'] if info else COLUMN_KINDS.get(column, 'str')
+        path = os.path.join(segment_dir, f"{column}.npy")
+        if os.path.exists(path):
+            data = np.load(path, mmap_mode='r')
+            data = np.asarray(data[mask] if mask is not None else data)
+        else:
+            # Column added after this segment was written
+            rows = int(mask.sum()) if mask is not None else meta['rows']
+            data = np.zeros(rows, dtype={'str': np.int32, 'int': np.int64}.get(kind, np.float64))
+            info = {'kind': kind, 'dictionary': [""]}
+
+        if kind != 'str':
+            return {column: data}
+        dictionary = info.get('dictionary', [""])
+        if decode:
+            return {column: np.asarray(dictionary, dtype=object)[data]}
+        return {column: data, f"{column}.dictionary": dictionary}
+
+    def export_csv(self, out_path, start=None, end=None):
+        """Write the (optionally time-filtered) log back out as CSV"""
+        rows = 0
+        with open(out_path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(LOG_COLUMNS)
+            for chunk in self.iter_segments(LOG_COLUMNS, start, end):
+                formatted = []
+                for name, kind in LOG_SCHEMA:
+                    values = chunk[name]
+                    if kind == 'time':
+                        formatted.append([time.strftime(TIMESTAMP_FORMAT, time.localtime(v)) for v in values])
+                    elif kind == 'float':
+                        formatted.append([f"{v:.2f}" for v in values])
+                    elif kind == 'int':
+                        formatted.append([v or "" for v in values.tolist()])
+                    else:
+                        formatted.append(values.tolist())
+                for row in zip(*formatted):
+                    writer.writerow(row)
+                    rows += 1
+        return rows
+
+class LockedLogWriter:
+    """Serializes a writer shared by several monitors (fleet mode)"""
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.path = writer.path
+        self.lock = threading.Lock()
+
+    def write_row(self, row):
+        with self.lock:
+            self.writer.write_row(row)
+
+    def flush(self):
+        with self.lock:
+            self.writer.flush()
+
+    def close(self):
+        with self.lock:
+            self.writer.close()
+
+def is_columnar_log(path):
+    return os.path.isdir(path)
+
+def open_log_writer(path, log_format='csv', **options):
+    """Open a writer for 'csv' (path is a file) or 'columnar' (path is a directory)"""
+    if log_format == 'columnar':
+        return ColumnarLogWriter(path, **options)
+    return CsvLogWriter(path)
@@ -0,0 +1,385 @@
+"""
+Plan cache delta sampler for pVault
+sys.dm_exec_query_stats totals are cumulative over the life of each cached plan, so a plan cached
+last week mixes last week with the last hour. Each sample snapshots the top plans by CPU, elapsed
+time and reads and stores what changed since the previous sample, keyed by query_hash and
+plan_handle, in a local SQLite file; the previous snapshot is kept there too, so samples taken by
+different runs (the monitor, each diagnostic run) continue from each other
+
+Sampled every PLAN_CACHE_SECONDS by monitor_query_performance.py and on each run of
+diagnose_invoice_timeout.py; report from the local copy without connecting:
+    python plan_cache_sampler.py                          # top 10 per hour by CPU, last 24 hours
+    python plan_cache_sampler.py --by reads --hours 6 --top 5
+"""
+
+import argparse
+import os
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from tabulate import tabulate
+
+from query_store import _hex
+from sql_connection import STATE_DIR, open_state_db
+from sql_text_cache import SqlTextCache
+
+PLAN_CACHE_DB = os.path.join(STATE_DIR, "plan_cache.db")
+TOP_PLANS = 50         # plans fetched per ranking (CPU, elapsed, reads) each sample
+TRACKED_BATCH = 500    # plan handles per lookup of tracked plans that left the top (2100 parameter limit)
+RETENTION_DAYS = 14
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Report rankings: name -> deltas column
+RANKINGS = {"cpu": "worker_us", "elapsed": "elapsed_us", "reads": "logical_reads"}
+
+# One row per cached statement; SampledAt is the server clock, which creation_time and
+# last_execution_time are compared against
+PLAN_COLUMNS = """
+    qs.sql_handle,
+    qs.plan_handle,
+    qs.statement_start_offset,
+    qs.statement_end_offset,
+    qs.query_hash,
+    qs.query_plan_hash,
+    qs.plan_generation_num,
+    qs.creation_time,
+    qs.last_execution_time,
+    qs.execution_count,
+    qs.total_worker_time,
+    qs.total_elapsed_time,
+    qs.total_logical_reads,
+    SYSDATETIME() AS SampledAt"""
+
+TOP_PLANS_QUERY = f"""
+SELECT{PLAN_COLUMNS}
+FROM (
+    SELECT *,
+        ROW_NUMBER() OVER (ORDER BY total_worker_time DESC) AS cpu_rank,
+        ROW_NUMBER() OVER (ORDER BY total_elapsed_time DESC) AS elapsed_rank,
+        ROW_NUMBER() OVER (ORDER BY total_logical_reads DESC) AS reads_rank
+    FROM sys.dm_exec_query_stats
+) qs
+WHERE qs.cpu_rank <= ? OR qs.elapsed_rank <= ? OR qs.reads_rank <= ?
+"""
+
+# Plans from the previous snapshot that are no longer in the top: still cached, or evicted
+TRACKED_PLANS_QUERY = f"""
+SELECT{PLAN_COLUMNS}
+FROM sys.dm_exec_query_stats qs
+WHERE qs.plan_handle IN ({{}})
+"""
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshot (
+    server TEXT NOT NULL,
+    plan_handle TEXT NOT NULL,
+    statement_start INTEGER NOT NULL,
+    query_hash TEXT,
+    query_plan_hash TEXT,
+    plan_generation INTEGER,
+    creation_time TEXT NOT NULL,
+    executions INTEGER NOT NULL,
+    worker_us INTEGER NOT NULL,
+    elapsed_us INTEGER NOT NULL,
+    logical_reads INTEGER NOT NULL,
+    PRIMARY KEY (server, plan_handle, statement_start)
+);
+CREATE TABLE IF NOT EXISTS samples (
+    server TEXT NOT NULL,
+    sampled_at TEXT NOT NULL,
+    seconds REAL,
+    plans INTEGER NOT NULL,
+    new INTEGER NOT NULL,
+    recompiled INTEGER NOT NULL,
+    evicted INTEGER NOT NULL,
+    entered INTEGER NOT NULL,
+    PRIMARY KEY (server, sampled_at)
+);
+CREATE TABLE IF NOT EXISTS deltas (
+    server TEXT NOT NULL,
+    sampled_at TEXT NOT NULL,
+    query_hash TEXT,
+    plan_handle TEXT NOT NULL,
+    statement_start INTEGER NOT NULL,
+    query_plan_hash TEXT,
+    status TEXT NOT NULL,
+    executions INTEGER NOT NULL,
+    worker_us INTEGER NOT NULL,
+    elapsed_us INTEGER NOT NULL,
+    logical_reads INTEGER NOT NULL,
+    PRIMARY KEY (server, sampled_at, plan_handle, statement_start)
+);
+CREATE INDEX IF NOT EXISTS ix_deltas_query ON deltas (server, query_hash, sampled_at);
+CREATE TABLE IF NOT EXISTS queries (
+    server TEXT NOT NULL,
+    query_hash TEXT NOT NULL,
+    query_text TEXT,
+    PRIMARY KEY (server, query_hash)
+);
+"""
+
+# status: delta (same plan as last sample), new (cached since), recompiled (creation time or
+# plan generation changed, or the counters went backwards: the totals restarted)
+PlanDelta = namedtuple('PlanDelta', [
+    'query_hash', 'plan_handle', 'statement_start', 'query_plan_hash', 'status',
+    'executions', 'worker_us', 'elapsed_us', 'logical_reads', 'text'
+])
+
+class PlanSample:
+    """Deltas of one sample; seconds is None for the first sample of a server (baseline only)"""
+
+    def __init__(self, sampled_at, seconds, plans, deltas, new=0, recompiled=0, evicted=0, entered=0):
+        self.sampled_at = sampled_at
+        self.seconds = seconds
+        self.plans = plans
+        self.deltas = deltas
+        self.new = new
+        self.recompiled = recompiled
+        self.evicted = evicted
+        self.entered = entered
+
+    def top(self, by="cpu", n=10):
+        column = RANKINGS[by]
+        return sorted(self.deltas, key=lambda d: getattr(d, column), reverse=True)[:n]
+
+def _timestamp(value):
+    return value.strftime(TIMESTAMP_FORMAT) if value is not None else None
+
+class PlanCacheSampler:
+    """Per-interval plan cache deltas of one server; not thread-safe, sample from one thread"""
+
+    def __init__(self, server, path=PLAN_CACHE_DB, top=TOP_PLANS):
+        self.server = server.lower()
+        self.path = path
+        self.top_plans = top
+        self.text_cache = SqlTextCache(capacity=1024)
+        self.db = open_state_db(path, SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def last_sampled_at(self):
+        row = self.db.execute("SELECT MAX(sampled_at) AS sampled_at FROM samples WHERE server = ?",
+                              (self.server,)).fetchone()
+        return row["sampled_at"]
+
+    def _snapshot(self):
+        return {(row["plan_handle"], row["statement_start"]): row for row in self.db.execute(
+            "SELECT * FROM snapshot WHERE server = ?", (self.server,))}
+
+    def _fetch_tracked(self, conn, handles):
+        """Rows of the given plan handles that are still cached"""
+        rows = []
+        cursor = conn.cursor()
+        for i in range(0, len(handles), TRACKED_BATCH):
+            batch = handles[i:i + TRACKED_BATCH]
+            cursor.execute(TRACKED_PLANS_QUERY.format(", ".join("?" for _ in batch)),
+                           *[bytes.fromhex(h) for h in batch])
+            rows.extend(cursor.fetchall())
+        return rows
+
+    def sample(self, conn):
+        """Snapshot the top plans and store the change since the previous sample; returns a PlanSample"""
+        cursor = conn.cursor()
+        cursor.execute(TOP_PLANS_QUERY, self.top_plans, self.top_plans, self.top_plans)
+        current = {(_hex(r.plan_handle), r.statement_start_offset): r for r in cursor.fetchall()}
+        top_keys = set(current)
+
+        previous = self._snapshot()
+        last = self.last_sampled_at()
+        # Plans that left the top are looked up by handle so their last interval still counts
+        missing = [key for key in previous if key not in current]
+        if missing:
+            for r in self._fetch_tracked(conn, sorted({handle for handle, _ in missing})):
+                key = (_hex(r.plan_handle), r.statement_start_offset)
+                if key in previous:
+                    current[key] = r
+        evicted = sum(1 for key in missing if key not in current)
+
+        sampled_at = max((r.SampledAt for r in current.values()), default=None) or datetime.now()
+        last_time = datetime.strptime(last, TIMESTAMP_FORMAT) if last else None
+        seconds = (sampled_at - last_time).total_seconds() if last_time else None
+        counts = {"new": 0, "recompiled": 0, "entered": 0}
+        deltas = []
+        keep = []
+        for key, r in current.items():
+            totals = (r.execution_count, r.total_worker_time, r.total_elapsed_time, r.total_logical_reads)
+            prev = previous.get(key)
+            if prev is not None:
+                before = (prev["executions"], prev["worker_us"], prev["elapsed_us"], prev["logical_reads"])
+                restarted = (prev["creation_time"] != _timestamp(r.creation_time)
+                             or prev["plan_generation"] != r.plan_generation_num
+                             or any(now < then for now, then in zip(totals, before)))
+                status = "recompiled" if restarted else "delta"
+                change = totals if restarted else tuple(now - then for now, then in zip(totals, before))
+            elif last_time is None:
+                status, change = None, None  # first sample: baseline only
+            elif r.creation_time > last_time:
+                status, change = "new", totals
+            elif r.last_execution_time is not None and r.last_execution_time <= last_time:
+                status, change = None, None  # cached before and idle since
+            else:
+                # Ran in the interval but was outside the top last time: its share of the totals is unknown
+                counts["entered"] += 1
+                status, change = None, None
+            if status and status != "delta":
+                counts[status] += 1
+            if change is not None and change[0]:
+                deltas.append((key, r, status, change))
+            # Keep tracking plans in the top, and plans that left it while still running
+            if key in top_keys or (change is not None and change[0]):
+                keep.append((key, r))
+
+        texts = self._texts(conn, [r for _, r, _, _ in deltas])
+        sample = PlanSample(sampled_at, seconds, len(top_keys), [
+            PlanDelta(_hex(r.query_hash), key[0], key[1], _hex(r.query_plan_hash), status, *change,
+                      text=texts.get(_hex(r.query_hash), ""))
+            for key, r, status, change in deltas], evicted=evicted, **counts)
+        self._store(sample, keep)
+        return sample
+
+    def _texts(self, conn, rows):
+        """query_hash -> statement text, fetched once per query hash"""
+        hashes = {_hex(r.query_hash) for r in rows}
+        texts = {row["query_hash"]: row["query_text"] for row in self.db.execute(
+            f"SELECT query_hash, query_text FROM queries WHERE server = ? AND query_hash IN "
+            f"({', '.join('?' for _ in hashes)})", (self.server, *hashes))} if hashes else {}
+        new = {}
+        for r in rows:
+            if _hex(r.query_hash) not in texts:
+                new.setdefault(_hex(r.query_hash), (r.sql_handle, r.statement_start_offset, r.statement_end_offset))
+        if new:
+            resolved = self.text_cache.resolve(conn, list(new.values()))
+            for query_hash, key in new.items():
+                texts[query_hash] = resolved[key]
+            with self.db:
+                self.db.executemany("INSERT OR REPLACE INTO queries (server, query_hash, query_text) VALUES (?, ?, ?)",
+                                    [(self.server, query_hash, texts[query_hash]) for query_hash in new])
+        return texts
+
+    def _store(self, sample, keep):
+        sampled_at = _timestamp(sample.sampled_at)
+        with self.db:
+            self.db.execute("DELETE FROM snapshot WHERE server = ?", (self.server,))
+            self.db.executemany(
+                "INSERT INTO snapshot (server, plan_handle, statement_start, query_hash, query_plan_hash, "
+                "plan_generation, creation_time, executions, worker_us, elapsed_us, logical_reads) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(self.server, key[0], key[1], _hex(r.query_hash), _hex(r.query_plan_hash), r.plan_generation_num,
+                  _timestamp(r.creation_time), r.execution_count, r.total_worker_time, r.total_elapsed_time,
+                  r.total_logical_reads) for key, r in keep])
+            self.db.execute(
+                "INSERT OR REPLACE INTO samples (server, sampled_at, seconds, plans, new, recompiled, evicted, entered) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (self.server, sampled_at, sample.seconds, sample.plans, sample.new, sample.recompiled,
+                 sample.evicted, sample.entered))
+            self.db.executemany(
+                "INSERT OR REPLACE INTO deltas (server, sampled_at, query_hash, plan_handle, statement_start, "
+                "query_plan_hash, status, executions, worker_us, elapsed_us, logical_reads) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(self.server, sampled_at) + tuple(d[:-1]) for d in sample.deltas])
+            cutoff = _timestamp(datetime.now() - timedelta(days=RETENTION_DAYS))
+            self.db.execute("DELETE FROM deltas WHERE server = ? AND sampled_at < ?", (self.server, cutoff))
+            self.db.execute("DELETE FROM samples WHERE server = ? AND sampled_at < ?", (self.server, cutoff))
+
+    def hours(self, hours=24):
+        """Per-hour sample coverage and plan churn over the last hours, oldest first"""
+        since = _timestamp(datetime.now() - timedelta(hours=hours))
+        return self.db.execute("""
+            SELECT substr(sampled_at, 1, 13) AS hour, COUNT(*) AS samples, SUM(seconds) AS seconds,
+                SUM(new) AS new, SUM(recompiled) AS recompiled, SUM(evicted) AS evicted, SUM(entered) AS entered
+            FROM samples
+            WHERE server = ? AND sampled_at >= ?
+            GROUP BY hour
+            ORDER BY hour
+        """, (self.server, since)).fetchall()
+
+    def top_queries(self, hours=24, by="cpu", n=10):
+        """Top n query hashes per hour by delta CPU, elapsed time or reads; a sample counts in the hour it ended"""
+        since = _timestamp(datetime.now() - timedelta(hours=hours))
+        return self.db.execute(f"""
+            SELECT * FROM (
+                SELECT h.*, q.query_text,
+                    ROW_NUMBER() OVER (PARTITION BY h.hour ORDER BY h.{RANKINGS[by]} DESC) AS rank
+                FROM (
+                    SELECT substr(sampled_at, 1, 13) AS hour, query_hash,
+                        SUM(executions) AS executions, SUM(worker_us) AS worker_us,
+                        SUM(elapsed_us) AS elapsed_us, SUM(logical_reads) AS logical_reads,
+                        COUNT(DISTINCT query_plan_hash) AS plans,
+                        SUM(status = 'recompiled') AS recompiles
+                    FROM deltas
+                    WHERE server = ? AND sampled_at >= ?
+                    GROUP BY hour, query_hash
+                ) h
+                LEFT JOIN queries q ON q.server = ? AND q.query_hash = h.query_hash
+            )
+            WHERE rank <= ?
+            ORDER BY hour, rank
+        """, (self.server, since, self.server, n)).fetchall()
+
+    def print_report(self, hours=24, by="cpu", n=10):
+        """Top queries of each hour by one delta measure, with that hour's plan churn"""
+        coverage = {h["hour"]: h for h in self.hours(hours)}
+        top = self.top_queries(hours, by, n)
+        if not top:
+            print(f"No plan cache deltas in the last {hours} hours (local copy: {self.path}); "
+                  f"at least two samples are needed")
+            return
+        by_hour = {}
+        for row in top:
+            by_hour.setdefault(row["hour"], []).append(row)
+        for hour, rows in by_hour.items():
+            h = coverage.get(hour)
+            churn = (f"{h['samples']} samples covering {h['seconds'] or 0:.0f}s; plans: {h['new']} new, "
+                     f"{h['recompiled']} recompiled, {h['evicted']} evicted" if h else "")
+            print(f"\n[{hour}:00 top {len(rows)} by {by}] {churn}")
+            print(tabulate(
+                [[r["rank"], r["query_hash"], r["executions"], round(r["worker_us"] / 1e6, 1),
+                  round(r["elapsed_us"] / 1e6, 1), r["logical_reads"],
+                  round(r["elapsed_us"] / r["executions"] / 1e6, 3), r["plans"],
+                  ' '.join(str(r["query_text"] or '').split())[:60]] for r in rows],
+                headers=['#', 'Query Hash', 'Execs', 'CPU(s)', 'Elapsed(s)', 'Reads', 'Avg(s)', 'Plans', 'Query'],
+                tablefmt='grid'))
+        if any(h["evicted"] for h in coverage.values()):
+            print("ℹ Executions of evicted plans between their last sample and the eviction are not counted")
+        entered = sum(h["entered"] or 0 for h in coverage.values())
+        if entered:
+            print(f"ℹ {entered} plans entered the top with unknown prior activity; counted from their next sample")
+
+def print_sample(sample, by="elapsed", n=10, title="Plan cache since the previous sample"):
+    """One sample's top plans by a delta measure"""
+    if sample.seconds is None:
+        print(f"ℹ First plan cache sample of this server stored ({sample.plans} plans); "
+              f"deltas start with the next sample")
+        return
+    print(f"\n[{title}: {sample.seconds:.0f}s, top {n} by {by}]")
+    print(f"Plans: {sample.plans} in the top, {sample.new} new, {sample.recompiled} recompiled, "
+          f"{sample.evicted} evicted, {sample.entered} entered the top")
+    top = sample.top(by, n)
+    if not top:
+        print("✓ No executions of the top plans since the previous sample")
+        return
+    print(tabulate(
+        [[d.query_hash, d.plan_handle[:16], d.status, d.executions, round(d.worker_us / 1e6, 1), round(d.elapsed_us / 1e6, 1),
+          d.logical_reads, round(d.elapsed_us / d.executions / 1e6, 3), ' '.join(d.text.split())[:60]]
+         for d in top],
+        headers=['Query Hash', 'Plan Handle', 'Status', 'Execs', 'CPU(s)', 'Elapsed(s)', 'Reads', 'Avg(s)', 'Query'],
+        tablefmt='grid'))
+
+def main():
+    parser = argparse.ArgumentParser(description='Report collected plan cache deltas from the local copy')
+    parser.add_argument('--server', default='inscolpvault.insulationsinc.local', help='server the samples were taken from')
+    parser.add_argument('--hours', type=int, default=24, help='how far back to report (default: 24)')
+    parser.add_argument('--by', choices=sorted(RANKINGS), default='cpu', help='ranking measure (default: cpu)')
+    parser.add_argument('--top', type=int, default=10, help='queries per hour (default: 10)')
+    parser.add_argument('--db', default=PLAN_CACHE_DB, help='local copy file')
+    args = parser.parse_args()
+
+    sampler = PlanCacheSampler(args.server, args.db)
+    last = sampler.last_sampled_at()
+    print(f"Plan cache samples of {args.server}: " + (f"last taken {last}" if last else "none taken yet"))
+    sampler.print_report(args.hours, args.by, args.top)
+    sampler.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""
+Query fingerprinting for pVault monitoring
+Maps query text to a stable hash so samples group by statement instead of by session_id
+"""
+
+import hashlib
+import re
+from functools import lru_cache
+
+_COMMENTS = re.compile(r"--[^\r\n]*|/\*.*?\*/", re.DOTALL)
+_STRINGS = re.compile(r"N?'(?:[^']|'')*'")
+_HEX = re.compile(r"\b0x[0-9a-fA-F]*\b")
+_NUMBERS = re.compile(r"(?<![\w@#$])[-+]?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?\b")
+_IN_LISTS = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+_PUNCTUATION = re.compile(r" ?([=<>!,()+*/%;]) ?")
+
+FINGERPRINT_CACHE_SIZE = 8192
+
+def normalize(text):
+    """Strip comments and literals and collapse whitespace and IN lists"""
+    text = _COMMENTS.sub(" ", text)
+    text = _STRINGS.sub("?", text)
+    text = _HEX.sub("?", text)
+    text = _NUMBERS.sub("?", text)
+    text = _IN_LISTS.sub("(?)", text)
+    text = _WHITESPACE.sub(" ", text)
+    return _PUNCTUATION.sub(r"\1", text).strip().lower()
+
+@lru_cache(maxsize=FINGERPRINT_CACHE_SIZE)
+def text_fingerprint(text):
+    """Stable 16-hex-digit hash of the normalized text; cached because texts repeat every tick"""
+    if not text:
+        return ""
+    return hashlib.blake2b(normalize(text).encode("utf-8"), digest_size=8).hexdigest()
+
+def hash_hex(value):
+    """Hex form of a binary(8) query_hash/query_plan_hash, or "" when missing or all zeros"""
+    if not value or not any(value):
+        return ""
+    return value.hex()
+
+def fingerprint(text, query_hash=None):
+    """Fingerprint a statement, preferring the server's query_hash when present"""
+    server_hash = hash_hex(query_hash)
+    if server_hash:
+        return f"qh:{server_hash}"
+    text_hash = text_fingerprint(text)
+    return f"fp:{text_hash}" if text_hash else ""
@@ -0,0 +1,332 @@
+"""
+Query Store collector for the pVault invoice procedures
+Pulls sys.query_store_runtime_stats incrementally by runtime_stats_interval_id into a local
+SQLite copy keyed by query and plan, so executions of plans since evicted from the plan cache
+(e.g. the 3 a.m. timeouts) can still be reported the next morning
+
+Collected by diagnose_invoice_timeout.py; report from the local copy without connecting:
+    python query_store.py                                   # LoadInvoicesByStatusID, last 24 hours
+    python query_store.py --procedure ApproveInvoiceBatch --hours 72
+"""
+
+import argparse
+import os
+from datetime import datetime, timedelta
+
+from tabulate import tabulate
+
+from sql_connection import STATE_DIR, open_state_db
+
+QUERY_STORE_DB = os.path.join(STATE_DIR, "query_store.db")
+PROCEDURE = "LoadInvoicesByStatusID"
+OBJECT_PATTERNS = ["%Invoice%"]  # procedures whose statements are collected (OBJECT_NAME LIKE)
+INITIAL_DAYS = 7       # history pulled on the first collection for a database
+RETENTION_DAYS = 90    # local copy kept this long, beyond the server's Query Store retention
+TEXT_BATCH = 500       # query ids per text lookup (SQL Server allows 2100 parameters)
+TIMEOUT_SECONDS = 30   # application command timeout; slower executions are flagged
+PLAN_REGRESSION_RATIO = 3  # a statement's slowest plan this many times its fastest is flagged
+
+# execution_type: 0 regular, 3 aborted by the client (command timeout, attention), 4 exception
+ABORTED = 3
+EXCEPTION = 4
+
+OPTIONS_QUERY = """
+SELECT
+    actual_state_desc,
+    desired_state_desc,
+    readonly_reason,
+    current_storage_size_mb,
+    max_storage_size_mb,
+    interval_length_minutes
+FROM sys.database_query_store_options
+"""
+
+# Intervals from the bookmark on (the newest interval is still open, so it is fetched again),
+# interval times converted to server local time (pyodbc cannot read datetimeoffset)
+RUNTIME_STATS_QUERY = """
+SELECT
+    rs.runtime_stats_id,
+    rs.runtime_stats_interval_id,
+    CONVERT(datetime2(0), SWITCHOFFSET(rsi.start_time, DATEPART(TZOFFSET, SYSDATETIMEOFFSET()))) AS IntervalStart,
+    CONVERT(datetime2(0), SWITCHOFFSET(rsi.end_time, DATEPART(TZOFFSET, SYSDATETIMEOFFSET()))) AS IntervalEnd,
+    rs.plan_id,
+    p.query_id,
+    p.query_plan_hash,
+    p.is_forced_plan,
+    OBJECT_NAME(q.object_id) AS ObjectName,
+    rs.execution_type,
+    rs.count_executions,
+    rs.avg_duration,
+    rs.max_duration,
+    rs.avg_cpu_time,
+    rs.avg_logical_io_reads,
+    rs.avg_physical_io_reads
+FROM sys.query_store_runtime_stats rs
+JOIN sys.query_store_runtime_stats_interval rsi
+    ON rsi.runtime_stats_interval_id = rs.runtime_stats_interval_id
+JOIN sys.query_store_plan p ON p.plan_id = rs.plan_id
+JOIN sys.query_store_query q ON q.query_id = p.query_id
+WHERE rs.runtime_stats_interval_id >= ?
+    AND rsi.start_time >= DATEADD(day, -?, SYSDATETIMEOFFSET())
+    AND ({})
+ORDER BY rs.runtime_stats_interval_id
+"""
+
+QUERY_TEXT_QUERY = """
+SELECT q.query_id, q.query_hash, qt.query_sql_text
+FROM sys.query_store_query q
+JOIN sys.query_store_query_text qt ON qt.query_text_id = q.query_text_id
+WHERE q.query_id IN ({})
+"""
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS queries (
+    server TEXT NOT NULL,
+    database TEXT NOT NULL,
+    query_id INTEGER NOT NULL,
+    object_name TEXT,
+    query_hash TEXT,
+    query_text TEXT,
+    PRIMARY KEY (server, database, query_id)
+);
+CREATE TABLE IF NOT EXISTS plans (
+    server TEXT NOT NULL,
+    database TEXT NOT NULL,
+    plan_id INTEGER NOT NULL,
+    query_id INTEGER NOT NULL,
+    query_plan_hash TEXT,
+    is_forced INTEGER,
+    PRIMARY KEY (server, database, plan_id)
+);
+CREATE TABLE IF NOT EXISTS runtime_stats (
+    server TEXT NOT NULL,
+    database TEXT NOT NULL,
+    runtime_stats_id INTEGER NOT NULL,
+    query_id INTEGER NOT NULL,
+    plan_id INTEGER NOT NULL,
+    interval_id INTEGER NOT NULL,
+    interval_start TEXT NOT NULL,
+    interval_end TEXT NOT NULL,
+    execution_type INTEGER NOT NULL,
+    executions INTEGER NOT NULL,
+    avg_duration_us REAL,
+    max_duration_us REAL,
+    avg_cpu_us REAL,
+    avg_logical_reads REAL,
+    avg_physical_reads REAL,
+    PRIMARY KEY (server, database, runtime_stats_id)
+);
+CREATE INDEX IF NOT EXISTS ix_runtime_query_plan ON runtime_stats (server, database, query_id, plan_id, interval_id);
+CREATE INDEX IF NOT EXISTS ix_runtime_interval ON runtime_stats (server, database, interval_start);
+CREATE TABLE IF NOT EXISTS bookmarks (
+    server TEXT NOT NULL,
+    database TEXT NOT NULL,
+    interval_id INTEGER NOT NULL,
+    collected_at TEXT NOT NULL,
+    PRIMARY KEY (server, database)
+);
+"""
+
+class QueryStoreUnavailable(Exception):
+    """Query Store is off, in error, or cannot be read on this server"""
+
+def _hex(value):
+    return value.hex() if isinstance(value, (bytes, bytearray)) else (str(value) if value is not None else None)
+
+class QueryStoreCollector:
+    """Local copy of one database's Query Store runtime stats for the matching procedures"""
+
+    def __init__(self, server, database, path=QUERY_STORE_DB, patterns=OBJECT_PATTERNS):
+        self.server = server.lower()
+        self.database = database.lower()
+        self.patterns = list(patterns)
+        self.path = path
+        self.db = open_state_db(path, SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def options(self, conn):
+        """Query Store options row; raises QueryStoreUnavailable when it cannot be used"""
+        cursor = conn.cursor()
+        try:
+            cursor.execute(OPTIONS_QUERY)
+            options = cursor.fetchone()
+        except Exception as e:
+            # SQL Server 2014 and older, or no VIEW DATABASE STATE permission
+            raise QueryStoreUnavailable(f"cannot read Query Store options: {str(e)[:120]}")
+        if options is None or options.actual_state_desc in ("OFF", "ERROR"):
+            state = options.actual_state_desc if options else "OFF"
+            raise QueryStoreUnavailable(f"Query Store is {state} for this database")
+        return options
+
+    def bookmark(self):
+        row = self.db.execute("SELECT interval_id FROM bookmarks WHERE server = ? AND database = ?",
+                              (self.server, self.database)).fetchone()
+        return row["interval_id"] if row else None
+
+    def collect(self, conn):
+        """Fetch runtime stats since the bookmark into the local copy; returns (rows, new queries)"""
+        options = self.options(conn)
+        since = self.bookmark() or 0
+        where = " OR ".join("OBJECT_NAME(q.object_id) LIKE ?" for _ in self.patterns)
+        cursor = conn.cursor()
+        cursor.execute(RUNTIME_STATS_QUERY.format(where), since, INITIAL_DAYS, *self.patterns)
+        rows = cursor.fetchall()
+
+        known = {row["query_id"] for row in self.db.execute(
+            "SELECT query_id FROM queries WHERE server = ? AND database = ?", (self.server, self.database))}
+        new_queries = {}
+        for r in rows:
+            if r.query_id not in known:
+                new_queries[r.query_id] = r.ObjectName
+        texts = self._query_texts(conn, list(new_queries))
+
+        key = (self.server, self.database)
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO queries (server, database, query_id, object_name, query_hash, query_text) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [key + (query_id, name) + texts.get(query_id, (None, None)) for query_id, name in new_queries.items()])
+            self.db.executemany(
+                "INSERT OR REPLACE INTO plans (server, database, plan_id, query_id, query_plan_hash, is_forced) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                {key + (r.plan_id, r.query_id, _hex(r.query_plan_hash), int(bool(r.is_forced_plan))) for r in rows})
+            # The open interval keeps changing; its rows are replaced by runtime_stats_id
+            self.db.executemany(
+                "INSERT OR REPLACE INTO runtime_stats (server, database, runtime_stats_id, query_id, plan_id, "
+                "interval_id, interval_start, interval_end, execution_type, executions, avg_duration_us, "
+                "max_duration_us, avg_cpu_us, avg_logical_reads, avg_physical_reads) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [key + (r.runtime_stats_id, r.query_id, r.plan_id, r.runtime_stats_interval_id,
+                        r.IntervalStart.isoformat(sep=" "), r.IntervalEnd.isoformat(sep=" "), r.execution_type,
+                        r.count_executions, r.avg_duration, r.max_duration, r.avg_cpu_time,
+                        r.avg_logical_io_reads, r.avg_physical_io_reads) for r in rows])
+            if rows:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO bookmarks (server, database, interval_id, collected_at) VALUES (?, ?, ?, ?)",
+                    key + (max(max(r.runtime_stats_interval_id for r in rows), since),
+                           datetime.now().isoformat(timespec="seconds")))
+            cutoff = (datetime.now() - timedelta(days=RETENTION_DAYS)).isoformat(sep=" ")
+            self.db.execute("DELETE FROM runtime_stats WHERE server = ? AND database = ? AND interval_start < ?",
+                            key + (cutoff,))
+        print(f"✓ Query Store ({options.actual_state_desc}, {options.interval_length_minutes} min intervals): "
+              f"{len(rows)} runtime stats rows from interval {since or 'start'}, {len(new_queries)} new queries")
+        return len(rows), len(new_queries)
+
+    def _query_texts(self, conn, query_ids):
+        """query_id -> (query_hash hex, text) for queries not in the local copy yet"""
+        texts = {}
+        cursor = conn.cursor()
+        for i in range(0, len(query_ids), TEXT_BATCH):
+            batch = query_ids[i:i + TEXT_BATCH]
+            cursor.execute(QUERY_TEXT_QUERY.format(", ".join("?" for _ in batch)), *batch)
+            for row in cursor.fetchall():
+                texts[row.query_id] = (_hex(row.query_hash), row.query_sql_text)
+        return texts
+
+    def intervals(self, procedure=PROCEDURE, hours=24):
+        """Per-interval totals of one procedure's statements over the last hours, oldest first"""
+        since = (datetime.now() - timedelta(hours=hours)).isoformat(sep=" ")
+        return self.db.execute("""
+            SELECT r.interval_start, r.interval_end,
+                SUM(r.executions) AS executions,
+                SUM(CASE WHEN r.execution_type = ? THEN r.executions ELSE 0 END) AS aborted,
+                SUM(CASE WHEN r.execution_type = ? THEN r.executions ELSE 0 END) AS failed,
+                SUM(r.avg_duration_us * r.executions) / SUM(r.executions) / 1e6 AS avg_sec,
+                MAX(r.max_duration_us) / 1e6 AS max_sec,
+                SUM(r.avg_cpu_us * r.executions) / 1e6 AS cpu_sec,
+                SUM(r.avg_logical_reads * r.executions) / SUM(r.executions) AS avg_reads,
+                COUNT(DISTINCT r.plan_id) AS plans
+            FROM runtime_stats r
+            JOIN queries q ON q.server = r.server AND q.database = r.database AND q.query_id = r.query_id
+            WHERE r.server = ? AND r.database = ? AND q.object_name = ? AND r.interval_start >= ?
+            GROUP BY r.interval_id
+            ORDER BY r.interval_start
+        """, (ABORTED, EXCEPTION, self.server, self.database, procedure, since)).fetchall()
+
+    def plans(self, procedure=PROCEDURE, hours=24):
+        """Per statement and plan totals of one procedure over the last hours, slowest first"""
+        since = (datetime.now() - timedelta(hours=hours)).isoformat(sep=" ")
+        return self.db.execute("""
+            SELECT q.query_id, r.plan_id, p.query_plan_hash, p.is_forced, q.query_text,
+                SUM(r.executions) AS executions,
+                SUM(CASE WHEN r.execution_type = ? THEN r.executions ELSE 0 END) AS aborted,
+                SUM(r.avg_duration_us * r.executions) / SUM(r.executions) / 1e6 AS avg_sec,
+                MAX(r.max_duration_us) / 1e6 AS max_sec,
+                SUM(r.avg_logical_reads * r.executions) / SUM(r.executions) AS avg_reads,
+                MIN(r.interval_start) AS first_seen, MAX(r.interval_end) AS last_seen
+            FROM runtime_stats r
+            JOIN queries q ON q.server = r.server AND q.database = r.database AND q.query_id = r.query_id
+            LEFT JOIN plans p ON p.server = r.server AND p.database = r.database AND p.plan_id = r.plan_id
+            WHERE r.server = ? AND r.database = ? AND q.object_name = ? AND r.interval_start >= ?
+            GROUP BY q.query_id, r.plan_id
+            ORDER BY avg_sec DESC
+        """, (ABORTED, self.server, self.database, procedure, since)).fetchall()
+
+    def print_report(self, procedure=PROCEDURE, hours=24):
+        """Per-interval duration, CPU and reads of a procedure, then its statements by plan"""
+        intervals = self.intervals(procedure, hours)
+        if not intervals:
+            print(f"No Query Store data for {procedure} in the last {hours} hours (local copy: {self.path})")
+            return
+
+        print(f"\n[{procedure} per Query Store interval, last {hours} hours]")
+        rows = []
+        for i in intervals:
+            flag = ""
+            if i["aborted"]:
+                flag = "⚠ TIMEOUTS"
+            elif i["max_sec"] > TIMEOUT_SECONDS:
+                flag = "⚠ TIMEOUT RISK"
+            rows.append([i["interval_start"][5:16], i["executions"], i["aborted"], i["failed"],
+                         round(i["avg_sec"], 2), round(i["max_sec"], 2), round(i["cpu_sec"], 1),
+                         int(i["avg_reads"]), i["plans"], flag])
+        print(tabulate(rows, headers=['Interval', 'Execs', 'Aborted', 'Errors', 'Avg(s)', 'Max(s)',
+                                      'CPU(s)', 'Avg Reads', 'Plans', ''], tablefmt='grid'))
+
+        aborted = sum(i["aborted"] for i in intervals)
+        if aborted:
+            worst = max(intervals, key=lambda i: i["aborted"])
+            print(f"⚠ {aborted:,} executions aborted by the client (command timeout) in {hours}h, "
+                  f"most in the interval starting {worst['interval_start'][:16]} ({worst['aborted']:,})")
+
+        print(f"\n[{procedure} statements by plan]")
+        plans = self.plans(procedure, hours)
+        for p in plans:
+            forced = " (forced)" if p["is_forced"] else ""
+            print(f"Query {p['query_id']} plan {p['plan_id']}{forced}: {p['executions']:,} execs, "
+                  f"avg {p['avg_sec']:.2f}s, max {p['max_sec']:.2f}s, {int(p['avg_reads']):,} reads, "
+                  f"{p['aborted']:,} aborted, seen {p['first_seen'][5:16]} - {p['last_seen'][5:16]}")
+            print(f"  {str(p['query_text'] or '')[:150]}")
+
+        # A statement whose plans differ this much in duration is a plan regression
+        by_query = {}
+        for p in plans:
+            by_query.setdefault(p["query_id"], []).append(p)
+        for query_id, query_plans in by_query.items():
+            slow, fast = query_plans[0], query_plans[-1]
+            if len(query_plans) > 1 and slow["avg_sec"] > PLAN_REGRESSION_RATIO * fast["avg_sec"]:
+                print(f"⚠ PLAN REGRESSION: query {query_id} plan {slow['plan_id']} averages {slow['avg_sec']:.1f}s "
+                      f"vs {fast['avg_sec']:.1f}s for plan {fast['plan_id']}")
+                print(f"  To pin the fast plan: EXEC sp_query_store_force_plan @query_id = {query_id}, "
+                      f"@plan_id = {fast['plan_id']};")
+
+def main():
+    parser = argparse.ArgumentParser(description='Report collected Query Store stats from the local copy')
+    parser.add_argument('--server', default='inscolpvault.insulationsinc.local', help='server the stats were collected from')
+    parser.add_argument('--database', default='PaperlessEnvironments', help='database the stats were collected from')
+    parser.add_argument('--procedure', default=PROCEDURE, help=f'procedure to report (default: {PROCEDURE})')
+    parser.add_argument('--hours', type=int, default=24, help='how far back to report (default: 24)')
+    parser.add_argument('--db', default=QUERY_STORE_DB, help='local copy file')
+    args = parser.parse_args()
+
+    collector = QueryStoreCollector(args.server, args.database, args.db)
+    bookmark = collector.bookmark()
+    print(f"Query Store copy of {args.server}/{args.database}: "
+          + (f"collected up to interval {bookmark}" if bookmark else "nothing collected yet"))
+    collector.print_report(args.procedure, args.hours)
+    collector.close()
+
+if __name__ == "__main__":
+    main()
@@ -3,95 +3,35 @@ Quick SQL Server Health Check (No pandas required)
 Works with existing pyodbc installation
 """
 
-import pyodbc
+try:
+    import pyodbc
+except ImportError:  # not needed with PVAULT_STANDIN (dmv_standin.py)
+    pyodbc = None
 import sys
 from datetime import datetime
+from sql_connection import ConnectionFactory, ConnectionFailed
+from dmv_snapshot import SnapshotQuery, collect_snapshot
+from baseline_store import save_run
 
 # Connection parameters - UPDATE THESE
 SERVER = "inscolpvault.insulationsinc.local"
 PORT = 55859  # SQL Server port
 DATABASE = "PaperlessEnvironments"
 USERNAME = "sa"
-PASSWORD = input("Enter SQL password for sa: ")  # Prompts for password
+PASSWORD = None  # prompted for when run as a script
 
 def connect_to_sql():
     """Establish SQL Server connection"""
-    # Try multiple connection strategies
-    connection_configs = [
-        # Strategy 1: ODBC Driver 18 with explicit port and encryption (primary)
-        {
-            "driver": "ODBC Driver 18 for SQL Server",
-            "server": f"{SERVER},{PORT}",
-            "encrypt": "yes",
-            "trust_cert": "yes"
-        },
-        # Strategy 2: ODBC Driver 18 with explicit port without encryption
-        {
-            "driver": "ODBC Driver 18 for SQL Server",
-            "server": f"{SERVER},{PORT}",
-            "encrypt": "no"
-        },
-        # Strategy 3: ODBC Driver 18 without port (let it try default discovery)
-        {
-            "driver": "ODBC Driver 18 for SQL Server",
-            "server": SERVER,
-            "encrypt": "yes",
-            "trust_cert": "yes"
-        },
-        # Strategy 4: ODBC Driver 17 with explicit port
-        {
-            "driver": "ODBC Driver 17 for SQL Server",
-            "server": f"{SERVER},{PORT}",
-            "encrypt": "yes",
-            "trust_cert": "yes"
-        },
-        # Strategy 5: SQL Server Native Client 11.0 with explicit port
-        {
-            "driver": "SQL Server Native Client 11.0",
-            "server": f"{SERVER},{PORT}"
-        },
-        # Strategy 6: Legacy SQL Server driver with explicit port
-        {
-            "driver": "SQL Server",
-            "server": f"{SERVER},{PORT}"
-        }
-    ]
-
     print(f"\nConnecting to {SERVER}...")
-    
-    for i, config in enumerate(connection_configs, 1):
-        try:
-            # Build connection string
-            conn_parts = [
-                f"DRIVER={{{config['driver']}}};",
-                f"SERVER={config['server']};",
-                f"DATABASE={DATABASE};",
-                f"UID={USERNAME};",
-                f"PWD={PASSWORD};"
-            ]
-            
-            if "encrypt" in config:
-                conn_parts.append(f"Encrypt={config['encrypt']};")
-            if "trust_cert" in config:
-                conn_parts.append(f"TrustServerCertificate=yes;")
-            
-            connection_string = "".join(conn_parts)
-            
-            if i > 1:
-                print(f"Trying strategy {i} ({config['driver']})...")
-            
-            conn = pyodbc.connect(connection_string, timeout=15)
-            print(f"✓ Connected successfully with {config['driver']}!\n")
-            return conn
-            
-        except pyodbc.Error as e:
-            if i == 1:
-                print(f"✗ Initial connection failed: {str(e)[:200]}")
-            continue
-        except Exception as e:
-            if i == 1:
-                print(f"✗ Connection error: {str(e)[:200]}")
-            continue
+
+    factory = ConnectionFactory(SERVER, PORT, DATABASE, USERNAME, PASSWORD, timeout=15)
+    try:
+        conn = factory.connect()
+        print(f"✓ Connected successfully with {factory.strategy['name']}!\n")
+        return conn
+    except ConnectionFailed as e:
+        for name, error in e.errors.items():
+            print(f"✗ {name}: {str(error)[:200]}")
 
     # All connection attempts failed
     print("\n" + "="*60)
@@ -129,9 +69,74 @@ def connect_to_sql():
     
     sys.exit(1)
 
-def run_quick_checks(conn):
+# Everything the quick check reports, fetched in one round trip (see dmv_snapshot.py)
+QUICK_CHECK_QUERIES = [
+    SnapshotQuery('server', """
+        SELECT
+            @@SERVERNAME AS ServerName,
+            SERVERPROPERTY('Edition') AS Edition,
+            SERVERPROPERTY('ProductVersion') AS Version
+    """),
+    SnapshotQuery('databases', """
+        SELECT name, state_desc FROM sys.databases WHERE database_id > 4
+    """),
+    SnapshotQuery('connections', """
+        SELECT COUNT(*) as ActiveConnections,
+               COUNT(DISTINCT session_id) as UniqueSessions
+        FROM sys.dm_exec_connections WHERE session_id > 50
+    """),
+    # Blocked and long-running requests; both checks and the summary read from this
+    SnapshotQuery('requests', """
+        SELECT
+            session_id,
+            blocking_session_id,
+            wait_time/1000 as WaitSec,
+            wait_type,
+            command,
+            status,
+            total_elapsed_time,
+            total_elapsed_time/1000 as ElapsedSec
+        FROM sys.dm_exec_requests
+        WHERE blocking_session_id > 0
+            OR (total_elapsed_time > 30000 AND session_id > 50)
+    """),
+    SnapshotQuery('cpu', """
+        SELECT TOP 1 SQLProcessUtilization as SQL_CPU
+        FROM (
+            SELECT record.value('(./Record/SchedulerMonitorEvent/SystemHealth/ProcessUtilization)[1]', 'int') AS SQLProcessUtilization
+            FROM (
+                SELECT convert(xml, record) AS record
+                FROM sys.dm_os_ring_buffers
+                WHERE ring_buffer_type = N'RING_BUFFER_SCHEDULER_MONITOR'
+                AND record LIKE '%<SystemHealth>%'
+            ) AS x
+        ) AS y
+        ORDER BY SQLProcessUtilization DESC
+    """),
+    SnapshotQuery('memory', """
+        SELECT
+            (physical_memory_in_use_kb/1024) AS MemoryMB,
+            process_physical_memory_low as LowMemory
+        FROM sys.dm_os_process_memory
+    """),
+    SnapshotQuery('waits', """
+        SELECT TOP 3
+            wait_type,
+            wait_time_ms/1000 as WaitSec,
+            waiting_tasks_count as Count
+        FROM sys.dm_os_wait_stats
+        WHERE wait_type NOT IN (
+            'SLEEP_TASK', 'BROKER_TASK_STOP', 'WAITFOR',
+            'LAZYWRITER_SLEEP', 'CHECKPOINT_QUEUE'
+        )
+        AND wait_time_ms > 0
+        ORDER BY wait_time_ms DESC
+    """),
+]
+
+def run_quick_checks(conn, save_baseline=True):
     """Run essential health checks"""
-    cursor = conn.cursor()
+    snapshot = collect_snapshot(conn, QUICK_CHECK_QUERIES)
 
     print("="*60)
     print("SQL SERVER QUICK HEALTH CHECK")
@@ -140,100 +145,53 @@ def run_quick_checks(conn):
 
     # 1. Server Info
     print("[SERVER INFO]")
-    cursor.execute("""
-        SELECT
-            @@SERVERNAME AS ServerName,
-            SERVERPROPERTY('Edition') AS Edition,
-            SERVERPROPERTY('ProductVersion') AS Version
-    """)
-    result = cursor.fetchone()
+    result = snapshot['server'][0]
     print(f"Server: {result.ServerName}")
     print(f"Edition: {result.Edition}")
     print(f"Version: {result.Version}\n")
 
     # 2. Database Status
     print("[DATABASE STATUS]")
-    cursor.execute("""
-        SELECT COUNT(*) as TotalDBs,
-               SUM(CASE WHEN state_desc = 'ONLINE' THEN 1 ELSE 0 END) as OnlineDBs,
-               SUM(CASE WHEN state_desc != 'ONLINE' THEN 1 ELSE 0 END) as OfflineDBs
-        FROM sys.databases WHERE database_id > 4
-    """)
-    result = cursor.fetchone()
-    print(f"Total User Databases: {result.TotalDBs}")
-    print(f"Online: {result.OnlineDBs}")
-    if result.OfflineDBs > 0:
-        print(f"⚠ OFFLINE: {result.OfflineDBs}\n")
+    databases = snapshot['databases']
+    offline = [db for db in databases if db.state_desc != 'ONLINE']
+    print(f"Total User Databases: {len(databases)}")
+    print(f"Online: {len(databases) - len(offline)}")
+    if offline:
+        print(f"⚠ OFFLINE: {len(offline)}\n")
 
         # Show offline databases
-        cursor.execute("""
-            SELECT name, state_desc FROM sys.databases
-            WHERE database_id > 4 AND state_desc != 'ONLINE'
-        """)
-        for db in cursor.fetchall():
+        for db in offline:
             print(f"  - {db.name}: {db.state_desc}")
     print()
 
     # 3. Performance - Current Activity
     print("[CURRENT ACTIVITY]")
-    cursor.execute("""
-        SELECT COUNT(*) as ActiveConnections,
-               COUNT(DISTINCT session_id) as UniqueSessions
-        FROM sys.dm_exec_connections WHERE session_id > 50
-    """)
-    result = cursor.fetchone()
+    result = snapshot['connections'][0]
     print(f"Active Connections: {result.ActiveConnections}")
     print(f"Unique Sessions: {result.UniqueSessions}\n")
 
     # 4. Blocking Check
     print("[BLOCKING CHECK]")
-    cursor.execute("""
-        SELECT COUNT(*) as BlockedSessions
-        FROM sys.dm_exec_requests
-        WHERE blocking_session_id > 0
-    """)
-    result = cursor.fetchone()
-    if result.BlockedSessions > 0:
-        print(f"⚠ BLOCKING DETECTED: {result.BlockedSessions} blocked sessions!")
+    blocked = [r for r in snapshot['requests'] if r.blocking_session_id > 0]
+    if blocked:
+        print(f"⚠ BLOCKING DETECTED: {len(blocked)} blocked sessions!")
 
         # Show blocking details
-        cursor.execute("""
-            SELECT
-                blocking_session_id as Blocker,
-                session_id as Blocked,
-                wait_time/1000 as WaitSec,
-                wait_type
-            FROM sys.dm_exec_requests
-            WHERE blocking_session_id > 0
-        """)
-        for block in cursor.fetchall():
-            print(f"  Session {block.Blocker} blocking {block.Blocked} ({block.WaitSec}s)")
+        for block in blocked:
+            print(f"  Session {block.blocking_session_id} blocking {block.session_id} ({block.WaitSec}s)")
     else:
         print("✓ No blocking detected\n")
 
     # 5. Long Running Queries
     print("[LONG RUNNING QUERIES]")
-    cursor.execute("""
-        SELECT COUNT(*) as LongQueries
-        FROM sys.dm_exec_requests
-        WHERE total_elapsed_time > 30000 AND session_id > 50
-    """)
-    result = cursor.fetchone()
-    if result.LongQueries > 0:
-        print(f"⚠ {result.LongQueries} queries running >30 seconds")
+    long_running = sorted((r for r in snapshot['requests']
+                           if r.session_id > 50 and r.total_elapsed_time > 30000),
+                          key=lambda r: r.total_elapsed_time, reverse=True)
+    if long_running:
+        print(f"⚠ {len(long_running)} queries running >30 seconds")
 
         # Show top 3
-        cursor.execute("""
-            SELECT TOP 3
-                session_id,
-                command,
-                total_elapsed_time/1000 as ElapsedSec,
-                status
-            FROM sys.dm_exec_requests
-            WHERE total_elapsed_time > 30000 AND session_id > 50
-            ORDER BY total_elapsed_time DESC
-        """)
-        for query in cursor.fetchall():
+        for query in long_running[:3]:
             print(f"  Session {query.session_id}: {query.command} ({query.ElapsedSec}s)")
     else:
         print("✓ No long-running queries\n")
@@ -242,33 +200,14 @@ def run_quick_checks(conn):
     print("[RESOURCE USAGE]")
 
     # CPU
-    cursor.execute("""
-        SELECT TOP 1 SQLProcessUtilization as SQL_CPU
-        FROM (
-            SELECT record.value('(./Record/SchedulerMonitorEvent/SystemHealth/ProcessUtilization)[1]', 'int') AS SQLProcessUtilization
-            FROM (
-                SELECT convert(xml, record) AS record
-                FROM sys.dm_os_ring_buffers
-                WHERE ring_buffer_type = N'RING_BUFFER_SCHEDULER_MONITOR'
-                AND record LIKE '%<SystemHealth>%'
-            ) AS x
-        ) AS y
-        ORDER BY SQLProcessUtilization DESC
-    """)
-    result = cursor.fetchone()
-    if result:
+    if snapshot['cpu']:
+        result = snapshot['cpu'][0]
         print(f"SQL CPU Usage: {result.SQL_CPU}%")
         if result.SQL_CPU > 80:
             print("  ⚠ High CPU usage!")
 
     # Memory
-    cursor.execute("""
-        SELECT
-            (physical_memory_in_use_kb/1024) AS MemoryMB,
-            process_physical_memory_low as LowMemory
-        FROM sys.dm_os_process_memory
-    """)
-    result = cursor.fetchone()
+    result = snapshot['memory'][0]
     print(f"Memory Used: {result.MemoryMB:,.0f} MB")
     if result.LowMemory:
         print("  ⚠ Low memory condition!\n")
@@ -277,25 +216,13 @@ def run_quick_checks(conn):
 
     # 7. Top Wait Types
     print("[TOP WAIT TYPES]")
-    cursor.execute("""
-        SELECT TOP 3
-            wait_type,
-            wait_time_ms/1000 as WaitSec,
-            waiting_tasks_count as Count
-        FROM sys.dm_os_wait_stats
-        WHERE wait_type NOT IN (
-            'SLEEP_TASK', 'BROKER_TASK_STOP', 'WAITFOR',
-            'LAZYWRITER_SLEEP', 'CHECKPOINT_QUEUE'
-        )
-        AND wait_time_ms > 0
-        ORDER BY wait_time_ms DESC
-    """)
-    for wait in cursor.fetchall():
+    for wait in snapshot['waits']:
         print(f"  {wait.wait_type}: {wait.WaitSec:,.0f}s ({wait.Count:,} waits)")
 
-    # 8. Error Log Check
+    # 8. Error Log Check (separate call: it needs sysadmin and must not fail the snapshot)
     print("\n[RECENT ERRORS]")
     try:
+        cursor = conn.cursor()
         cursor.execute("EXEC sp_readerrorlog 0, 1, 'Error'")
         errors = cursor.fetchmany(5)
         if errors:
@@ -312,18 +239,15 @@ def run_quick_checks(conn):
     print("SUMMARY")
     print("="*60)
 
-    # Collect all issues
+    # Collect all issues from the same snapshot, so the summary matches the sections above
     issues = []
-    cursor.execute("SELECT COUNT(*) as c FROM sys.databases WHERE database_id > 4 AND state_desc != 'ONLINE'")
-    if cursor.fetchone().c > 0:
+    if offline:
         issues.append("Offline databases")
 
-    cursor.execute("SELECT COUNT(*) as c FROM sys.dm_exec_requests WHERE blocking_session_id > 0")
-    if cursor.fetchone().c > 0:
+    if blocked:
         issues.append("Blocking sessions")
 
-    cursor.execute("SELECT COUNT(*) as c FROM sys.dm_exec_requests WHERE total_elapsed_time > 30000 AND session_id > 50")
-    if cursor.fetchone().c > 0:
+    if long_running:
         issues.append("Long-running queries")
 
     if issues:
@@ -335,10 +259,23 @@ def run_quick_checks(conn):
         print("✓ No critical issues detected")
         print("  System appears to be running normally")
 
+    # Keep the run for hour-of-week comparisons (python baseline_store.py)
+    if save_baseline:
+        save_run(SERVER, DATABASE, 'quick_check', {
+            'offline_databases': len(offline),
+            'active_connections': snapshot['connections'][0].ActiveConnections,
+            'blocked_sessions': len(blocked),
+            'long_running_queries': len(long_running),
+            'sql_cpu_pct': snapshot['cpu'][0].SQL_CPU if snapshot['cpu'] else None,
+            'memory_used_mb': snapshot['memory'][0].MemoryMB,
+            'memory_low': 1 if snapshot['memory'][0].LowMemory else 0,
+        })
+
     conn.close()
     print("\nHealth check completed successfully!")
 
 if __name__ == "__main__":
+    PASSWORD = input("Enter SQL password for sa: ")  # Prompts for password
     try:
         conn = connect_to_sql()
         run_quick_checks(conn)
@@ -0,0 +1,294 @@
+"""
+Shared SQL Server connection factory for the pVault scripts
+Races the driver/encryption strategies concurrently and remembers the winner per server.
+Encrypted strategies race first; unencrypted ones are only tried once all of those failed,
+and a connection made without encryption is flagged (in the cache and on the console)
+"""
+
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+try:
+    import pyodbc
+except ImportError:  # only the stand-in (dmv_standin.py) works without it
+    pyodbc = None
+
+# Local state (connection cache and other per-machine data) lives here
+STATE_DIR = os.environ.get("PVAULT_STATE_DIR",
+                           os.path.join(os.path.expanduser("~"), ".pvault_sql"))
+CACHE_FILE = os.path.join(STATE_DIR, "connection_cache.json")
+# Record every statement and result set of every connection to this file (dmv_recorder.py)
+RECORD_FILE = os.environ.get("PVAULT_RECORD")
+# Connect to a stand-in instead of SQL Server: "synthetic[:key=value,...]", a .json file or a recording
+# (dmv_standin.py)
+STANDIN = os.environ.get("PVAULT_STANDIN")
+STANDIN_STRATEGY = {
+    "name": "pVault stand-in (no SQL Server)",
+    "driver": "pVault stand-in",
+    "use_port": False,
+    "extra": "",
+    "encrypted": True
+}
+
+# Connection strategies in order of preference; "encrypted": False ones are a last resort
+CONNECTION_STRATEGIES = [
+    # ODBC Driver 18 with explicit port and encryption (primary)
+    {
+        "name": "ODBC Driver 18 (encrypted)",
+        "driver": "ODBC Driver 18 for SQL Server",
+        "use_port": True,
+        "extra": "Encrypt=yes;TrustServerCertificate=yes;",
+        "encrypted": True
+    },
+    # ODBC Driver 18 with explicit port without encryption
+    {
+        "name": "ODBC Driver 18 (unencrypted)",
+        "driver": "ODBC Driver 18 for SQL Server",
+        "use_port": True,
+        "extra": "Encrypt=no;",
+        "encrypted": False
+    },
+    # ODBC Driver 18 without port (let it try default discovery)
+    {
+        "name": "ODBC Driver 18 (no port)",
+        "driver": "ODBC Driver 18 for SQL Server",
+        "use_port": False,
+        "extra": "Encrypt=yes;TrustServerCertificate=yes;",
+        "encrypted": True
+    },
+    # ODBC Driver 17 with explicit port
+    {
+        "name": "ODBC Driver 17",
+        "driver": "ODBC Driver 17 for SQL Server",
+        "use_port": True,
+        "extra": "Encrypt=yes;TrustServerCertificate=yes;",
+        "encrypted": True
+    },
+    # SQL Server Native Client 11.0 with explicit port (no encryption unless the server forces it)
+    {
+        "name": "SQL Server Native Client 11.0",
+        "driver": "SQL Server Native Client 11.0",
+        "use_port": True,
+        "extra": "",
+        "encrypted": False
+    },
+    # Legacy SQL Server driver with explicit port
+    {
+        "name": "SQL Server",
+        "driver": "SQL Server",
+        "use_port": True,
+        "extra": "",
+        "encrypted": False
+    }
+]
+
+_cache_lock = threading.Lock()
+_recorder = None
+_recorder_lock = threading.Lock()
+
+class ConnectionFailed(Exception):
+    """Raised when no connection strategy succeeds"""
+
+    def __init__(self, server, errors):
+        self.server = server
+        self.errors = errors  # strategy name -> exception
+        super().__init__(f"All connection strategies failed for {server}")
+
+def load_cache(cache_file=CACHE_FILE):
+    """Read the strategy cache, returning {} if missing or unreadable"""
+    try:
+        with open(cache_file, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def open_state_db(path, schema, timeout=5.0):
+    """SQLite copy under STATE_DIR (or ":memory:") with its schema created; rows come back as sqlite3.Row"""
+    if path != ":memory:":
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    db = sqlite3.connect(path, timeout=timeout)
+    db.row_factory = sqlite3.Row
+    db.executescript(schema)
+    return db
+
+def _update_cache(cache_file, key, entry):
+    """Set or remove (entry=None) one server's cached strategy"""
+    with _cache_lock:
+        cache = load_cache(cache_file)
+        if entry is None:
+            if cache.pop(key, None) is None:
+                return
+        else:
+            cache[key] = entry
+        try:
+            os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+            tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+            with open(tmp_file, "w") as f:
+                json.dump(cache, f, indent=2)
+            os.replace(tmp_file, cache_file)
+        except OSError:
+            pass  # the cache is only an optimization
+
+def default_recorder():
+    """The process-wide recorder when PVAULT_RECORD is set, else None"""
+    global _recorder
+    if not RECORD_FILE:
+        return None
+    with _recorder_lock:
+        if _recorder is None:
+            from dmv_recorder import SnapshotRecorder
+            _recorder = SnapshotRecorder(RECORD_FILE)
+        return _recorder
+
+class ConnectionFactory:
+    def __init__(self, server, port, database, username, password, timeout=15,
+                 cache_file=CACHE_FILE, recorder=None, standin=STANDIN):
+        self.server = server
+        self.port = port
+        self.database = database
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+        self.cache_file = cache_file
+        self.strategy = None  # strategy used by the last successful connect()
+        self.errors = {}      # strategy name -> exception from the last connect()
+        self.warned = False   # unencrypted connection already reported
+        self.recorder = recorder or default_recorder()  # wraps new connections when recording
+        self.standin = standin  # stand-in spec or StandinServer; connects to it instead of SQL Server
+
+    @property
+    def cache_key(self):
+        return f"{self.server},{self.port}".lower()
+
+    def connection_string(self, strategy, mask_password=False):
+        """Build the ODBC connection string for a strategy"""
+        server = f"{self.server},{self.port}" if strategy["use_port"] else self.server
+        password = "***PASSWORD***" if mask_password else self.password
+        return (
+            f"DRIVER={{{strategy['driver']}}};"
+            f"SERVER={server};"
+            f"DATABASE={self.database};"
+            f"UID={self.username};"
+            f"PWD={password};"
+            f"{strategy['extra']}"
+        )
+
+    def candidate_strategies(self):
+        """Strategies whose driver is installed (all of them if that can't be determined)"""
+        try:
+            installed = set(pyodbc.drivers())
+        except Exception:
+            installed = set()
+        candidates = [s for s in CONNECTION_STRATEGIES if s["driver"] in installed]
+        return candidates or list(CONNECTION_STRATEGIES)
+
+    def connect(self):
+        """Open a connection, trying the cached strategy first and racing the rest"""
+        connection = self._connect()
+        if self.recorder is not None:
+            connection = self.recorder.wrap(connection, f"{self.server}/{self.database}")
+        return connection
+
+    def _connect(self):
+        self.errors = {}
+        if self.standin:
+            from dmv_standin import standin_server
+            self.strategy = STANDIN_STRATEGY
+            return standin_server(self.standin).connect()
+        if pyodbc is None:
+            raise ConnectionFailed(self.server, {"pyodbc": ImportError("pyodbc is not installed")})
+
+        strategies = self.candidate_strategies()
+
+        cached = load_cache(self.cache_file).get(self.cache_key)
+        if cached:
+            for strategy in strategies:
+                if strategy["name"] == cached.get("strategy"):
+                    try:
+                        connection = pyodbc.connect(self.connection_string(strategy),
+                                                    timeout=self.timeout)
+                        self.strategy = strategy
+                        self._warn_unencrypted(strategy)
+                        return connection
+                    except Exception as e:
+                        self.errors[strategy["name"]] = e
+                        _update_cache(self.cache_file, self.cache_key, None)
+                        strategies = [s for s in strategies if s is not strategy]
+                    break
+
+        # Preference order: an unencrypted handshake finishes faster, so it never races an encrypted one
+        connection = strategy = None
+        for tier in ([s for s in strategies if s["encrypted"]], [s for s in strategies if not s["encrypted"]]):
+            if tier:
+                connection, strategy = self._race(tier)
+                if connection is not None:
+                    break
+        if connection is None:
+            raise ConnectionFailed(self.server, self.errors)
+
+        self.strategy = strategy
+        _update_cache(self.cache_file, self.cache_key, {
+            "strategy": strategy["name"],
+            "driver": strategy["driver"],
+            "encrypted": strategy["encrypted"],
+            "updated": datetime.now().isoformat(timespec="seconds")
+        })
+        self._warn_unencrypted(strategy)
+        return connection
+
+    def _warn_unencrypted(self, strategy):
+        """Say so (once per factory) when the connection is not encrypted"""
+        if strategy["encrypted"] or self.warned:
+            return
+        self.warned = True
+        failed = ", ".join(f"{name}: {str(error)[:80]}" for name, error in self.errors.items())
+        print(f"[WARNING] Connected to {self.server} WITHOUT encryption using {strategy['name']}"
+              + (f"; encrypted strategies failed ({failed})" if failed else " (cached strategy)"))
+        print(f"  → Remove the {self.cache_key} entry from {self.cache_file} to retry encryption")
+
+    def _race(self, strategies):
+        """Try strategies concurrently; return the first (connection, strategy) to succeed"""
+        lock = threading.Lock()
+        finished = threading.Event()
+        state = {"winner": None, "pending": len(strategies)}
+        errors = {}  # losers may still fail after the race is decided
+
+        def attempt(strategy):
+            connection = error = None
+            try:
+                connection = pyodbc.connect(self.connection_string(strategy),
+                                            timeout=self.timeout)
+            except Exception as e:
+                error = e
+
+            with lock:
+                state["pending"] -= 1
+                if connection is not None and state["winner"] is None:
+                    state["winner"] = (connection, strategy)
+                    connection = None
+                elif error is not None:
+                    errors[strategy["name"]] = error
+                if state["winner"] is not None or state["pending"] == 0:
+                    finished.set()
+
+            if connection is not None:
+                connection.close()  # lost the race
+
+        # Daemon threads so a hung loser never delays interpreter exit
+        for strategy in strategies:
+            threading.Thread(target=attempt, args=(strategy,), daemon=True).start()
+
+        if strategies:
+            finished.wait()
+        with lock:
+            self.errors.update(errors)
+            return state["winner"] or (None, None)
+
+def connect(server, port, database, username, password, timeout=15):
+    """Convenience wrapper: open a connection and return (connection, strategy)"""
+    factory = ConnectionFactory(server, port, database, username, password, timeout)
+    connection = factory.connect()
+    return connection, factory.strategy
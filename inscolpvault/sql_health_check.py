@@ -4,65 +4,107 @@ Server: inscolpvault.insulationsinc.local
 Purpose: Comprehensive health check and diagnostics
 """
 
-import pyodbc
 import pandas as pd
 from datetime import datetime
 import sys
 import json
+import io
+import copy
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 from tabulate import tabulate
+from sql_connection import ConnectionFactory, ConnectionFailed
+from wait_stats import WaitStatsTracker
+from fragmentation_cache import FragmentationCache, SCAN_BUDGET_SECONDS, describe
+from baseline_store import save_run
+from check_trace import CheckTracer, TRACE_FILE
+from check_budget import CheckBudget, RUN_BUDGET_SECONDS
+from deadlock_collector import DeadlockCollector
+from xe_timeouts import XeUnavailable
+
+class _CheckOutput:
+    """stdout proxy that routes print() from pool workers into per-check buffers"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def write(self, text):
+        buffer = getattr(self.local, 'buffer', None)
+        return (buffer or self.stream).write(text)
+
+    def flush(self):
+        self.stream.flush()
 
 class SQLServerHealthCheck:
-    def __init__(self, server, database, username, password, port=55859):
+    # Report order; every check is a read-only DMV query and can run on its own connection.
+    # run_all_checks runs them in check_budget.CHECK_PRIORITY order under per-check timeouts
+    CHECKS = [
+        'check_server_info',
+        'check_database_status',
+        'check_performance_metrics',
+        'check_wait_stats',
+        'check_blocking',
+        'check_long_running_queries',
+        'check_query_timeouts',
+        'check_large_tables',
+        'check_missing_indexes',
+        'check_table_fragmentation',
+        'check_statistics_age',
+        'check_disk_space',
+        'check_recent_errors',
+        'check_deadlocks',
+    ]
+
+    def __init__(self, server, database, username, password, port=55859, wait_sample_seconds=5,
+                 trace=TRACE_FILE, time_budget=RUN_BUDGET_SECONDS, check_timeouts=None):
         self.server = server
         self.database = database
         self.username = username
         self.password = password
         self.port = port
         self.connection = None
-        self.results = {}
+        self.results = {'metrics': {}}  # metric -> value, saved to the baseline store
+        self.wait_sample_seconds = wait_sample_seconds
+        self.factory = ConnectionFactory(server, port, database, username, password, timeout=30)
+        self.clock = time.monotonic  # dmv_replay.py substitutes the recorded clock and skips sleeps
+        self.sleep = time.sleep
+        self.trace_path = trace  # write a CheckTracer trace of run_all_checks here
+        self.tracer = None
+        self.time_budget = time_budget  # seconds for the whole run_all_checks
+        self.check_timeouts = check_timeouts  # check -> seconds, overriding check_budget.CHECK_TIMEOUTS
+        self.budget = None  # CheckBudget of the current run
 
     def connect(self):
         """Establish connection to SQL Server"""
-        # Try multiple connection strategies
-        connection_configs = [
-            # ODBC Driver 18 (preferred)
-            {
-                "driver": "ODBC Driver 18 for SQL Server",
-                "extra": "Encrypt=yes;TrustServerCertificate=yes;"
-            },
-            # ODBC Driver 17
-            {
-                "driver": "ODBC Driver 17 for SQL Server",
-                "extra": "TrustServerCertificate=yes;"
-            },
-            # SQL Server Native Client 11.0
-            {
-                "driver": "SQL Server Native Client 11.0",
-                "extra": ""
-            }
-        ]
-
         print(f"[INFO] Connecting to {self.server}:{self.port}...")
 
-        for config in connection_configs:
-            try:
-                connection_string = (
-                    f"DRIVER={{{config['driver']}}};"
-                    f"SERVER={self.server},{self.port};"
-                    f"DATABASE={self.database};"
-                    f"UID={self.username};"
-                    f"PWD={self.password};"
-                    f"{config['extra']}"
-                )
-
-                self.connection = pyodbc.connect(connection_string, timeout=30)
-                print(f"[SUCCESS] Connected to SQL Server using {config['driver']}")
-                return True
-            except Exception as e:
-                continue
+        self.connection = self._open_connection()
+        if self.connection is None:
+            print(f"[ERROR] Failed to connect with all strategies")
+            return False
+        return True
 
-        print(f"[ERROR] Failed to connect with all drivers")
-        return False
+    def _open_connection(self, quiet=False):
+        """Open a new connection, or return None if every strategy fails"""
+        try:
+            connection = self.factory.connect()
+        except ConnectionFailed:
+            return None
+        if self.budget is not None:
+            connection = self.budget.wrap(connection)
+        if self.tracer is not None:
+            connection = self.tracer.wrap(connection)
+        if not quiet:
+            print(f"[SUCCESS] Connected to SQL Server using {self.factory.strategy['name']}")
+        return connection
+
+    def record(self, metric, value):
+        """Keep a metric of this run for the baseline store"""
+        self.results['metrics'][metric] = value
 
     def check_server_info(self):
         """Get basic server information"""
@@ -122,6 +164,8 @@ class SQLServerHealthCheck:
                                    'ReadOnly', 'AutoClose', 'AutoShrink', 'PageVerify'])
             print(tabulate(df, headers='keys', tablefmt='grid'))
 
+            self.record('offline_databases', sum(1 for db in databases if db.Status != 'ONLINE'))
+
             # Flag any issues
             for db in databases:
                 if db.Status != 'ONLINE':
@@ -170,6 +214,8 @@ class SQLServerHealthCheck:
             df = pd.DataFrame([tuple(row) for row in cpu_data],
                             columns=['RecordID', 'Time', 'SQL_CPU%', 'Other_CPU%', 'Idle%'])
             print(tabulate(df.head(5), headers='keys', tablefmt='grid'))
+            self.record('sql_cpu_pct', cpu_data[0].SQL_CPU)
+            self.record('other_cpu_pct', cpu_data[0].Other_CPU)
 
         # Memory usage
         print("\n[Memory Usage]")
@@ -185,6 +231,8 @@ class SQLServerHealthCheck:
         memory = cursor.fetchone()
         if memory:
             print(f"Physical Memory Used: {memory[0]:,.0f} MB")
+            self.record('memory_used_mb', memory[0])
+            self.record('memory_low', 1 if memory[2] else 0)
             print(f"Total Virtual Address Space: {memory[1]:,.0f} MB")
             if memory[2]:
                 print("[WARNING] Physical memory is low!")
@@ -232,6 +280,30 @@ class SQLServerHealthCheck:
             df['Percentage'] = df['Percentage'].round(2)
             print(tabulate(df, headers='keys', tablefmt='grid'))
 
+        # The totals above are cumulative since startup; sample a short interval for current waits
+        if self.wait_sample_seconds > 0:
+            tracker = WaitStatsTracker()
+            tracker.sample(self.connection, self.clock)
+            self.sleep(self.wait_sample_seconds)
+            tracker.sample(self.connection, self.clock)
+
+            print(f"\n[Waits during a {self.wait_sample_seconds}s sample]")
+            deltas = tracker.top_interval(10)
+            total_ms = sum(counters[1] for counters in tracker.interval.values())
+            self.record('wait_ms_per_sec', total_ms / tracker.interval_seconds if tracker.interval_seconds else 0.0)
+            # Deltas where only the wait count changed sum to 0 ms: no shares to record then
+            if total_ms:
+                for d in deltas:
+                    self.record(f'wait_pct.{d.wait_type}', 100.0 * d.wait_ms / total_ms)
+            if deltas:
+                df = pd.DataFrame([(d.wait_type, d.wait_ms / 1000.0, d.waits_per_sec,
+                                    d.avg_wait_ms, d.signal_pct) for d in deltas],
+                                  columns=['Wait Type', 'Wait(s)', 'Waits/sec',
+                                           'Avg Wait(ms)', 'Signal%'])
+                print(tabulate(df.round(2), headers='keys', tablefmt='grid'))
+            else:
+                print("[OK] No waits during the sample")
+
     def check_blocking(self):
         """Check for current blocking sessions"""
         print("\n" + "="*60)
@@ -258,6 +330,8 @@ class SQLServerHealthCheck:
 
         cursor.execute(query)
         blocks = cursor.fetchall()
+        self.record('blocked_sessions', len(blocks))
+        self.record('max_blocked_wait_sec', max((block[2] for block in blocks), default=0.0))
 
         if blocks:
             for block in blocks:
@@ -300,6 +374,7 @@ class SQLServerHealthCheck:
 
         cursor.execute(query)
         queries = cursor.fetchall()
+        self.record('long_running_queries', len(queries))
 
         if queries:
             for q in queries:
@@ -340,6 +415,8 @@ class SQLServerHealthCheck:
 
         cursor.execute(query)
         files = cursor.fetchall()
+        self.record('data_file_mb', sum(f.SizeMB for f in files if f.FileType == 'ROWS'))
+        self.record('log_file_mb', sum(f.SizeMB for f in files if f.FileType == 'LOG'))
 
         if files:
             df = pd.DataFrame([tuple(row) for row in files],
@@ -381,6 +458,26 @@ class SQLServerHealthCheck:
         except Exception as e:
             print(f"[WARNING] Could not read error log: {str(e)}")
 
+    def check_deadlocks(self):
+        """Deadlocks from the system_health session since the last read, counted per deadlock shape"""
+        print("\n" + "="*60)
+        print("DEADLOCKS (system_health)")
+        print("="*60)
+
+        collector = DeadlockCollector(self.server)
+        try:
+            try:
+                new = collector.collect(self.connection)
+                print(f"[INFO] {len(new)} deadlock report(s) since the last read")
+            except XeUnavailable as e:
+                print(f"[WARNING] Could not read deadlocks: {e}")
+            total = collector.print_report(hours=24, n=10)
+            self.record('deadlocks_24h', total)
+            if total:
+                print("  → Details of one shape: python deadlock_collector.py --fingerprint <fingerprint>")
+        finally:
+            collector.close()
+
     def check_query_timeouts(self):
         """Check for queries that may be timing out"""
         print("\n" + "="*60)
@@ -420,6 +517,8 @@ class SQLServerHealthCheck:
                 print("  [WARNING] Approaching timeout threshold!")
             print("-" * 40)
 
+        self.record('active_requests', len(queries))
+        self.record('timeout_risk_queries', len(timeout_risk))
         if timeout_risk:
             print(f"\n[ALERT] {len(timeout_risk)} queries at risk of timeout")
 
@@ -493,6 +592,7 @@ class SQLServerHealthCheck:
         """)
 
         indexes = cursor.fetchall()
+        self.record('missing_index_advantage', sum(idx.IndexAdvantage for idx in indexes))
         if indexes:
             print("\n[Top Missing Indexes (causing slow queries)]")
             for idx in indexes[:5]:
@@ -512,35 +612,27 @@ class SQLServerHealthCheck:
         print("INDEX FRAGMENTATION ANALYSIS")
         print("="*60)
 
-        cursor = self.connection.cursor()
-
-        cursor.execute("""
-        SELECT
-            s.name AS SchemaName,
-            t.name AS TableName,
-            i.name AS IndexName,
-            ps.avg_fragmentation_in_percent,
-            ps.page_count
-        FROM sys.dm_db_index_physical_stats(DB_ID(), NULL, NULL, NULL, 'LIMITED') ps
-        INNER JOIN sys.indexes i ON ps.object_id = i.object_id AND ps.index_id = i.index_id
-        INNER JOIN sys.tables t ON i.object_id = t.object_id
-        INNER JOIN sys.schemas s ON t.schema_id = s.schema_id
-        WHERE ps.avg_fragmentation_in_percent > 30
-            AND ps.page_count > 1000
-            AND i.name IS NOT NULL
-        ORDER BY ps.avg_fragmentation_in_percent DESC
-        """)
-
-        fragments = cursor.fetchall()
+        # Only indexes that changed since their last scan are rescanned (see fragmentation_cache.py),
+        # for no longer than most of what is left of this check's time
+        deadline = self.budget.current_deadline() if self.budget is not None else None
+        scan_budget = SCAN_BUDGET_SECONDS if deadline is None else min(SCAN_BUDGET_SECONDS, 0.8 * deadline.remaining())
+        cache = FragmentationCache(self.connection, self.server, self.database, budget=scan_budget)
+        indexes = cache.refresh()
+        cache.print_summary(indexes)
+
+        fragments = sorted((f for f in indexes
+                            if f.fragmentation is not None and f.fragmentation > 30 and f.page_count > 1000),
+                           key=lambda f: f.fragmentation, reverse=True)
+        self.record('fragmented_indexes', len(fragments))
         if fragments:
             print("\n[Fragmented Indexes (>30% fragmentation)]")
             for f in fragments[:10]:
-                print(f"{f.SchemaName}.{f.TableName}.{f.IndexName}")
-                print(f"  Fragmentation: {f.avg_fragmentation_in_percent:.1f}%")
+                print(f"{f.schema}.{f.table}.{f.index}")
+                print(f"  Fragmentation: {f.fragmentation:.1f}% {describe(f)}")
                 print(f"  Pages: {f.page_count:,}")
-                if f.avg_fragmentation_in_percent > 70:
+                if f.fragmentation > 70:
                     print("  [CRITICAL] Rebuild index immediately!")
-                elif f.avg_fragmentation_in_percent > 50:
+                elif f.fragmentation > 50:
                     print("  [WARNING] Consider rebuilding this index")
 
     def check_statistics_age(self):
@@ -569,6 +661,7 @@ class SQLServerHealthCheck:
         """)
 
         stats = cursor.fetchall()
+        self.record('outdated_statistics', len(stats))
         if stats:
             print("\n[Outdated Statistics (can cause timeout issues)]")
             for s in stats[:10]:
@@ -594,32 +687,142 @@ class SQLServerHealthCheck:
         print("6. Consider query timeout settings in application")
         print("7. Review execution plans for expensive operations")
 
-    def run_all_checks(self):
-        """Run all health checks"""
+    def _traced(self, name):
+        """Span for one check when tracing, else a no-op"""
+        return self.tracer.check(name) if self.tracer is not None else nullcontext()
+
+    def _check_order(self):
+        return self.budget.order(self.CHECKS) if self.budget is not None else self.CHECKS
+
+    def _run_check(self, checker, name):
+        """Run one check under its deadline (skipped once the run budget is used up)"""
+        if self.budget is None:
+            with self._traced(name):
+                getattr(checker, name)()
+            return
+        if self.budget.should_skip(name):
+            print(f"\n[SKIPPED] {name}: time budget of {self.budget.seconds:.0f}s used up")
+            return
+        with self._traced(name), self.budget.check(name):
+            getattr(checker, name)()
+
+    def _run_checks_sequential(self, timings):
+        """Run every check in priority order on the main connection"""
+        for name in self._check_order():
+            start = time.perf_counter()
+            try:
+                self._run_check(self, name)
+            except Exception as e:
+                print(f"\n[ERROR] {name} failed: {str(e)}")
+            timings[name] = time.perf_counter() - start
+
+    def _run_pooled_check(self, name, pool, output):
+        """Run one check on a pooled connection, capturing its printed output"""
+        connection = pool.get()
+        worker = copy.copy(self)
+        worker.connection = connection
+        buffer = io.StringIO()
+        output.local.buffer = buffer
+        start = time.perf_counter()
+        try:
+            self._run_check(worker, name)
+        except Exception as e:
+            print(f"\n[ERROR] {name} failed: {str(e)}")
+        finally:
+            elapsed = time.perf_counter() - start
+            output.local.buffer = None
+            pool.put(connection)
+        return buffer.getvalue(), elapsed
+
+    def _run_checks_parallel(self, timings, max_workers):
+        """Run every check on a bounded connection pool, printing in priority order"""
+        connections = [self.connection]
+        for _ in range(max_workers - 1):
+            connection = self._open_connection(quiet=True)
+            if connection is None:
+                break
+            connections.append(connection)
+
+        pool = queue.Queue()
+        for connection in connections:
+            pool.put(connection)
+        print(f"[INFO] Running {len(self.CHECKS)} checks on {len(connections)} connections")
+
+        output = _CheckOutput(sys.stdout)
+        sys.stdout = output
+        try:
+            with ThreadPoolExecutor(max_workers=len(connections)) as executor:
+                futures = [(name, executor.submit(self._run_pooled_check, name, pool, output))
+                           for name in self._check_order()]
+                # Print each check's output as soon as it and everything before it is done
+                for name, future in futures:
+                    text, elapsed = future.result()
+                    output.stream.write(text)
+                    timings[name] = elapsed
+        finally:
+            sys.stdout = output.stream
+            for connection in connections[1:]:
+                connection.close()
+
+    def print_timing_summary(self, timings, wall_time):
+        """Print per-check wall time, slowest first"""
+        print("\n" + "="*60)
+        print("CHECK TIMINGS")
+        print("="*60)
+
+        check_time = sum(timings.values())
+        rows = [(name, round(sec, 3), round(100.0 * sec / check_time, 1) if check_time else 0.0)
+                for name, sec in sorted(timings.items(), key=lambda x: x[1], reverse=True)]
+        print(tabulate(rows, headers=['Check', 'Seconds', '% of Check Time'], tablefmt='grid'))
+        print(f"Sum of check times: {check_time:.2f}s")
+        print(f"Wall time: {wall_time:.2f}s")
+        if wall_time > 0:
+            print(f"Speedup: {check_time / wall_time:.1f}x")
+        if rows:
+            print(f"Slowest check: {rows[0][0]} ({rows[0][1]:.2f}s)")
+
+    def save_results(self, compare=False):
+        """Persist this run's metrics and check timings to the local baseline store"""
+        metrics = dict(self.results['metrics'])
+        for name, seconds in self.results.get('timings', {}).items():
+            metrics[f'check_seconds.{name}'] = seconds
+        return save_run(self.server, self.database, 'health_check', metrics, compare=compare)
+
+    def run_all_checks(self, parallel=False, max_workers=4, compare_baseline=False):
+        """Run all health checks, optionally on a pool of max_workers connections"""
+        if self.trace_path:
+            self.tracer = CheckTracer('run_all_checks', server=self.server, database=self.database,
+                                      parallel=bool(parallel and max_workers > 1))
+            self.sleep = self.tracer.traced_sleep(self.sleep)
+        self.budget = CheckBudget(self.time_budget, self.check_timeouts)
         if not self.connect():
             return False
+        self.budget.start_timer()
 
+        timings = {}
+        self.results['timings'] = timings
+        start = time.perf_counter()
         try:
-            self.check_server_info()
-            self.check_database_status()
-            self.check_performance_metrics()
-            self.check_wait_stats()
-            self.check_blocking()
-            self.check_long_running_queries()
-            self.check_query_timeouts()
-            self.check_large_tables()
-            self.check_missing_indexes()
-            self.check_table_fragmentation()
-            self.check_statistics_age()
-            self.check_disk_space()
-            self.check_recent_errors()
+            if parallel and max_workers > 1:
+                self._run_checks_parallel(timings, max_workers)
+            else:
+                self._run_checks_sequential(timings)
             self.generate_report()
+            self.print_timing_summary(timings, time.perf_counter() - start)
+            self.budget.print_summary()
+            self.record('checks_incomplete', len(self.budget.incomplete()))
+            if self.tracer is not None:
+                self.tracer.print_summary()
+            self.save_results(compare=compare_baseline)
 
         except Exception as e:
             print(f"\n[ERROR] Health check failed: {str(e)}")
             import traceback
             traceback.print_exc()
         finally:
+            self.budget.stop_timer()
+            if self.tracer is not None:
+                print(f"\n✓ Trace written to {self.tracer.save(self.trace_path)}")
             if self.connection:
                 self.connection.close()
                 print("\n[INFO] Connection closed")
@@ -634,12 +837,14 @@ def main():
     username = input("Username: ").strip()
     password = input("Password: ").strip()
     port = input("Port (55859): ").strip() or "55859"
+    parallel = input("Run checks in parallel? (y/N): ").strip().lower() == 'y'
+    compare = input("Compare with the baseline for this hour of the week? (y/N): ").strip().lower() == 'y'
 
     # Create health check instance
     health_check = SQLServerHealthCheck(server, database, username, password, int(port))
 
     # Run checks
-    health_check.run_all_checks()
+    health_check.run_all_checks(parallel=parallel, compare_baseline=compare)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
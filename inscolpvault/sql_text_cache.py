@@ -0,0 +1,91 @@
+"""
+sql_handle -> statement text cache for pVault monitoring
+Fetches statement text once per new handle/offset instead of on every sampling tick
+"""
+
+from collections import OrderedDict
+
+# sys.dm_exec_sql_text calls per round trip (each handle is one parameter; SQL Server allows 2100)
+FETCH_BATCH_SIZE = 200
+MAX_STATEMENT_LENGTH = 4000  # characters kept per statement
+
+def cut_statement(text, start_offset, end_offset):
+    """Cut one statement out of its batch using the UTF-16 byte offsets from the DMVs"""
+    if not text:
+        return ""
+    start = (start_offset or 0) // 2
+    if end_offset is None or end_offset == -1:
+        statement = text[start:]
+    else:
+        statement = text[start:end_offset // 2 + 1]
+    return statement.strip()[:MAX_STATEMENT_LENGTH]
+
+class SqlTextCache:
+    """Bounded LRU of (sql_handle, statement_start_offset, statement_end_offset) -> statement"""
+
+    def __init__(self, capacity=2048):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.fetches = 0  # round trips to sys.dm_exec_sql_text
+
+    def __len__(self):
+        return len(self.entries)
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return 100.0 * self.hits / lookups if lookups else 0.0
+
+    def resolve(self, connection, keys):
+        """Return {key: statement} for (sql_handle, start, end) keys, fetching only new ones"""
+        result = {}
+        missing = {}  # sql_handle -> keys needing that handle's text
+        pending = set()
+        for key in keys:
+            if key in result or key in pending:
+                continue
+            text = self.entries.get(key)
+            if text is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                result[key] = text
+            elif key[0]:
+                self.misses += 1
+                pending.add(key)
+                missing.setdefault(key[0], []).append(key)
+            else:
+                result[key] = ""
+
+        if missing:
+            batches = self._fetch(connection, list(missing))
+            for handle, handle_keys in missing.items():
+                for key in handle_keys:
+                    # Handles whose text is gone are cached as "" so they are not re-fetched
+                    text = cut_statement(batches.get(bytes(handle)), key[1], key[2])
+                    self._store(key, text)
+                    result[key] = text
+        return result
+
+    def _store(self, key, text):
+        self.entries[key] = text
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def _fetch(self, connection, handles):
+        """Full batch text per handle, FETCH_BATCH_SIZE handles per round trip"""
+        cursor = connection.cursor()
+        texts = {}
+        for i in range(0, len(handles), FETCH_BATCH_SIZE):
+            batch = handles[i:i + FETCH_BATCH_SIZE]
+            values = ", ".join("(CAST(? AS varbinary(64)))" for _ in batch)
+            cursor.execute(f"""
+            SELECT h.sql_handle, t.text
+            FROM (VALUES {values}) AS h(sql_handle)
+            CROSS APPLY sys.dm_exec_sql_text(h.sql_handle) t
+            """, *batch)
+            self.fetches += 1
+            for row in cursor.fetchall():
+                texts[bytes(row[0])] = row[1]
+        return texts
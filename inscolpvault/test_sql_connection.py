@@ -5,6 +5,7 @@ Tests basic connectivity to pvault SQL Server
 
 import pyodbc
 import sys
+from sql_connection import ConnectionFactory, ConnectionFailed
 
 def test_connection():
     print("SQL Server Connection Test")
@@ -19,30 +20,6 @@ def test_connection():
 
     print(f"\nAttempting to connect to {server}:{port}...")
 
-    # Test different connection string variations
-    connection_strings = [
-        # Try with ODBC Driver 18 (preferred)
-        {
-            "name": "ODBC Driver 18",
-            "string": f"DRIVER={{ODBC Driver 18 for SQL Server}};SERVER={server},{port};DATABASE={database};UID={username};PWD={password};TrustServerCertificate=yes;Encrypt=yes;"
-        },
-        # Standard connection with ODBC Driver 17
-        {
-            "name": "ODBC Driver 17",
-            "string": f"DRIVER={{ODBC Driver 17 for SQL Server}};SERVER={server},{port};DATABASE={database};UID={username};PWD={password};TrustServerCertificate=yes;"
-        },
-        # Try with SQL Server Native Client
-        {
-            "name": "SQL Server Native Client",
-            "string": f"DRIVER={{SQL Server Native Client 11.0}};SERVER={server},{port};DATABASE={database};UID={username};PWD={password};"
-        },
-        # Try with just SQL Server driver
-        {
-            "name": "SQL Server",
-            "string": f"DRIVER={{SQL Server}};SERVER={server},{port};DATABASE={database};UID={username};PWD={password};"
-        }
-    ]
-
     # First, list available drivers
     print("\n[Available ODBC Drivers on System]")
     try:
@@ -53,52 +30,54 @@ def test_connection():
         print("  Unable to list drivers")
 
     print("\n[Testing Connections]")
+    print("Trying all connection strategies in parallel...")
+    factory = ConnectionFactory(server, port, database, username, password, timeout=10)
     successful_connection = None
 
-    for conn_config in connection_strings:
-        print(f"\nTrying {conn_config['name']}...")
-        try:
-            conn = pyodbc.connect(conn_config['string'], timeout=10)
-            print(f"  ✓ SUCCESS with {conn_config['name']}")
-
-            # Test basic query
-            cursor = conn.cursor()
-            cursor.execute("SELECT @@VERSION AS Version, @@SERVERNAME AS ServerName")
-            result = cursor.fetchone()
-
-            print(f"  Server: {result.ServerName}")
-            print(f"  Version: {result.Version[:100]}...")
-
-            # Get database list
-            cursor.execute("SELECT name FROM sys.databases ORDER BY name")
-            databases = cursor.fetchall()
-            print(f"\n  Available Databases:")
-            for db in databases[:10]:  # Show first 10
-                print(f"    - {db[0]}")
-            if len(databases) > 10:
-                print(f"    ... and {len(databases)-10} more")
-
-            conn.close()
-            successful_connection = conn_config
-            break
-
-        except pyodbc.Error as e:
-            print(f"  ✗ Failed: {str(e)[:100]}")
-            if "08001" in str(e):
-                print("    → Network connectivity issue. Check VPN connection and firewall.")
-            elif "28000" in str(e):
-                print("    → Authentication failed. Check username/password.")
-            elif "IM002" in str(e):
-                print(f"    → Driver not found. Install {conn_config['name']}.")
-
-        except Exception as e:
-            print(f"  ✗ Unexpected error: {str(e)[:100]}")
+    try:
+        conn = factory.connect()
+        print(f"  ✓ SUCCESS with {factory.strategy['name']}")
+
+        # Test basic query
+        cursor = conn.cursor()
+        cursor.execute("SELECT @@VERSION AS Version, @@SERVERNAME AS ServerName")
+        result = cursor.fetchone()
+
+        print(f"  Server: {result.ServerName}")
+        print(f"  Version: {result.Version[:100]}...")
+
+        # Get database list
+        cursor.execute("SELECT name FROM sys.databases ORDER BY name")
+        databases = cursor.fetchall()
+        print(f"\n  Available Databases:")
+        for db in databases[:10]:  # Show first 10
+            print(f"    - {db[0]}")
+        if len(databases) > 10:
+            print(f"    ... and {len(databases)-10} more")
+
+        conn.close()
+        successful_connection = factory.strategy
+
+    except ConnectionFailed:
+        pass
+    except Exception as e:
+        print(f"  ✗ Unexpected error: {str(e)[:100]}")
+
+    # Report strategies that failed
+    for name, error in list(factory.errors.items()):
+        print(f"\n  ✗ {name} failed: {str(error)[:100]}")
+        if "08001" in str(error):
+            print("    → Network connectivity issue. Check VPN connection and firewall.")
+        elif "28000" in str(error):
+            print("    → Authentication failed. Check username/password.")
+        elif "IM002" in str(error):
+            print(f"    → Driver not found. Install {name}.")
 
     print("\n" + "="*50)
     if successful_connection:
         print(f"✓ Connection successful using {successful_connection['name']}")
         print("\nConnection string for your reference:")
-        print(successful_connection['string'].replace(password, '***PASSWORD***'))
+        print(factory.connection_string(successful_connection, mask_password=True))
         print("\nYou can now run the full health check script: python sql_health_check.py")
     else:
         print("✗ All connection attempts failed")
@@ -0,0 +1,156 @@
+"""
+Interval wait statistics for pVault monitoring
+Turns cumulative sys.dm_os_wait_stats snapshots into per-interval and rolling-window deltas
+"""
+
+import time
+from collections import deque, namedtuple
+
+# Idle/background waits that say nothing about query performance
+BENIGN_WAITS = (
+    'CLR_SEMAPHORE', 'LAZYWRITER_SLEEP', 'RESOURCE_QUEUE',
+    'SLEEP_TASK', 'SLEEP_SYSTEMTASK', 'SQLTRACE_BUFFER_FLUSH',
+    'WAITFOR', 'LOGMGR_QUEUE', 'CHECKPOINT_QUEUE',
+    'REQUEST_FOR_DEADLOCK_SEARCH', 'XE_TIMER_EVENT',
+    'BROKER_TO_FLUSH', 'BROKER_TASK_STOP', 'CLR_MANUAL_EVENT',
+    'CLR_AUTO_EVENT', 'DISPATCHER_QUEUE_SEMAPHORE',
+    'FT_IFTS_SCHEDULER_IDLE_WAIT', 'XE_DISPATCHER_WAIT',
+    'XE_DISPATCHER_JOIN', 'BROKER_EVENTHANDLER',
+    'TRACEWRITE', 'FT_IFTSHC_MUTEX', 'SQLTRACE_INCREMENTAL_FLUSH_SLEEP',
+    'DIRTY_PAGE_POLL', 'HADR_FILESTREAM_IOMGR_IOCOMPLETION',
+    'SP_SERVER_DIAGNOSTICS_SLEEP', 'QDS_PERSIST_TASK_MAIN_LOOP_SLEEP',
+    'QDS_CLEANUP_STALE_QUERIES_TASK_MAIN_LOOP_SLEEP', 'WAIT_XTP_OFFLINE_CKPT_NEW_LOG'
+)
+
+WAIT_STATS_QUERY = """
+SELECT
+    wait_type,
+    waiting_tasks_count,
+    wait_time_ms,
+    signal_wait_time_ms
+FROM sys.dm_os_wait_stats
+WHERE wait_time_ms > 0
+    AND wait_type NOT IN ({})
+""".format(", ".join(f"'{w}'" for w in BENIGN_WAITS))
+
+WaitDelta = namedtuple('WaitDelta', [
+    'wait_type', 'waits', 'wait_ms', 'signal_ms', 'resource_ms',
+    'waits_per_sec', 'avg_wait_ms', 'signal_pct'
+])
+
+def _to_delta(wait_type, counters, seconds):
+    waits, wait_ms, signal_ms = counters
+    return WaitDelta(
+        wait_type=wait_type,
+        waits=waits,
+        wait_ms=wait_ms,
+        signal_ms=signal_ms,
+        resource_ms=wait_ms - signal_ms,
+        waits_per_sec=waits / seconds if seconds > 0 else 0.0,
+        avg_wait_ms=wait_ms / waits if waits else 0.0,
+        signal_pct=100.0 * signal_ms / wait_ms if wait_ms else 0.0
+    )
+
+class WaitStatsTracker:
+    """Keeps the previous snapshot and a rolling window of per-interval deltas"""
+
+    def __init__(self, window_seconds=300):
+        self.window_seconds = window_seconds
+        self.previous = None        # wait_type -> (waits, wait_ms, signal_ms)
+        self.previous_time = None
+        self.interval = {}          # deltas for the most recent interval
+        self.interval_seconds = 0.0
+        self.window = deque()       # (seconds, deltas) per interval, oldest first
+        self.window_totals = {}     # wait_type -> [waits, wait_ms, signal_ms]
+        self.window_elapsed = 0.0
+        self.resets = 0
+
+    def sample(self, connection, clock=time.monotonic):
+        """Query sys.dm_os_wait_stats and fold the snapshot in"""
+        cursor = connection.cursor()
+        cursor.execute(WAIT_STATS_QUERY)
+        rows = cursor.fetchall()
+        return self.update(rows, clock())
+
+    def update(self, rows, now=None):
+        """Fold a cumulative snapshot in; returns False for the first (baseline) snapshot"""
+        now = time.monotonic() if now is None else now
+        current = {row[0]: (row[1], row[2], row[3]) for row in rows}
+        previous, previous_time = self.previous, self.previous_time
+        self.previous, self.previous_time = current, now
+        if previous is None:
+            return False
+
+        # DBCC SQLPERF('sys.dm_os_wait_stats', CLEAR) or a restart drops every counter;
+        # in that case everything accumulated since the clear belongs to this interval
+        cleared = sum(c[1] for c in current.values()) < sum(p[1] for p in previous.values())
+        if cleared:
+            self.resets += 1
+
+        deltas = {}
+        for wait_type, counters in current.items():
+            before = None if cleared else previous.get(wait_type)
+            if before is None or any(c < b for c, b in zip(counters, before)):
+                delta = counters  # new wait type, or this counter was reset
+            else:
+                delta = (counters[0] - before[0], counters[1] - before[1], counters[2] - before[2])
+            if delta[0] or delta[1]:
+                deltas[wait_type] = delta
+
+        seconds = max(now - previous_time, 0.0)
+        self.interval = deltas
+        self.interval_seconds = seconds
+        self._add_to_window(seconds, deltas)
+        return True
+
+    def _add_to_window(self, seconds, deltas):
+        self.window.append((seconds, deltas))
+        self.window_elapsed += seconds
+        self._apply(deltas, 1)
+
+        # Drop whole intervals from the front, keeping at least the newest one
+        while len(self.window) > 1 and self.window_elapsed - self.window[0][0] >= self.window_seconds:
+            old_seconds, old_deltas = self.window.popleft()
+            self.window_elapsed -= old_seconds
+            self._apply(old_deltas, -1)
+
+    def _apply(self, deltas, sign):
+        totals = self.window_totals
+        for wait_type, (waits, wait_ms, signal_ms) in deltas.items():
+            entry = totals.get(wait_type)
+            if entry is None:
+                entry = totals[wait_type] = [0, 0, 0]
+            entry[0] += sign * waits
+            entry[1] += sign * wait_ms
+            entry[2] += sign * signal_ms
+            if sign < 0 and entry[0] <= 0 and entry[1] <= 0:
+                del totals[wait_type]
+
+    def top_interval(self, n=5):
+        """Top-N wait types by wait time in the most recent interval"""
+        return self._top(self.interval, self.interval_seconds, n)
+
+    def top_window(self, n=5):
+        """Top-N wait types by wait time across the rolling window"""
+        return self._top(self.window_totals, self.window_elapsed, n)
+
+    def _top(self, deltas, seconds, n):
+        ranked = sorted(deltas.items(), key=lambda x: x[1][1], reverse=True)[:n]
+        return [_to_delta(wait_type, counters, seconds) for wait_type, counters in ranked]
+
+    def signal_resource_split(self, window=False):
+        """(signal_ms, resource_ms) totals for the interval or the rolling window"""
+        deltas = self.window_totals if window else self.interval
+        signal_ms = sum(d[2] for d in deltas.values())
+        wait_ms = sum(d[1] for d in deltas.values())
+        return signal_ms, wait_ms - signal_ms
+
+def print_wait_deltas(title, deltas, seconds):
+    """Print one block of wait deltas in the monitor's console style"""
+    print(f"\n[{title} - {seconds:.0f}s]")
+    if not deltas:
+        print("  No waits recorded")
+        return
+    for d in deltas:
+        print(f"  {d.wait_type}: {d.wait_ms / 1000.0:.1f}s waited, {d.waits_per_sec:.1f} waits/s, "
+              f"{d.avg_wait_ms:.1f}ms avg, {d.signal_pct:.0f}% signal")
@@ -0,0 +1,411 @@
+"""
+Extended Events timeout collector for pVault
+Polling sys.dm_exec_requests only sees queries still running at a sample, so a query that times
+out between polls is never seen. This reads an Extended Events session capturing attention
+(client cancel / command timeout) and aborted rpc_completed / sql_batch_completed events for the
+pVault database. Each poll reads only the events after a bookmark (event file name and offset,
+or ring buffer timestamp) and parses them with a streaming XML parser
+
+Read every XE_POLL_SECONDS by monitor_query_performance.py, which logs each timeout as an event
+row. Creating the session needs ALTER ANY EVENT SESSION; print the DDL for a DBA with:
+    python xe_timeouts.py [--database PaperlessEnvironments] [--target event_file|ring_buffer]
+"""
+
+import argparse
+import json
+import ntpath
+import os
+import threading
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+from xml.etree import ElementTree
+
+from sql_connection import STATE_DIR
+
+SESSION_NAME = "pvault_timeouts"
+TARGET = "event_file"  # or "ring_buffer" (no file access, but every poll transfers the whole buffer)
+MAX_FILE_MB = 20
+MAX_ROLLOVER_FILES = 4
+RING_BUFFER_KB = 4096
+FETCH_ROWS = 500          # event file rows per fetch
+RING_BUFFER_CHUNK = 65536  # characters fed to the parser at a time
+INITIAL_MINUTES = 60      # events read on the first poll of a server without a bookmark
+MATCH_SECONDS = 2         # an attention and an aborted completion of one session this close are one timeout
+BOOKMARK_FILE = os.path.join(STATE_DIR, "xe_bookmarks.json")
+
+ACTIONS = ("sqlserver.client_app_name, sqlserver.client_hostname, sqlserver.database_name, "
+           "sqlserver.query_hash, sqlserver.session_id, sqlserver.sql_text")
+
+# result = 2 is Abort: the client cancelled the call (command timeout) or the connection was killed
+CREATE_SESSION = """
+CREATE EVENT SESSION [{session}] ON SERVER
+ADD EVENT sqlserver.attention (
+    ACTION ({actions})
+    WHERE sqlserver.database_name = N'{database}'),
+ADD EVENT sqlserver.rpc_completed (
+    ACTION ({actions})
+    WHERE [result] = (2) AND sqlserver.database_name = N'{database}'),
+ADD EVENT sqlserver.sql_batch_completed (
+    ACTION ({actions})
+    WHERE [result] = (2) AND sqlserver.database_name = N'{database}')
+ADD TARGET {target}
+WITH (MAX_DISPATCH_LATENCY = 5 SECONDS, EVENT_RETENTION_MODE = ALLOW_SINGLE_EVENT_LOSS, STARTUP_STATE = ON)
+"""
+
+TARGETS = {
+    "event_file": (f"package0.event_file (SET filename = N'{SESSION_NAME}.xel', "
+                   f"max_file_size = ({MAX_FILE_MB}), max_rollover_files = ({MAX_ROLLOVER_FILES}))"),
+    "ring_buffer": f"package0.ring_buffer (SET max_memory = ({RING_BUFFER_KB}))",
+}
+
+START_SESSION = "ALTER EVENT SESSION [{session}] ON SERVER STATE = START"
+
+SESSION_QUERY = """
+SELECT
+    es.name,
+    (SELECT TOP 1 t.name FROM sys.server_event_session_targets t
+     WHERE t.event_session_id = es.event_session_id) AS TargetName,
+    CASE WHEN xs.name IS NULL THEN 0 ELSE 1 END AS Running
+FROM sys.server_event_sessions es
+LEFT JOIN sys.dm_xe_sessions xs ON xs.name = es.name
+WHERE es.name = ?
+"""
+
+# Current file of the event_file target; earlier rollover files sit next to it
+EVENT_FILE_QUERY = """
+SELECT CAST(t.target_data AS xml).value('(EventFileTarget/File/@name)[1]', 'nvarchar(260)') AS FileName
+FROM sys.dm_xe_sessions s
+JOIN sys.dm_xe_session_targets t ON t.event_session_address = s.address
+WHERE s.name = ? AND t.target_name = 'event_file'
+"""
+
+# Events after the bookmark only (initial file name and offset both NULL: from the oldest file)
+READ_FILE_QUERY = """
+SELECT file_name, file_offset, event_data
+FROM sys.fn_xe_file_target_read_file(?, NULL, ?, ?)
+"""
+
+RING_BUFFER_QUERY = """
+SELECT CAST(t.target_data AS nvarchar(max)) AS TargetData
+FROM sys.dm_xe_sessions s
+JOIN sys.dm_xe_session_targets t ON t.event_session_address = s.address
+WHERE s.name = ? AND t.target_name = 'ring_buffer'
+"""
+
+XeEvent = namedtuple('XeEvent', [
+    'name', 'timestamp', 'session_id', 'database', 'duration_sec', 'result', 'statement',
+    'client_app', 'client_host', 'query_hash'
+])
+
+# kind: attention (command timeout or cancel, with the aborted call when it was captured),
+# aborted (an aborted call without an attention, e.g. a killed session)
+XeTimeout = namedtuple('XeTimeout', [
+    'timestamp', 'session_id', 'database', 'duration_sec', 'kind', 'event', 'statement',
+    'client_app', 'client_host', 'query_hash'
+])
+
+class XeUnavailable(Exception):
+    """The event session does not exist and cannot be created, or cannot be read"""
+
+def session_ddl(database, target=TARGET):
+    """CREATE EVENT SESSION statement for the timeout session of one database"""
+    return CREATE_SESSION.format(session=SESSION_NAME, actions=ACTIONS, target=TARGETS[target],
+                                 database=database.replace("'", "''")).strip()
+
+def _local_time(text):
+    """XE timestamps are UTC (2025-11-12T08:00:00.123Z); the monitor log uses local time"""
+    base, _, fraction = text.rstrip("Z").split("+")[0].partition(".")
+    moment = datetime.strptime(base, "%Y-%m-%dT%H:%M:%S").replace(
+        microsecond=int((fraction + "000000")[:6]), tzinfo=timezone.utc)
+    return moment.astimezone().replace(tzinfo=None)
+
+def _message(error):
+    """Driver message without pyodbc's (state, message) tuple"""
+    return str(error.args[-1] if error.args else error)[:120]
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def parse_event(element):
+    """XeEvent from one <event> element"""
+    values = {}
+    for child in element:
+        name = child.get("name")
+        if name == "result":
+            values[name] = child.findtext("text") or child.findtext("value")
+        else:
+            values[name] = child.findtext("value")
+    duration = _int(values.get("duration"))
+    query_hash = _int(values.get("query_hash"))
+    return XeEvent(
+        name=element.get("name"),
+        timestamp=_local_time(element.get("timestamp")),
+        session_id=_int(values.get("session_id")),
+        database=values.get("database_name") or "",
+        duration_sec=duration / 1000000.0 if duration is not None else None,
+        result=values.get("result") or "",
+        statement=values.get("statement") or values.get("batch_text") or values.get("sql_text") or "",
+        client_app=values.get("client_app_name") or "",
+        client_host=values.get("client_hostname") or "",
+        query_hash=(query_hash % (1 << 64)).to_bytes(8, "big") if query_hash else None)
+
+def iter_events(chunks, parse=parse_event):
+    """Parse <event> elements from XML text chunks as they arrive; each is dropped once parsed.
+
+    parse turns an element into an event with a timestamp, or None to skip it.
+    """
+    parser = ElementTree.XMLPullParser(events=("start", "end"))
+    root = None
+    for chunk in chunks:
+        parser.feed(chunk)
+        for kind, element in parser.read_events():
+            if kind == "start":
+                if root is None:
+                    root = element
+            elif element.tag == "event":
+                event = parse(element)
+                if event is not None:
+                    yield event
+                root.clear()  # events are children of the root; keep memory flat
+    parser.close()
+
+def match_timeouts(events, pending=()):
+    """(timeouts, unmatched attentions) from events in time order.
+
+    An attention is merged with the aborted completion of the same session within
+    MATCH_SECONDS. Attentions without one are returned so the next poll can still match them.
+    """
+    attentions = list(pending)
+    timeouts = []
+    for event in events:
+        if event.name == "attention":
+            attentions.append(event)
+            continue
+        match = next((a for a in attentions if a.session_id == event.session_id
+                      and abs((event.timestamp - a.timestamp).total_seconds()) <= MATCH_SECONDS), None)
+        if match is not None:
+            attentions.remove(match)
+        timeouts.append(XeTimeout(
+            event.timestamp, event.session_id, event.database, event.duration_sec,
+            "attention" if match else "aborted", event.name, event.statement or (match.statement if match else ""),
+            event.client_app, event.client_host, event.query_hash or (match.query_hash if match else None)))
+    return timeouts, attentions
+
+def attention_timeout(event):
+    return XeTimeout(event.timestamp, event.session_id, event.database, event.duration_sec, "attention",
+                     event.name, event.statement, event.client_app, event.client_host, event.query_hash)
+
+def load_bookmarks(path=BOOKMARK_FILE):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+_bookmark_lock = threading.Lock()
+
+def save_bookmark(key, bookmark, path=BOOKMARK_FILE):
+    """Store one server's bookmark; every monitored server shares the file"""
+    with _bookmark_lock:
+        bookmarks = load_bookmarks(path)
+        bookmarks[key] = bookmark
+        try:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "w") as f:
+                json.dump(bookmarks, f, indent=2)
+            os.replace(tmp, path)
+        except OSError:
+            pass  # the next run re-reads INITIAL_MINUTES of events
+
+class XeSessionReader:
+    """Incremental reader of one server's event session: events after a bookmark, oldest first.
+
+    Subclasses set the session, the queries reading its targets and the event parser.
+    """
+
+    session = SESSION_NAME
+    read_file_query = READ_FILE_QUERY
+    ring_buffer_query = RING_BUFFER_QUERY
+    initial_minutes = INITIAL_MINUTES
+    parse = staticmethod(parse_event)
+
+    def __init__(self, server, target=TARGET, bookmark_file=BOOKMARK_FILE):
+        self.server = server
+        self.target = target
+        self.bookmark_file = bookmark_file
+        self.key = f"{server.lower()}/{self.session}"
+        self.bookmark = load_bookmarks(bookmark_file).get(self.key)
+        self.file_pattern = None
+        self.ready = False  # cleared when the session turns out not to be running
+        self.events_read = 0
+
+    def read(self, conn):
+        """Events since the previous read, by this or any other process sharing the bookmark file"""
+        self._reload_bookmark()
+        if self.target == "event_file":
+            return self._read_file(conn)
+        return self._read_ring_buffer(conn)
+
+    def _reload_bookmark(self):
+        """Continue from the stored bookmark when another process (a health check next to the
+        monitor) has read further than this reader"""
+        with _bookmark_lock:
+            stored = load_bookmarks(self.bookmark_file).get(self.key)
+        if stored and (not self.bookmark or stored.get("timestamp", "") >= self.bookmark.get("timestamp", "")):
+            self.bookmark = stored
+
+    def _since(self):
+        """Oldest event time still wanted, as a local datetime"""
+        if self.bookmark and self.bookmark.get("timestamp"):
+            return datetime.fromisoformat(self.bookmark["timestamp"])
+        return datetime.now() - timedelta(minutes=self.initial_minutes)
+
+    def _file_pattern(self, conn):
+        if self.file_pattern is None:
+            cursor = conn.cursor()
+            cursor.execute(EVENT_FILE_QUERY, self.session)
+            row = cursor.fetchone()
+            if row is None or not row.FileName:
+                self.ready = False
+                raise XeUnavailable(f"event session {self.session} is not running")
+            self.file_pattern = ntpath.join(ntpath.dirname(row.FileName), f"{self.session}*.xel")
+        return self.file_pattern
+
+    def _file_rows(self, cursor, state):
+        """event_data strings in fetch batches, noting the last file and offset read.
+
+        Rows the query blanks (events of no interest) still move the position.
+        """
+        yield "<events>"
+        while True:
+            rows = cursor.fetchmany(FETCH_ROWS)
+            if not rows:
+                break
+            for row in rows:
+                state["file"], state["offset"] = row.file_name, row.file_offset
+                if row.event_data is not None:
+                    yield row.event_data
+        yield "</events>"
+
+    def _read_file(self, conn):
+        pattern = self._file_pattern(conn)
+        bookmark = self.bookmark or {}
+        cursor = conn.cursor()
+        try:
+            cursor.execute(self.read_file_query, pattern, bookmark.get("file"), bookmark.get("offset"))
+        except Exception as e:
+            if not bookmark.get("file"):
+                raise
+            # The bookmarked file rolled over and was deleted: read what is left, skipping by time
+            print(f"⚠ Event file {bookmark['file']} is gone ({_message(e)}); re-reading from the oldest file")
+            bookmark = dict(bookmark, file=None, offset=None)
+            cursor.execute(self.read_file_query, pattern, None, None)
+        since = self._since()
+        state = {"file": bookmark.get("file"), "offset": bookmark.get("offset")}
+        events = []
+        for event in iter_events(self._file_rows(cursor, state), self.parse):
+            self.events_read += 1
+            if bookmark.get("file") is None and event.timestamp <= since:
+                continue
+            events.append(event)
+        if state["file"] is not None:
+            self.bookmark = {"file": state["file"], "offset": state["offset"],
+                             "timestamp": max([e.timestamp for e in events] + [since]).isoformat()}
+            save_bookmark(self.key, self.bookmark, self.bookmark_file)
+        return events
+
+    def _read_ring_buffer(self, conn):
+        cursor = conn.cursor()
+        cursor.execute(self.ring_buffer_query, self.session)
+        row = cursor.fetchone()
+        if row is None:
+            self.ready = False
+            raise XeUnavailable(f"event session {self.session} is not running")
+        data = row.TargetData or ""
+        # The ring buffer has no offsets: skip by timestamp, and by count within the last timestamp
+        since = self._since()
+        seen = (self.bookmark or {}).get("at_timestamp", 0)
+        events = []
+        chunks = (data[i:i + RING_BUFFER_CHUNK] for i in range(0, len(data), RING_BUFFER_CHUNK))
+        for event in iter_events(chunks, self.parse):
+            self.events_read += 1
+            if event.timestamp < since:
+                continue
+            if event.timestamp == since and seen:
+                seen -= 1
+                continue
+            events.append(event)
+        if events:
+            last = events[-1].timestamp
+            at_last = sum(1 for e in events if e.timestamp == last)
+            if self.bookmark and last == since:
+                at_last += self.bookmark.get("at_timestamp", 0)
+            self.bookmark = {"timestamp": last.isoformat(), "at_timestamp": at_last}
+            save_bookmark(self.key, self.bookmark, self.bookmark_file)
+        return events
+
+class XeTimeoutReader(XeSessionReader):
+    """Incremental reader of one server's timeout session"""
+
+    def __init__(self, server, database, target=TARGET, create=True, bookmark_file=BOOKMARK_FILE):
+        super().__init__(server, target, bookmark_file)
+        self.database = database
+        self.create = create
+        self.pending = []  # attentions waiting for their aborted completion
+
+    def ensure_session(self, conn):
+        """Create and start the session when needed; raises XeUnavailable"""
+        cursor = conn.cursor()
+        try:
+            cursor.execute(SESSION_QUERY, SESSION_NAME)
+            session = cursor.fetchone()
+        except Exception as e:
+            raise XeUnavailable(f"cannot read event sessions: {_message(e)}")
+        if session is not None:
+            self.target = session.TargetName or self.target
+        if session is None or not session.Running:
+            if session is None and not self.create:
+                raise XeUnavailable(f"event session {SESSION_NAME} does not exist")
+            # Event session DDL cannot run inside a transaction
+            autocommit = conn.autocommit
+            conn.autocommit = True
+            try:
+                if session is None:
+                    cursor.execute(session_ddl(self.database, self.target))
+                    print(f"✓ Created event session {SESSION_NAME} ({self.target}) for {self.database}")
+                cursor.execute(START_SESSION.format(session=SESSION_NAME))
+            except Exception as e:
+                self.create = False  # later polls only look for a session a DBA created
+                raise XeUnavailable(f"cannot create or start event session {SESSION_NAME} "
+                                    f"(needs ALTER ANY EVENT SESSION): {_message(e)}")
+            finally:
+                conn.autocommit = autocommit
+        if self.target not in TARGETS:
+            raise XeUnavailable(f"event session {SESSION_NAME} has an unsupported target {self.target}")
+        self.ready = True
+
+    def poll(self, conn):
+        """Timeouts since the previous poll, oldest first"""
+        if not self.ready:
+            self.ensure_session(conn)
+        events = self.read(conn)
+        timeouts, attentions = match_timeouts(events, self.pending)
+        # Attentions still unmatched a poll later stand alone; new ones wait one poll for their completion
+        timeouts.extend(attention_timeout(a) for a in attentions if a in self.pending)
+        self.pending = [a for a in attentions if a not in self.pending]
+        timeouts.sort(key=lambda t: t.timestamp)
+        return timeouts
+
+def main():
+    parser = argparse.ArgumentParser(description='Print the Extended Events session DDL for the timeout collector')
+    parser.add_argument('--database', default='PaperlessEnvironments', help='database whose timeouts are captured')
+    parser.add_argument('--target', choices=sorted(TARGETS), default=TARGET, help=f'session target (default: {TARGET})')
+    args = parser.parse_args()
+    print(f"{session_ddl(args.database, args.target)};\nGO\n{START_SESSION.format(session=SESSION_NAME)};\nGO")
+
+if __name__ == "__main__":
+    main()